@@ -0,0 +1,122 @@
+"""
+Benchmark de throughput de AIService con un backend de Gemini simulado.
+
+Mide cuántos turnos por segundo completa un solo proceso cuando varias
+conversaciones están en curso a la vez, variando el límite de concurrencia,
+con la cache de contexto (system prompt + herramientas en cachedContents) y
+sin ella. La llamada que usa la cache envía solo la conversación.
+
+Uso:
+    python benchmarks/bench_ai_concurrency.py [--turns 64] [--latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from google.genai import types
+
+import src.ai as ai_module
+from src.ai import AIService, TOOLS
+
+
+# Tokens simulados del system prompt + herramientas y de la conversación
+_CONTEXT_TOKENS = 3000
+_CONVERSATION_TOKENS = 200
+
+
+class _FakeModels:
+    def __init__(self, latency):
+        self.latency = latency
+        self.cached_calls = 0
+        self.inline_calls = 0
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.latency)
+        cached = config is not None and config.cached_content is not None
+        if cached:
+            self.cached_calls += 1
+        else:
+            self.inline_calls += 1
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="OK")]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=_CONTEXT_TOKENS + _CONVERSATION_TOKENS,
+                cached_content_token_count=_CONTEXT_TOKENS if cached else None,
+            ),
+        )
+
+    async def count_tokens(self, model, contents):
+        return types.CountTokensResponse(total_tokens=_CONVERSATION_TOKENS)
+
+
+class _FakeCaches:
+    def __init__(self, latency):
+        self.latency = latency
+        self._entries = {}
+
+    async def create(self, model, config=None):
+        await asyncio.sleep(self.latency)
+        name = f"cachedContents/bench-{len(self._entries)}"
+        self._entries[name] = types.CachedContent(name=name, model=model)
+        return self._entries[name]
+
+    async def get(self, name, config=None):
+        return self._entries[name]
+
+    async def update(self, name, config=None):
+        return self._entries[name]
+
+    async def delete(self, name, config=None):
+        self._entries.pop(name, None)
+
+
+class _FakeClient:
+    def __init__(self, latency):
+        self.models = _FakeModels(latency)
+        self.aio = type("Aio", (), {"models": self.models, "caches": _FakeCaches(latency)})()
+
+
+async def _run(turns, concurrency, context_cache):
+    service = AIService(max_concurrency=concurrency, timeout=30)
+    service._context_cache.enabled = context_cache
+    messages = [{"role": "user", "content": "¿Qué eventos tengo mañana?"}]
+
+    async def turn():
+        # Un turno con herramientas hace dos llamadas a Gemini
+        await service.get_agent_response(messages, TOOLS)
+        await service.get_agent_response(messages, TOOLS)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(turn() for _ in range(turns)))
+    elapsed = time.perf_counter() - start
+    stats = service._context_cache.stats()
+    await service.close()
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=64)
+    parser.add_argument("--latency", type=float, default=0.2, help="latencia simulada por llamada (s)")
+    args = parser.parse_args()
+
+    print(f"{args.turns} turnos, 2 llamadas por turno, latencia simulada {args.latency}s")
+    print(f"{'cache':>9} {'concurrencia':>12} {'tiempo (s)':>11} {'turnos/s':>9} "
+          f"{'con cache':>10} {'sin cache':>10} {'tokens en cache':>16}")
+    for context_cache in (False, True):
+        for concurrency in (1, 4, 16, 64):
+            fake = ai_module.client = _FakeClient(args.latency)
+            elapsed, stats = asyncio.run(_run(args.turns, concurrency, context_cache))
+            label = "activa" if context_cache else "apagada"
+            share = stats["cached_tokens"] / stats["prompt_tokens"] if stats["prompt_tokens"] else 0.0
+            print(f"{label:>9} {concurrency:>12} {elapsed:>11.2f} {args.turns / elapsed:>9.1f} "
+                  f"{fake.models.cached_calls // 2:>10} {fake.models.inline_calls // 2:>10} {share:>16.0%}")
+
+
+if __name__ == "__main__":
+    main()
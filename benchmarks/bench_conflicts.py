@@ -0,0 +1,76 @@
+"""
+Benchmark de consultas de solapamiento con IntervalIndex.
+
+Genera calendarios con decenas de miles de eventos (duraciones variadas y
+algunos de varios días) y compara la búsqueda de conflictos del índice con un
+recorrido lineal de todos los eventos, verificando que ambos coincidan.
+
+Uso:
+    python benchmarks/bench_conflicts.py [--sizes 10000,50000,100000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.conflicts import IntervalIndex
+
+
+def _calendar(size, rng):
+    base = datetime(2030, 1, 1)
+    span_minutes = size * 90  # densidad parecida a una agenda muy ocupada
+    events = []
+    for n in range(size):
+        start = base + timedelta(minutes=rng.randrange(span_minutes))
+        if rng.random() < 0.01:
+            duration = timedelta(days=rng.randint(1, 5))
+        else:
+            duration = timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120]))
+        events.append((start, start + duration, f"ev{n}"))
+    return events, base, span_minutes
+
+
+def _linear(events, start, end):
+    return sorted((s, item) for s, e, item in events if s < end and e > start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,50000,100000")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    print(f"{'eventos':>8} {'construcción':>13} {'índice':>12} {'lineal':>12}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        events, base, span_minutes = _calendar(size, rng)
+        queries = []
+        for _ in range(args.queries):
+            start = base + timedelta(minutes=rng.randrange(span_minutes))
+            queries.append((start, start + timedelta(hours=1)))
+
+        t0 = time.perf_counter()
+        index = IntervalIndex(events)
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        t0 = time.perf_counter()
+        indexed = [index.overlaps(s, e) for s, e in queries]
+        index_us = (time.perf_counter() - t0) / len(queries) * 1e6
+
+        linear_queries = queries[:200]
+        t0 = time.perf_counter()
+        linear = [_linear(events, s, e) for s, e in linear_queries]
+        linear_us = (time.perf_counter() - t0) / len(linear_queries) * 1e6
+
+        for got, expected in zip(indexed, linear):
+            assert sorted(got) == sorted(item for _, item in expected)
+
+        print(f"{size:>8} {build_ms:>10.1f} ms {index_us:>9.1f} µs {linear_us:>9.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
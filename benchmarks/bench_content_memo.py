@@ -0,0 +1,81 @@
+"""
+Benchmark de la conversión del historial al formato de Gemini.
+
+Simula turnos sobre un historial de 200 mensajes con resultados grandes de
+list_appointments: en cada turno se agregan los mensajes nuevos (user,
+assistant con tool_calls, tool, assistant) y la ventana se desliza. Compara
+convertir todo el historial en cada llamada con la conversión incremental
+por usuario (_ContentMemo), que solo convierte los mensajes nuevos, y
+verifica que ambas den el mismo resultado.
+
+Uso:
+    python benchmarks/bench_content_memo.py [--messages 200] [--events 50] [--turns 50]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.ai import _ContentMemo, _convert_messages_to_gemini
+
+
+def _turn(n, listing):
+    call_id = f"call_list_appointments_{n}"
+    return [
+        {"role": "user", "content": f"¿Qué tengo la semana {n}?"},
+        {"role": "assistant", "content": "", "tool_calls": [
+            {"id": call_id, "type": "function",
+             "function": {"name": "list_appointments", "arguments": json.dumps({"time_min": f"2030-01-{n % 28 + 1:02d}"})}}
+        ]},
+        {"role": "tool", "content": listing, "tool_call_id": call_id, "name": "list_appointments"},
+        {"role": "assistant", "content": f"Esta semana tienes {n} reuniones."},
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200, help="mensajes en la ventana")
+    parser.add_argument("--events", type=int, default=50, help="eventos en cada resultado de list_appointments")
+    parser.add_argument("--turns", type=int, default=50)
+    args = parser.parse_args()
+
+    listing = json.dumps([
+        {"id": f"ev{i}", "summary": f"Reunión de seguimiento {i}", "start": "2030-01-01T10:00:00-05:00",
+         "end": "2030-01-01T11:00:00-05:00", "attendees": ["ana@example.com", "luis@example.com"],
+         "hangoutLink": f"https://meet.google.com/abc-{i}"}
+        for i in range(args.events)
+    ])
+    history = []
+    for n in range(args.messages // 4):
+        history.extend(_turn(n, listing))
+
+    memo = _ContentMemo()
+    _convert_messages_to_gemini(history[-args.messages:], memo=memo)
+
+    full_total = incremental_total = 0.0
+    for n in range(args.messages // 4, args.messages // 4 + args.turns):
+        history.extend(_turn(n, listing))
+        window = history[-args.messages:]
+
+        start = time.perf_counter()
+        full = _convert_messages_to_gemini(window)
+        full_total += time.perf_counter() - start
+
+        start = time.perf_counter()
+        incremental = _convert_messages_to_gemini(window, memo=memo)
+        incremental_total += time.perf_counter() - start
+
+        assert [c.model_dump() for c in full] == [c.model_dump() for c in incremental]
+
+    print(f"{args.messages} mensajes, tool results de {len(listing) // 1024} KB, {args.turns} turnos")
+    print(f"conversión completa     {full_total / args.turns * 1000:8.2f} ms/llamada")
+    print(f"conversión incremental  {incremental_total / args.turns * 1000:8.2f} ms/llamada "
+          f"({memo.hits} unidades reutilizadas, {memo.misses} convertidas)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark de la cache de contexto de Gemini (system prompt + herramientas).
+
+Usa un doble local de la API (models + caches) que cobra como tokens de
+entrada todo lo que se envía en línea, y compara los tokens enviados por
+llamada con y sin cache de contexto para muchos usuarios. También verifica
+los casos de error: la entrada se comparte entre usuarios, una entrada
+rechazada por Gemini se recrea y, si la API de caching no está disponible,
+las llamadas siguen funcionando con el prompt en línea.
+
+Uso:
+    python benchmarks/bench_context_cache.py [--users 50] [--turns 4]
+"""
+import argparse
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import errors, types
+
+import src.ai as ai
+
+
+def _tokens(value) -> int:
+    return len(str(value)) // 4
+
+
+class _FakeCaches:
+    def __init__(self, available=True):
+        self.available = available
+        self.entries = {}
+        self.created = 0
+
+    async def create(self, model, config):
+        if not self.available:
+            raise errors.ClientError(400, {"error": {"message": "Cached content is too small", "status": "INVALID_ARGUMENT"}})
+        self.created += 1
+        name = f"cachedContents/{self.created}"
+        self.entries[name] = _tokens(config.system_instruction) + _tokens(config.tools)
+        return types.CachedContent(name=name, model=model)
+
+    async def update(self, name, config):
+        return types.CachedContent(name=name)
+
+    async def delete(self, name):
+        self.entries.pop(name, None)
+
+
+class _FakeModels:
+    def __init__(self, caches):
+        self.caches = caches
+        self.inline_tokens = 0
+        self.calls = 0
+
+    async def generate_content(self, model, contents, config):
+        self.calls += 1
+        cached = 0
+        if config.cached_content:
+            if config.cached_content not in self.caches.entries:
+                raise errors.ClientError(404, {"error": {"message": "CachedContent not found", "status": "NOT_FOUND"}})
+            cached = self.caches.entries[config.cached_content]
+        else:
+            self.inline_tokens += _tokens(config.system_instruction) + _tokens(config.tools)
+        prompt = _tokens(contents)
+        self.inline_tokens += prompt
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text="ok")]))],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt + cached, cached_content_token_count=cached or None
+            ),
+        )
+
+
+def _client(available=True):
+    caches = _FakeCaches(available)
+    models = _FakeModels(caches)
+    return SimpleNamespace(aio=SimpleNamespace(models=models, caches=caches)), models, caches
+
+
+async def _run_users(service, users, turns):
+    for turn in range(turns):
+        for user in range(users):
+            messages = [{"role": "user", "content": f"Usuario {user}: agenda una reunión el día {turn + 1}"}]
+            response = await service.get_agent_response(messages, ai.TOOLS)
+            assert response.content == "ok"
+
+
+async def _main(args):
+    results = {}
+    for label, enabled in (("sin cache", False), ("con cache", True)):
+        ai.client, models, caches = _client()
+        service = ai.AIService()
+        service._context_cache = ai.ContextCache(ai.client, enabled=enabled)
+        await _run_users(service, args.users, args.turns)
+        results[label] = models.inline_tokens / models.calls
+        if enabled:
+            # Una sola entrada compartida por todos los usuarios
+            assert caches.created == 1, caches.created
+
+            # Gemini borró la entrada: se descarta, se reintenta en línea y la siguiente llamada crea otra
+            caches.entries.clear()
+            await _run_users(service, 1, 1)
+            await _run_users(service, 1, 1)
+            assert caches.created == 2, caches.created
+            await service.close()
+            assert not caches.entries
+            print(f"stats: {service.stats()['context_cache']}")
+
+    # API de caching no disponible: todo sigue funcionando con el prompt en línea
+    ai.client, models, caches = _client(available=False)
+    service = ai.AIService()
+    service._context_cache = ai.ContextCache(ai.client, enabled=True)
+    await _run_users(service, 3, 1)
+    assert service.stats()["context_cache"]["failures"] == 1
+
+    print(f"{args.users} usuarios x {args.turns} turnos")
+    for label, tokens in results.items():
+        print(f"{label:10} {tokens:8.0f} tokens de entrada no cacheados por llamada")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
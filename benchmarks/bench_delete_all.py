@@ -0,0 +1,141 @@
+"""
+Benchmark de CalendarService.delete_all_events contra un servidor local.
+
+El servidor imita events.list (paginado con nextPageToken), events.delete y el
+endpoint batch de Google. Se compara borrar evento por evento (un request por
+cita, como antes) con la versión paginada + batch. Algunos ids ya no existen
+en el servidor para ejercitar el manejo de 404 por ítem. --rtt agrega una
+demora por request para simular la ida y vuelta a Google.
+
+Uso:
+    python benchmarks/bench_delete_all.py [--events 500] [--rtt 0.03]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+
+from src.calendar_api import CalendarService
+from src.google_clients import GoogleServicePool
+
+
+class _FakeCalendar:
+    def __init__(self):
+        self.rtt = 0.0
+        self.events = []
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def reset(self, count, missing=0):
+        self.events = [f"ev{i:05d}" for i in range(count)]
+        # Ids que se listan pero ya fueron borrados por otro cliente (404)
+        self.gone = set(self.events[:missing])
+        self.requests = 0
+
+    def delete(self, event_id):
+        with self.lock:
+            if event_id in self.gone or event_id not in self.events:
+                return 404
+            self.events.remove(event_id)
+            return 204
+
+
+CALENDAR = _FakeCalendar()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, body=b"", content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        CALENDAR.requests += 1
+        time.sleep(CALENDAR.rtt)
+        query = parse_qs(urlparse(self.path).query)
+        size = int(query.get("maxResults", ["10"])[0])
+        offset = int(query.get("pageToken", ["0"])[0])
+        items = CALENDAR.events[offset:offset + size]
+        page = {"items": [{"id": event_id} for event_id in items]}
+        if offset + size < len(CALENDAR.events):
+            page["nextPageToken"] = str(offset + size)
+        self._reply(200, json.dumps(page).encode())
+
+    def do_DELETE(self):
+        CALENDAR.requests += 1
+        time.sleep(CALENDAR.rtt)
+        status = CALENDAR.delete(urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1])
+        self._reply(status, b"" if status == 204 else b'{"error": {"code": 404, "message": "Not Found"}}')
+
+    def do_POST(self):
+        CALENDAR.requests += 1
+        time.sleep(CALENDAR.rtt)
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        boundary = "batch_response"
+        parts = []
+        for content_id, event_id in re.findall(r"Content-ID: <([^>]+)>.*?DELETE \S*/events/(\S+) HTTP", body, re.S):
+            status = CALENDAR.delete(event_id)
+            reason = "No Content" if status == 204 else "Not Found"
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\nContent-Length: 0\r\n\r\n\r\n"
+            )
+        payload = "".join(parts) + f"--{boundary}--\r\n"
+        self._reply(200, payload.encode(), content_type=f"multipart/mixed; boundary={boundary}")
+
+    def log_message(self, *args):
+        pass
+
+
+def _one_by_one(calendar):
+    # Flujo anterior, pero recorriendo todas las páginas: un DELETE por evento
+    for event_id in calendar.list_future_event_ids():
+        calendar.delete_event(event_id)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=500)
+    parser.add_argument("--rtt", type=float, default=0.03, help="latencia simulada por request (s)")
+    args = parser.parse_args()
+    CALENDAR.rtt = args.rtt
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    creds = Credentials(token="benchmark")
+    pool = GoogleServicePool(client_options={"api_endpoint": url})
+    calendar = pool.services("bench-user", creds).get("calendar")
+    assert isinstance(calendar, CalendarService)
+
+    for label, run in (("uno por uno", lambda: _one_by_one(calendar)),
+                       ("paginado + batch", calendar.delete_all_events)):
+        CALENDAR.reset(args.events, missing=5)
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        remaining = len(CALENDAR.events) - len(CALENDAR.gone)
+        extra = f", {len(result)} ids devueltos" if result is not None else ""
+        print(f"{label:<18} {elapsed * 1000:8.1f} ms  {CALENDAR.requests:4d} requests  pendientes: {remaining}{extra}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Benchmark de la respuesta del event loop con muchos turnos simultáneos que usan la DB.
+
+Lanza a la vez varios turnos por ronda; cada uno lee la ventana de historial
+(sin cache), espera a un "Gemini" simulado, lista eventos de la copia local del
+calendario y guarda los mensajes del turno. Mientras tanto una tarea aparte
+pide despertarse cada --tick-ms y mide con cuánto retraso lo logra: ese retraso
+es lo que esperan el webhook, las ediciones del streaming y los recordatorios.
+
+Compara el acceso anterior (sesiones síncronas dentro de los handlers, que
+bloquean el loop durante cada consulta y cada espera por el lock de SQLite)
+con el actual (AsyncSessionLocal sobre aiosqlite).
+
+Uso:
+    python benchmarks/bench_event_loop_lag.py [--users 64] [--rows 2000] [--rounds 3] [--gemini-ms 50]
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import src.database as database
+import src.history_manager as history_manager
+from src.calendar_sync import CalendarSync
+from src.database import Base, AsyncSessionLocal, SessionLocal, CalendarEvent, ConversationHistory, HISTORY_SCHEMA_VERSION
+from src.history_manager import HistoryManager
+from src.unit_of_work import TurnUnitOfWork
+
+
+def _populate(engine, users, rows_per_user, events):
+    base = datetime(2024, 1, 1)
+    listing = [{"id": f"ev{i}", "summary": f"Reunión {i}", "start": "2030-01-01T10:00:00-05:00"} for i in range(events)]
+    tool_calls = [{"id": "call_list_appointments_0", "name": "list_appointments", "arguments": {}}]
+    now = datetime.utcnow()
+    with engine.begin() as conn:
+        for user in range(users):
+            rows = []
+            for i in range(rows_per_user):
+                row = {"telegram_id": str(user), "created_at": base + timedelta(seconds=i),
+                       "schema_version": HISTORY_SCHEMA_VERSION, "tool_calls": None, "tool_result": None,
+                       "tool_call_id": None, "name": None}
+                kind = i % 4
+                if kind == 0:
+                    row.update(role="user", content=f"Mensaje {i}")
+                elif kind == 1:
+                    row.update(role="assistant", content="", tool_calls=tool_calls)
+                elif kind == 2:
+                    row.update(role="tool", content="", tool_result=listing,
+                               tool_call_id="call_list_appointments_0", name="list_appointments")
+                else:
+                    row.update(role="assistant", content=f"Respuesta {i}")
+                rows.append(row)
+            conn.execute(insert(ConversationHistory), rows)
+            conn.execute(insert(CalendarEvent), [
+                {"telegram_id": str(user), "event_id": f"{user}-{n}", "summary": f"Evento {n}",
+                 "start_time": now + timedelta(hours=n), "end_time": now + timedelta(hours=n + 1), "all_day": False}
+                for n in range(events)
+            ])
+
+
+def _turn_messages(user_id, n):
+    return [
+        ("user", f"¿Qué tengo mañana? ({n})", None, None),
+        ("assistant", {"role": "assistant", "content": "", "tool_calls": [
+            {"id": "call_list_appointments_0", "type": "function",
+             "function": {"name": "list_appointments", "arguments": "{}"}}]}, None, None),
+        ("tool", json.dumps([{"id": "ev0", "summary": "Evento 0"}]), "call_list_appointments_0", "list_appointments"),
+        ("assistant", "Mañana tienes un evento.", None, None),
+    ]
+
+
+async def _sync_turn(user_id, n, gemini_s):
+    """Turno con sesión síncrona: cada consulta y commit bloquea el event loop"""
+    db = SessionLocal()
+    try:
+        records = db.query(ConversationHistory).filter(
+            ConversationHistory.telegram_id == user_id
+        ).order_by(ConversationHistory.created_at.desc(), ConversationHistory.id.desc()).limit(60).all()
+        messages = [m for m in (HistoryManager._parse_record(r) for r in reversed(records)) if m is not None]
+        await asyncio.sleep(gemini_s)
+
+        db.query(CalendarEvent).filter(
+            CalendarEvent.telegram_id == user_id, CalendarEvent.end_time > datetime.utcnow()
+        ).order_by(CalendarEvent.start_time.asc()).limit(10).all()
+        await asyncio.sleep(gemini_s)
+
+        db.add_all([HistoryManager.build_record(user_id, *msg) for msg in _turn_messages(user_id, n)])
+        db.commit()
+        return len(messages)
+    finally:
+        db.close()
+
+
+async def _async_turn(user_id, n, gemini_s):
+    """Turno actual: TurnUnitOfWork y lecturas sobre AsyncSessionLocal"""
+    history_manager._cache.invalidate(user_id)
+    async with TurnUnitOfWork(user_id) as uow:
+        messages = await HistoryManager.get_user_history(user_id)
+        await asyncio.sleep(gemini_s)
+
+        await CalendarSync.list_events(user_id, datetime.utcnow(), db=uow.db)
+        await asyncio.sleep(gemini_s)
+
+        for msg in _turn_messages(user_id, n):
+            uow.add_message(*msg)
+        return len(messages)
+
+
+async def _measure(turn, users, rounds, gemini_s, tick_s):
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + tick_s
+            await asyncio.sleep(tick_s)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(tick_s * 2)
+    start = time.perf_counter()
+    for n in range(rounds):
+        await asyncio.gather(*(turn(str(user), n, gemini_s) for user in range(users)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "p50": statistics.median(lags) * 1000,
+        "p99": lags[int(len(lags) * 0.99) - 1] * 1000,
+        "max": lags[-1] * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=64, help="turnos simultáneos por ronda")
+    parser.add_argument("--rows", type=int, default=2000, help="mensajes de historial por usuario")
+    parser.add_argument("--events", type=int, default=20, help="eventos por resultado de list_appointments")
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--gemini-ms", type=float, default=50)
+    parser.add_argument("--tick-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, turn in (("sesión síncrona", _sync_turn), ("AsyncSession", _async_turn)):
+            db_path = os.path.join(tmp, f"{len(results)}.db")
+            # Mismo tamaño de pool en los dos casos: cada turno tiene su conexión
+            engine = create_engine(f"sqlite:///{db_path}", json_serializer=database._json_serializer,
+                                   pool_size=args.users)
+            Base.metadata.create_all(bind=engine)
+            _populate(engine, args.users, args.rows, args.events)
+            SessionLocal.configure(bind=engine)
+            AsyncSessionLocal.configure(bind=create_async_engine(
+                f"sqlite+aiosqlite:///{db_path}", json_serializer=database._json_serializer,
+                pool_size=args.users
+            ))
+            results[label] = asyncio.run(
+                _measure(turn, args.users, args.rounds, args.gemini_ms / 1000, args.tick_ms / 1000)
+            )
+
+    print(f"{args.users} turnos simultáneos x {args.rounds} rondas, historial de {args.rows} mensajes por usuario")
+    print(f"{'acceso':16} {'total (s)':>10} {'lag p50 (ms)':>13} {'lag p99 (ms)':>13} {'lag máx (ms)':>13}")
+    for label, r in results.items():
+        print(f"{label:16} {r['elapsed']:>10.2f} {r['p50']:>13.2f} {r['p99']:>13.2f} {r['max']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
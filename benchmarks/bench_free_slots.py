@@ -0,0 +1,74 @@
+"""
+Benchmark del cálculo de horarios libres de find_free_slots.
+
+Genera los bloques ocupados que devolvería freebusy para el usuario y varios
+invitados durante un mes y compara la unión vectorizada con NumPy
+(src.free_slots.merge_busy) contra una unión equivalente en Python puro.
+También mide el cálculo completo de propuestas.
+
+Uso:
+    python benchmarks/bench_free_slots.py [--blocks 600] [--repeat 50]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from src.free_slots import find_free_slots, merge_busy
+
+
+def _python_merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def _timed(repeat, fn):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=600, help="bloques ocupados (usuario + invitados)")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    window_start = datetime(2030, 1, 7, tzinfo=timezone.utc)
+    window_end = window_start + timedelta(days=30)
+    busy = []
+    for _ in range(args.blocks):
+        start = window_start + timedelta(minutes=15 * rng.randrange(30 * 24 * 4))
+        busy.append((start, start + timedelta(minutes=rng.choice([15, 30, 60, 90]))))
+
+    starts = np.array([int(s.timestamp()) for s, _ in busy], dtype=np.int64)
+    ends = np.array([int(e.timestamp()) for _, e in busy], dtype=np.int64)
+    pairs = list(zip(starts.tolist(), ends.tolist()))
+
+    numpy_ms, (merged_starts, merged_ends) = _timed(args.repeat, lambda: merge_busy(starts, ends))
+    python_ms, merged = _timed(args.repeat, lambda: _python_merge(pairs))
+    assert merged == [[s, e] for s, e in zip(merged_starts.tolist(), merged_ends.tolist())]
+
+    total_ms, slots = _timed(args.repeat, lambda: find_free_slots(busy, window_start, window_end, timedelta(hours=1)))
+
+    print(f"{args.blocks} bloques ocupados -> {len(merged)} bloques unidos")
+    print(f"unión NumPy          {numpy_ms:8.3f} ms")
+    print(f"unión Python         {python_ms:8.3f} ms")
+    print(f"find_free_slots      {total_ms:8.3f} ms  ({len(slots)} propuestas)")
+
+
+if __name__ == "__main__":
+    main()
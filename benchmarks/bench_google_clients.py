@@ -0,0 +1,104 @@
+"""
+Benchmark del costo por turno de los clientes de Google.
+
+Compara el flujo anterior (build() de Calendar y Gmail en cada mensaje, con un
+transporte httplib2 nuevo) contra GoogleServicePool (clientes reutilizados,
+discovery parseado una vez y conexiones keep-alive). Las llamadas van a un
+servidor HTTP local que responde como la API de Calendar.
+
+Uso:
+    python benchmarks/bench_google_clients.py [--turns 300]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from src.calendar_api import CalendarService
+from src.google_clients import GoogleServicePool
+
+
+class _CalendarHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo salen en dos writes: sin esto el keep-alive pagaría
+    # Nagle + ACK retardado (~40 ms), cosa que un frontend real no hace
+    disable_nagle_algorithm = True
+    connections = set()
+
+    def do_GET(self):
+        _CalendarHandler.connections.add(self.client_address)
+        body = b'{"items": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _CalendarHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def _per_message_build(creds, client_options, with_tools):
+    # Como antes: ambos servicios se construían siempre, se usaran o no
+    calendar = CalendarService(
+        credentials=creds,
+        service=build("calendar", "v3", credentials=creds, client_options=client_options)
+    )
+    build("gmail", "v1", credentials=creds, client_options=client_options)
+    if with_tools:
+        calendar.list_events()
+
+
+def _pooled(pool, creds, with_tools):
+    services = pool.services("bench-user", creds)
+    if with_tools:
+        services.get("calendar").list_events()
+
+
+def _measure(label, turns, fn):
+    _CalendarHandler.connections.clear()
+    fn()  # calentamiento
+    start = time.perf_counter()
+    for _ in range(turns):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<36} {elapsed / turns * 1000:8.2f} ms/turno   conexiones TCP: {len(_CalendarHandler.connections)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=300)
+    args = parser.parse_args()
+
+    server, url = _start_server()
+    client_options = {"api_endpoint": url}
+    creds = Credentials(token="benchmark")
+    pool = GoogleServicePool(client_options=client_options)
+
+    print(f"{args.turns} turnos contra {url}")
+    _measure("build() por mensaje, sin herramientas", args.turns,
+             lambda: _per_message_build(creds, client_options, with_tools=False))
+    _measure("pool, sin herramientas", args.turns, lambda: _pooled(pool, creds, with_tools=False))
+    _measure("build() por mensaje + list_events", args.turns,
+             lambda: _per_message_build(creds, client_options, with_tools=True))
+    _measure("pool + list_events", args.turns, lambda: _pooled(pool, creds, with_tools=True))
+    print(f"pool: {pool.stats()}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
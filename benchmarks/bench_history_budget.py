@@ -0,0 +1,86 @@
+"""
+Benchmark de la ventana de historial por presupuesto de tokens.
+
+Arma historiales con conversación corta y resultados grandes de
+list_appointments y compara, para cada uno, cuántos mensajes y tokens
+estimados envía la ventana anterior (últimos 15 mensajes) frente a la
+ventana por presupuesto (HistoryManager._select_window), y cuánto tarda
+calcularla.
+
+Uso:
+    python benchmarks/bench_history_budget.py [--budget 4000] [--repeat 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.history_manager import HistoryManager
+from src.token_budget import estimator
+
+
+def _legacy_window(messages, limit=15):
+    """Ventana anterior: últimos 'limit' mensajes, empezando en 'user'"""
+    window = messages[-limit:]
+    while window and window[0].get("role") != "user":
+        window.pop(0)
+    return window
+
+
+def _chat(turns):
+    messages = []
+    for n in range(turns):
+        messages.append({"role": "user", "content": f"Gracias, ¿y el día {n}?"})
+        messages.append({"role": "assistant", "content": "Ese día no tienes eventos."})
+    return messages
+
+
+def _tool_heavy(turns, events):
+    listing = json.dumps([
+        {"id": f"ev{i}", "summary": f"Reunión de seguimiento {i}", "start": "2030-01-01T10:00:00-05:00",
+         "end": "2030-01-01T11:00:00-05:00", "attendees": ["ana@example.com", "luis@example.com"]}
+        for i in range(events)
+    ])
+    call = {"role": "assistant", "content": "", "tool_calls": [
+        {"id": "call_list_appointments_0", "type": "function",
+         "function": {"name": "list_appointments", "arguments": "{}"}}
+    ]}
+    messages = []
+    for _ in range(turns):
+        messages.append({"role": "user", "content": "¿Qué tengo esta semana?"})
+        messages.append(call)
+        messages.append({"role": "tool", "content": listing, "tool_call_id": "call_list_appointments_0",
+                         "name": "list_appointments"})
+        messages.append({"role": "assistant", "content": "Tienes estas reuniones esta semana: ..."})
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--budget", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    histories = {
+        "charla corta": _chat(30),
+        "list_appointments x20": _tool_heavy(15, 20),
+        "list_appointments x100": _tool_heavy(15, 100),
+    }
+    print(f"{'historial':24} {'15 mensajes':>20} {'presupuesto':>20} {'tiempo':>10}")
+    for label, messages in histories.items():
+        legacy = _legacy_window(messages)
+        budget = HistoryManager._select_window(messages, args.budget)
+        assert not budget or budget[0]["role"] == "user"
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            HistoryManager._select_window(messages, args.budget)
+        us = (time.perf_counter() - start) / args.repeat * 1e6
+        print(f"{label:24} {len(legacy):>4} msj {estimator.estimate(legacy):>7} tok "
+              f"{len(budget):>4} msj {estimator.estimate(budget):>7} tok {us:>7.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark del formato de almacenamiento del historial.
+
+Guarda la misma conversación (con tool_calls y resultados grandes de
+list_appointments) en el formato anterior (JSON dentro de 'content') y en
+el actual (columnas JSON tool_calls / tool_result), y compara el tamaño en
+disco de cada fila y el costo de leer la ventana: consulta, armado de los
+mensajes y conversión al formato de Gemini.
+
+Uso:
+    python benchmarks/bench_history_storage.py [--turns 500] [--events 20] [--repeat 50]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, text
+
+import src.database as database
+from src.ai import _convert_messages_to_gemini
+from src.database import Base, ConversationHistory, SessionLocal
+from src.history_manager import HistoryManager
+
+
+def _legacy_parse(rec):
+    """Lectura anterior: detectar JSON en 'content' y decodificarlo"""
+    content = rec.content or ""
+    if rec.role == "assistant" and content.startswith("{"):
+        content = json.loads(content)
+    return HistoryManager._to_message(rec.role, content, rec.tool_call_id, rec.name)
+
+
+def _legacy_row(msg, created_at):
+    content = json.dumps(msg) if msg.get("tool_calls") else msg["content"]
+    return {"telegram_id": "u", "role": msg["role"], "content": content, "tool_call_id": msg.get("tool_call_id"),
+            "name": msg.get("name"), "created_at": created_at}
+
+
+def _conversation(turns, events):
+    listing = json.dumps([
+        {"id": f"ev{i}", "summary": f"Reunión de revisión {i}", "start": "2030-01-01T10:00:00-05:00",
+         "attendees": ["ana@example.com"], "description": "Revisión del presupuesto del año próximo"}
+        for i in range(events)
+    ])
+    for n in range(turns):
+        call = {"id": "call_list_appointments_0", "type": "function",
+                "function": {"name": "list_appointments", "arguments": json.dumps({"time_min": "2030-01-01T00:00:00"})}}
+        yield {"role": "user", "content": f"¿Qué reuniones tengo la próxima semana? ({n})"}
+        yield {"role": "assistant", "content": "", "tool_calls": [call]}
+        yield {"role": "tool", "content": listing, "tool_call_id": "call_list_appointments_0", "name": "list_appointments"}
+        yield {"role": "assistant", "content": "Tienes varias reuniones de revisión."}
+
+
+def _measure(repeat, parse):
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            records = db.query(ConversationHistory).filter(ConversationHistory.telegram_id == "u").order_by(
+                ConversationHistory.created_at.desc(), ConversationHistory.id.desc()
+            ).limit(60).all()
+            records.reverse()
+            messages = [m for m in (parse(r) for r in records) if m is not None]
+            _convert_messages_to_gemini(messages)
+            db.expire_all()
+        return (time.perf_counter() - start) / repeat * 1000
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=500)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    base = datetime(2030, 1, 1)
+    messages = list(_conversation(args.turns, args.events))
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for label in ("anterior", "actual"):
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, label)}.db",
+                                   json_serializer=database._json_serializer)
+            Base.metadata.create_all(bind=engine)
+            SessionLocal.configure(bind=engine)
+            db = SessionLocal()
+            for i, msg in enumerate(messages):
+                created_at = base + timedelta(seconds=i)
+                if label == "anterior":
+                    db.add(ConversationHistory(**_legacy_row(msg, created_at), schema_version=1))
+                else:
+                    db.add(HistoryManager.build_record("u", msg["role"], msg if msg.get("tool_calls") else msg["content"],
+                                                       msg.get("tool_call_id"), msg.get("name"), created_at))
+            db.commit()
+            db.close()
+            with engine.connect() as conn:
+                row_bytes = conn.execute(text(
+                    "SELECT avg(length(coalesce(content, '')) + length(coalesce(tool_calls, ''))"
+                    " + length(coalesce(tool_result, ''))) FROM conversation_history"
+                )).scalar()
+            parse = _legacy_parse if label == "anterior" else HistoryManager._parse_record
+            results[label] = (row_bytes, _measure(args.repeat, parse))
+
+    print(f"{len(messages)} mensajes, resultados de list_appointments con {args.events} eventos")
+    print(f"{'formato':10} {'bytes/fila':>11} {'lectura de ventana':>19}")
+    for label, (row_bytes, ms) in results.items():
+        print(f"{label:10} {row_bytes:>11.0f} {ms:>16.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark de HistoryManager.get_user_history frente al tamaño del historial.
+
+Compara la lectura anterior (todas las filas del usuario, parseadas y luego
+recortadas a la ventana) con la consulta por ventana (ORDER BY ... DESC LIMIT)
+sobre el índice (telegram_id, created_at).
+
+Uso:
+    python benchmarks/bench_history_window.py [--sizes 1000,10000,100000]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database import Base, ConversationHistory, SessionLocal, AsyncSessionLocal, HISTORY_SCHEMA_VERSION
+from src.history_manager import HistoryManager
+
+
+def _legacy_get_user_history(user_id, limit=15):
+    """Implementación anterior: lee todo el historial y recorta en Python"""
+    db = SessionLocal()
+    try:
+        records = db.query(ConversationHistory).filter(
+            ConversationHistory.telegram_id == user_id
+        ).order_by(ConversationHistory.created_at.asc()).all()
+        messages = [m for m in (HistoryManager._parse_record(r) for r in records) if m is not None]
+        if len(messages) > limit:
+            messages = messages[-limit:]
+            while messages and messages[0].get("role") != "user":
+                messages.pop(0)
+        return messages
+    finally:
+        db.close()
+
+
+def _populate(engine, user_id, count):
+    base = datetime.datetime(2024, 1, 1)
+    tool_calls = [{"id": "call_list_appointments_0", "name": "list_appointments", "arguments": {}}]
+    rows = []
+    for i in range(count):
+        # Patrón de conversación: user, assistant(tool_calls), tool, assistant
+        kind = i % 4
+        row = {"telegram_id": user_id, "created_at": base + datetime.timedelta(seconds=i),
+               "schema_version": HISTORY_SCHEMA_VERSION, "tool_calls": None, "tool_result": None}
+        if kind == 0:
+            row.update(role="user", content=f"Mensaje {i}")
+        elif kind == 1:
+            row.update(role="assistant", content="", tool_calls=tool_calls)
+        elif kind == 2:
+            row.update(role="tool", content="", tool_result=[{"id": "abc", "summary": "Reunión"}],
+                       tool_call_id="call_list_appointments_0", name="list_appointments")
+        else:
+            row.update(role="assistant", content=f"Respuesta {i}")
+        rows.append(row)
+    with engine.begin() as conn:
+        conn.execute(insert(ConversationHistory), rows)
+
+
+def _time(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+async def _time_async(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,100000")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        SessionLocal.configure(bind=engine)
+        AsyncSessionLocal.configure(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.db"))
+
+        async def run():
+            print(f"{'mensajes':>9} {'anterior (ms)':>14} {'ventana (ms)':>13}")
+            for size in (int(x) for x in args.sizes.split(",")):
+                user_id = f"user_{size}"
+                _populate(engine, user_id, size)
+                legacy_repeat = max(1, min(args.repeat, 200000 // size))
+                legacy = _time(lambda: _legacy_get_user_history(user_id), legacy_repeat)
+                windowed = await _time_async(lambda: HistoryManager.get_user_history(user_id), args.repeat)
+                print(f"{size:>9} {legacy:>14.2f} {windowed:>13.2f}")
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
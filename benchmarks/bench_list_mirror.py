@@ -0,0 +1,106 @@
+"""
+Benchmark de list_appointments: copia local sincronizada vs. consulta a Google.
+
+Llena calendar_events con muchos usuarios y eventos, y mide la herramienta
+list_appointments cuando la copia está fresca (consulta indexada local) frente
+a la ruta anterior, que hacía un events.list a Google en cada llamada
+(simulado con una latencia fija).
+
+Uso:
+    python benchmarks/bench_list_mirror.py [--users 200] [--events 1000] [--latency 0.15]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database import Base, AsyncSessionLocal, CalendarEvent, CalendarSyncState
+from src.google_clients import run_google_io
+from src.tool_executor import ToolExecutor
+
+
+class _SlowCalendar:
+    calendar_id = "primary"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def list_events(self, time_min=None, max_results=10):
+        time.sleep(self.latency)
+        return [{"id": f"ev{i}", "summary": "Reunión", "start": {"dateTime": time_min}} for i in range(max_results)]
+
+    def sync_events(self, sync_token=None, time_min=None):
+        time.sleep(self.latency)
+        return [], sync_token or "token"
+
+
+def _seed(engine, users, events):
+    now = datetime.utcnow()
+    rows = []
+    for user in range(users):
+        for n in range(events):
+            start = now + timedelta(hours=n * 7 - events)
+            rows.append({
+                "telegram_id": str(user), "event_id": f"{user}-{n}", "summary": f"Evento {n}",
+                "start_time": start, "end_time": start + timedelta(hours=1), "all_day": False,
+            })
+    with engine.begin() as conn:
+        for i in range(0, len(rows), 10000):
+            conn.execute(insert(CalendarEvent), rows[i:i + 10000])
+        conn.execute(insert(CalendarSyncState), [
+            {"telegram_id": str(user), "calendar_id": "primary", "sync_token": "token", "last_synced_at": now}
+            for user in range(users)
+        ])
+
+
+async def _measure(calls, fn):
+    start = time.perf_counter()
+    for i in range(calls):
+        await fn(i)
+    return (time.perf_counter() - start) / calls * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--events", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.15, help="latencia simulada de events.list (s)")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        engine = create_engine(f"sqlite:///{db_path}")
+        Base.metadata.create_all(bind=engine)
+        AsyncSessionLocal.configure(bind=create_async_engine(f"sqlite+aiosqlite:///{db_path}"))
+        _seed(engine, args.users, args.events)
+        print(f"calendar_events: {args.users * args.events} filas")
+
+        calendar = _SlowCalendar(args.latency)
+        services = {"calendar": calendar}
+
+        async def from_google(i):
+            await run_google_io(calendar.list_events, datetime.utcnow().isoformat() + "Z")
+
+        async def from_mirror(i):
+            result = await ToolExecutor.execute("list_appointments", {}, str(i % args.users), services)
+            assert len(result) == 10, result
+
+        async def run():
+            return await _measure(min(args.calls, 10), from_google), await _measure(args.calls, from_mirror)
+
+        google_ms, mirror_ms = asyncio.run(run())
+        print(f"events.list a Google  {google_ms:8.2f} ms/llamada")
+        print(f"copia local           {mirror_ms:8.2f} ms/llamada")
+
+
+if __name__ == "__main__":
+    main()
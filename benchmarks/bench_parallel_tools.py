@@ -0,0 +1,121 @@
+"""
+Benchmark de un turno con varias herramientas.
+
+Simula servicios de Calendar y Gmail cuyas llamadas bloquean el hilo (como
+googleapiclient) y compara la ejecución en serie sobre el event loop con
+ToolExecutor.execute_many, que reparte las llamadas en el pool de E/S. Un
+turno en paralelo debería costar lo que la llamada más lenta.
+
+Se mide con la copia local del calendario vacía (list_appointments tiene que
+sincronizar con sync_events antes de leer) y ya al día (se lee de la copia).
+
+Uso:
+    python benchmarks/bench_parallel_tools.py [--latency 0.2]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, delete
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.calendar_sync import CalendarSync
+from src.database import Base, AsyncSessionLocal, CalendarEvent, CalendarSyncState, write_transaction
+from src.tool_executor import ToolExecutor
+from src.unit_of_work import TurnUnitOfWork
+
+_EVENT = {
+    "id": "ev-1", "status": "confirmed", "summary": "Reunión",
+    "start": {"dateTime": "2030-01-01T10:00:00Z"}, "end": {"dateTime": "2030-01-01T11:00:00Z"},
+}
+
+
+class _SlowCalendar:
+    calendar_id = "primary"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def list_events(self, time_min=None, max_results=10):
+        time.sleep(self.latency)
+        return [{"id": _EVENT["id"], "summary": _EVENT["summary"], "start": _EVENT["start"]}]
+
+    def sync_events(self, sync_token=None, time_min=None):
+        time.sleep(self.latency)
+        return [dict(_EVENT)], "sync-token"
+
+    def delete_event(self, event_id):
+        time.sleep(self.latency)
+        return True
+
+
+class _SlowGmail:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def send_email(self, to, subject, body):
+        time.sleep(self.latency)
+        return {"id": "msg-1"}
+
+
+CALLS = [
+    ("list_appointments", {}),
+    ("list_appointments", {"time_min": "2030-01-01T00:00:00Z"}),
+    ("send_email", {"to": "ana@example.com", "subject": "Hola", "body": "Nos vemos"}),
+    ("delete_appointment", {"event_id": "ev-1"}),
+    ("delete_appointment", {"event_id": "ev-2"}),
+]
+
+
+async def _serial(services, db):
+    return [await ToolExecutor.execute(name, args, "bench", services, db=db) for name, args in CALLS]
+
+
+async def _parallel(services, db):
+    return await ToolExecutor.execute_many(CALLS, "bench", services, db=db)
+
+
+async def _clear_mirror():
+    async with AsyncSessionLocal() as db, write_transaction(db):
+        await db.execute(delete(CalendarEvent))
+        await db.execute(delete(CalendarSyncState))
+
+
+async def _run(services):
+    for mirror in ("copia vacía", "copia al día"):
+        for label, runner in (("en serie", _serial), ("execute_many", _parallel)):
+            await _clear_mirror()
+            if mirror == "copia al día":
+                await CalendarSync.sync_user("bench", services["calendar"])
+            # Como en bot.py: las herramientas del turno comparten su sesión
+            start = time.perf_counter()
+            async with TurnUnitOfWork("bench") as uow:
+                results = await runner(services, uow.db)
+            elapsed = time.perf_counter() - start
+            assert all(isinstance(r, list) for r in results[:2])
+            assert [r["status"] for r in results[2:]] == ["success"] * 3
+            print(f"{mirror:<13} {label:<14} {elapsed * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.2, help="latencia simulada por llamada a Google (s)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'bench.db')
+        Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_path}"))
+        AsyncSessionLocal.configure(bind=create_async_engine(f"sqlite+aiosqlite:///{db_path}"))
+
+        services = {"calendar": _SlowCalendar(args.latency), "gmail": _SlowGmail(args.latency)}
+        print(f"{len(CALLS)} herramientas por turno, {args.latency * 1000:.0f} ms por llamada")
+        asyncio.run(_run(services))
+
+
+if __name__ == "__main__":
+    main()
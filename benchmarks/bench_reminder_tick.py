@@ -0,0 +1,134 @@
+"""
+Benchmark del costo de una revisión de recordatorios frente al tamaño de la tabla.
+
+Llena 'appointments' con citas futuras repartidas en un año (más unas pocas
+con recordatorio vencido) y mide SchedulerService.check_reminders con un bot
+falso. La revisión solo toca las filas vencidas vía el índice de
+next_reminder_at, así que su costo no depende del total de citas. Para
+comparar, también se mide el barrido anterior (todas las citas futuras) en
+tamaños donde sigue siendo razonable.
+
+Uso:
+    python benchmarks/bench_reminder_tick.py [--sizes 10000,100000,1000000] [--legacy-max 100000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database import Base, Appointment, SessionLocal, AsyncSessionLocal
+from src.rate_limiter import TelegramRateLimiter
+from src.scheduler import SchedulerService
+
+DUE_PER_TICK = 50
+
+
+class _FakeBot:
+    def __init__(self):
+        self.sent = 0
+
+    async def send_message(self, chat_id, text):
+        self.sent += 1
+
+
+def _populate(engine, count, offset):
+    now = datetime.utcnow()
+    rng = random.Random(count)
+    chunk = []
+    with engine.begin() as conn:
+        for i in range(count):
+            start = now + timedelta(days=2, seconds=rng.randint(0, 365 * 24 * 3600))
+            chunk.append({
+                "telegram_id": str(i % 5000), "event_id": f"ev_{offset + i}", "title": "Reunión",
+                "start_time": start, "end_time": start + timedelta(hours=1),
+                "rem_24h_sent": False, "rem_3h_sent": False, "rem_1h_sent": False, "rem_15m_sent": False,
+                "next_reminder_at": start - timedelta(hours=24),
+            })
+            if len(chunk) == 50000:
+                conn.execute(insert(Appointment), chunk)
+                chunk = []
+        if chunk:
+            conn.execute(insert(Appointment), chunk)
+
+
+def _add_due(engine, tag):
+    now = datetime.utcnow()
+    rows = []
+    for i in range(DUE_PER_TICK):
+        start = now + timedelta(minutes=30 + i)
+        rows.append({
+            "telegram_id": str(i), "event_id": f"due_{tag}_{i}", "title": "Pronto",
+            "start_time": start, "end_time": start + timedelta(hours=1),
+            "rem_24h_sent": False, "rem_3h_sent": False, "rem_1h_sent": False, "rem_15m_sent": False,
+            "next_reminder_at": start - timedelta(hours=24),
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(Appointment), rows)
+
+
+def _legacy_scan():
+    db = SessionLocal()
+    try:
+        return len(db.query(Appointment).filter(Appointment.start_time > datetime.utcnow()).all())
+    finally:
+        db.close()
+
+
+async def _run(engine, args):
+    bot = _FakeBot()
+    service = SchedulerService(bot)
+    # Sin límite de tasa efectivo: aquí se mide el costo de la DB, no el ritmo de Telegram
+    service.rate_limiter = TelegramRateLimiter(global_rate=1e6, per_chat_rate=1e6)
+
+    print(f"{'citas':>9} {'revisión con {0} vencidas (ms)'.format(DUE_PER_TICK):>32} {'revisión vacía (ms)':>20} {'barrido anterior (ms)':>22}")
+    total = 0
+    for size in (int(x) for x in args.sizes.split(",")):
+        _populate(engine, size - total, total)
+        total = size
+
+        _add_due(engine, size)
+        start = time.perf_counter()
+        await service.check_reminders()
+        busy = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        for _ in range(20):
+            await service.check_reminders()
+        idle = (time.perf_counter() - start) / 20 * 1000
+
+        legacy = "-"
+        if size <= args.legacy_max:
+            start = time.perf_counter()
+            _legacy_scan()
+            legacy = f"{(time.perf_counter() - start) * 1000:.1f}"
+
+        print(f"{size:>9} {busy:>32.1f} {idle:>20.2f} {legacy:>22}")
+
+    print(f"recordatorios enviados: {bot.sent}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--legacy-max", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/bench.db")
+        Base.metadata.create_all(bind=engine)
+        SessionLocal.configure(bind=engine)
+        AsyncSessionLocal.configure(bind=create_async_engine(f"sqlite+aiosqlite:///{tmp}/bench.db"))
+        asyncio.run(_run(engine, args))
+
+
+if __name__ == "__main__":
+    main()
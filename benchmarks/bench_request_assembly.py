@@ -0,0 +1,71 @@
+"""
+Benchmark del armado de cada petición a Gemini (sin red).
+
+Mide lo que AIService hace antes de llamar a la API en cada turno: pasar el
+historial a Content, agregar la línea de fecha y hora, obtener las
+declaraciones de herramientas, la clave de la cache de contexto y el
+GenerateContentConfig. Compara la ruta memoizada (_CompiledTools y la línea
+de fecha por minuto) con reconstruir todo en cada llamada.
+
+Uso:
+    python benchmarks/bench_request_assembly.py [--calls 2000] [--history 6]
+"""
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import types
+
+import src.ai as ai
+
+
+def _rebuild_each_call(service, messages):
+    gemini_messages = ai._convert_messages_to_gemini(messages)
+    first = gemini_messages[0]
+    time_part = types.Part(text=ai.get_time_context())
+    gemini_messages = [types.Content(role=first.role, parts=[time_part, *first.parts]), *gemini_messages[1:]]
+    gemini_tools = ai._build_gemini_tools(ai.TOOLS)
+    ai.ContextCache.key(service.model_name, ai.SYSTEM_PROMPT, gemini_tools)
+    return gemini_messages, types.GenerateContentConfig(system_instruction=ai.SYSTEM_PROMPT, tools=gemini_tools)
+
+
+def _memoized(service, messages):
+    gemini_messages = ai._with_time_context(ai._convert_messages_to_gemini(messages))
+    return gemini_messages, service._compiled_tools(ai.TOOLS).inline_config
+
+
+def _per_call_us(calls, fn):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    return (time.perf_counter() - start) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=6, help="mensajes de historial por turno")
+    args = parser.parse_args()
+
+    service = ai.AIService()
+    messages = []
+    for n in range(args.history // 2):
+        messages.append({"role": "user", "content": f"¿Tengo algo el día {n + 1}?"})
+        messages.append({"role": "assistant", "content": "No, ese día está libre."})
+    messages.append({"role": "user", "content": "Agenda una reunión mañana a las 10"})
+
+    assert _memoized(service, messages)[1] is _memoized(service, messages)[1]
+    rebuilt_us = _per_call_us(args.calls, lambda: _rebuild_each_call(service, messages))
+    memoized_us = _per_call_us(args.calls, lambda: _memoized(service, messages))
+
+    print(f"{len(messages)} mensajes, {len(ai.TOOLS)} herramientas")
+    print(f"reconstruyendo todo   {rebuilt_us:8.1f} µs/llamada")
+    print(f"memoizado             {memoized_us:8.1f} µs/llamada")
+
+
+if __name__ == "__main__":
+    main()
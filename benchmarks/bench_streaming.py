@@ -0,0 +1,104 @@
+"""
+Benchmark de latencia percibida con respuestas en streaming.
+
+Simula un Gemini que genera la respuesta en chunks (latencia inicial más un
+intervalo por chunk) y compara cuánto tarda el usuario en ver algo:
+sin streaming el primer mensaje llega con la respuesta completa; con
+streaming llega con el primer chunk y después se edita (como mucho una vez
+por intervalo). También muestra las métricas que expone /stats.
+
+Uso:
+    python benchmarks/bench_streaming.py [--first 0.8] [--chunks 20] [--chunk-delay 0.15] [--interval 1.0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "bench")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.genai import types
+
+import src.ai as ai
+from src.bot import StreamingReply
+
+
+def _chunk(text):
+    return types.GenerateContentResponse(candidates=[
+        types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))
+    ])
+
+
+class _FakeModels:
+    def __init__(self, first, chunks, chunk_delay):
+        self.first, self.chunks, self.chunk_delay = first, chunks, chunk_delay
+
+    async def generate_content(self, model, contents, config=None):
+        await asyncio.sleep(self.first + self.chunks * self.chunk_delay)
+        return _chunk("palabra " * self.chunks)
+
+    async def generate_content_stream(self, model, contents, config=None):
+        async def stream():
+            await asyncio.sleep(self.first)
+            for _ in range(self.chunks):
+                yield _chunk("palabra ")
+                await asyncio.sleep(self.chunk_delay)
+        return stream()
+
+
+class _FakeMessage:
+    def __init__(self, started):
+        self.started = started
+        self.first_visible = None
+
+    async def reply_text(self, text):
+        if self.first_visible is None:
+            self.first_visible = time.perf_counter() - self.started
+        return SimpleNamespace(edit_text=self._edit)
+
+    async def _edit(self, text):
+        await asyncio.sleep(0.05)  # ida y vuelta a la API de Telegram
+
+
+async def _run(args):
+    ai.client = SimpleNamespace(aio=SimpleNamespace(models=_FakeModels(args.first, args.chunks, args.chunk_delay)))
+    service = ai.AIService()
+    service._context_cache.enabled = False  # el doble local no implementa caches
+    messages = [{"role": "user", "content": "¿Qué tengo mañana?"}]
+
+    started = time.perf_counter()
+    message = _FakeMessage(started)
+    response = await service.get_agent_response(messages, ai.TOOLS)
+    await message.reply_text(response.content)
+    blocking_visible = message.first_visible
+    blocking_total = time.perf_counter() - started
+
+    started = time.perf_counter()
+    message = _FakeMessage(started)
+    reply = StreamingReply(message, interval=args.interval)
+    response = await service.stream_agent_response(messages, ai.TOOLS, on_text=reply.update)
+    await reply.finish(response.content)
+    streaming_visible = message.first_visible
+    streaming_total = time.perf_counter() - started
+
+    print(f"{'':22} {'primer texto':>13} {'respuesta completa':>19}")
+    print(f"{'sin streaming':22} {blocking_visible * 1000:>10.0f} ms {blocking_total * 1000:>16.0f} ms")
+    print(f"{'con streaming':22} {streaming_visible * 1000:>10.0f} ms {streaming_total * 1000:>16.0f} ms")
+    print(f"ediciones de Telegram: {reply.edits} (intervalo {args.interval}s, {args.chunks} chunks)")
+    print(f"/stats gemini: {service.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--first", type=float, default=0.8, help="latencia hasta el primer chunk (s)")
+    parser.add_argument("--chunks", type=int, default=20)
+    parser.add_argument("--chunk-delay", type=float, default=0.15, help="tiempo entre chunks (s)")
+    parser.add_argument("--interval", type=float, default=1.0, help="mínimo entre ediciones (s)")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
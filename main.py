@@ -3,14 +3,17 @@ import os
 import uvicorn
 import asyncio
 from fastapi import FastAPI, Request
-from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
 
 from src.config import TELEGRAM_BOT_TOKEN, WEBHOOK_URL
 from src.bot import TelegramBot
-from src.database import init_db
+from src.database import init_db, async_engine
 from src.scheduler import SchedulerService
+from src.history_manager import HistoryManager
+from src.auth_manager import AuthManager
 from src.auth_routes import router as auth_router
+from src.update_processor import PerChatUpdateProcessor
+from src.inbox import InboxManager, InboxDispatcher
 
 # Logging
 logging.basicConfig(level=logging.INFO)
@@ -23,8 +26,10 @@ app.include_router(auth_router)
 # Inicialización de DB y Bot
 init_db()
 bot_logic = TelegramBot(TELEGRAM_BOT_TOKEN)
-application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+update_processor = PerChatUpdateProcessor()
+application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).concurrent_updates(update_processor).build()
 scheduler = SchedulerService(application.bot)
+inbox = InboxDispatcher(application)
 
 @app.on_event("startup")
 async def startup_event():
@@ -51,22 +56,45 @@ async def startup_event():
         await application.start()
         asyncio.create_task(application.updater.start_polling())
     
-    scheduler.start()
+    # Drena también lo que haya quedado pendiente de una ejecución anterior
+    await inbox.start()
+    await scheduler.start()
     logger.info("Sistema de gestión de citas iniciado correctamente.")
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    await inbox.stop()
     await application.stop()
     await application.shutdown()
+    await bot_logic.ai.close()
+    await async_engine.dispose()
 
 @app.post("/webhook")
 async def webhook_handler(request: Request):
-    """Maneja las actualizaciones de Telegram"""
+    """Guarda el update en la bandeja de entrada y responde de inmediato.
+
+    El procesamiento (Gemini, Google APIs) lo hacen los workers del
+    InboxDispatcher; las reentregas de Telegram se descartan por update_id.
+    """
     data = await request.json()
-    update = Update.de_json(data, application.bot)
-    await application.process_update(update)
+    update_id = data.get("update_id")
+    if update_id is None:
+        return {"status": "ignored"}
+    if await InboxManager.store(update_id, data):
+        inbox.notify()
     return {"status": "ok"}
 
+@app.get("/stats")
+def stats():
+    """Métricas internas de procesamiento"""
+    return {
+        "updates": update_processor.stats(),
+        "inbox": inbox.stats(),
+        "history_cache": HistoryManager.cache_stats(),
+        "google_clients": AuthManager.pool_stats(),
+        "gemini": bot_logic.ai.stats(),
+    }
+
 @app.get("/")
 def health_check():
     return {"status": "online", "message": "Asistente de Citas AI funcionando"}
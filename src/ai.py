@@ -1,10 +1,24 @@
+import asyncio
 import json
 import logging
-import pathlib
+import time
+from collections import OrderedDict, deque
 from google import genai
 from google.genai import types
 from datetime import datetime
-from src.config import GEMINI_API_KEY, TIMEZONE_STR, TIMEZONE
+from src.gemini_cache import ContextCache, is_cache_error
+from src.token_budget import estimator
+from src.config import (
+    GEMINI_API_KEY,
+    GEMINI_MAX_CONCURRENCY,
+    GEMINI_TIMEOUT_SECONDS,
+    GEMINI_STATS_WINDOW,
+    SUMMARY_MAX_TOKENS,
+    CONTENT_MEMO_USERS,
+    TOKEN_CALIBRATION_EVERY,
+    TIMEZONE_STR,
+    TIMEZONE,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -15,16 +29,17 @@ client = genai.Client(api_key=GEMINI_API_KEY)
 # System prompt
 # ---------------------------------------------------------------------------
 
-def get_system_prompt():
-    now_local = datetime.now(TIMEZONE)
-    return f"""
+# Parte fija del prompt: es idéntica en todas las llamadas, así que va en la
+# cache de contexto de Gemini junto con las herramientas. La fecha y hora
+# actual viaja en cada turno (get_time_context).
+SYSTEM_PROMPT = f"""
 Eres MeetMate AI, un asistente inteligente para la gestión de eventos.
 
 TU OBJETIVO: Ayudar al usuario a agendar, reprogramar, consultar y cancelar eventos (aunque el usuario se refiera a ellos como "citas", "reuniones" o "agendas", tú siempre usarás el término "eventos" en tus respuestas).
 
 REGLAS CRÍTICAS:
 1. La zona horaria actual es {TIMEZONE_STR}.
-2. La fecha y hora actual es: {now_local.strftime('%A, %d de %B de %Y, %I:%M %p')}.
+2. La fecha y hora actual se indica al comienzo de la conversación, en la línea "Fecha y hora actual".
 3. Si el usuario no especifica la duración, asume 1 hora.
 4. Si falta información (como la hora o el motivo), pídela amablemente.
 5. **IMPORTANTE: Siempre pide el correo electrónico de los asistentes antes de agendar un evento.** Explícales que es para enviarles la invitación oficial de Google Calendar.
@@ -36,11 +51,13 @@ REGLAS CRÍTICAS:
     - Usa ℹ️ o ⚠️ para advertencias o información crítica.
     - Usa 👋 o 🗓️ para saludos y referencias al calendario.
 10. No listes eventos pasados como pendientes a menos que se pida el historial.
+11. **Conflictos de horario:** Si create_appointment o update_appointment devuelven status "conflict", informa al usuario con qué eventos se cruza y pregunta si desea continuar. Solo si confirma, repite la llamada con ignore_conflicts=true.
 
 Herramientas disponibles:
 - create_appointment: Para agendar nuevos eventos.
 - update_appointment: Para cambiar detalles de un evento.
 - list_appointments: Para consultar eventos programados.
+- find_free_slots: Para saber cuándo hay tiempo libre. Úsala siempre que el usuario pregunte por disponibilidad o pida proponer un horario, en lugar de deducirlo de list_appointments.
 - delete_appointment: Para cancelar un evento.
 - delete_all_appointments: Para borrar todos los eventos futuros.
 - send_email: Para redactar y enviar correos electrónicos.
@@ -52,6 +69,39 @@ REGLAS DE CORREO ELECTRÓNICO:
 """
 
 
+def get_time_context():
+    now_local = datetime.now(TIMEZONE)
+    return f"Fecha y hora actual: {now_local.strftime('%A, %d de %B de %Y, %I:%M %p')} ({TIMEZONE_STR})."
+
+
+# La línea de fecha y hora tiene resolución de minutos: se arma una vez por minuto
+_time_part = {"minute": None, "part": None}
+
+
+def _time_context_part():
+    minute = int(time.time() // 60)
+    if _time_part["minute"] != minute:
+        _time_part["part"] = types.Part(text=get_time_context())
+        _time_part["minute"] = minute
+    return _time_part["part"]
+
+
+def _with_time_context(gemini_messages):
+    """Prepend the current time to the first user turn (without mutating the converted history)."""
+    first = gemini_messages[0]
+    time_part = _time_context_part()
+    return [types.Content(role=first.role, parts=[time_part, *(first.parts or [])]), *gemini_messages[1:]]
+
+
+SUMMARY_PROMPT = """
+Mantienes el resumen de una conversación entre un usuario y MeetMate AI, su asistente de agenda.
+Recibes el resumen anterior (puede estar vacío) y un tramo más reciente de la conversación.
+Devuelve un único resumen actualizado, en el idioma del usuario, con lo que siga siendo útil:
+preferencias, correos de contactos, eventos acordados o cancelados (con fechas), compromisos y
+pendientes. Omite saludos, confirmaciones triviales y detalles ya obsoletos. Sé breve y concreto.
+"""
+
+
 # ---------------------------------------------------------------------------
 # Format converters: OpenAI history → Gemini format
 # ---------------------------------------------------------------------------
@@ -72,7 +122,129 @@ def _build_gemini_tools(openai_tools):
     return [types.Tool(function_declarations=function_declarations)]
 
 
-def _convert_messages_to_gemini(openai_messages):
+def _tools_signature(openai_tools):
+    """Identity of a tool registry: the list and each definition in it."""
+    return id(openai_tools), tuple(id(t) for t in openai_tools)
+
+
+class _CompiledTools:
+    """Everything derived from a tool registry that is reused on every call."""
+
+    MAX_CACHED_CONFIGS = 8
+
+    def __init__(self, openai_tools, model_name: str):
+        self.source = openai_tools  # strong ref so the ids in the signature stay valid
+        self.signature = _tools_signature(openai_tools)
+        self.gemini_tools = _build_gemini_tools(openai_tools)
+        self.cache_key = ContextCache.key(model_name, SYSTEM_PROMPT, self.gemini_tools)
+        self.inline_config = types.GenerateContentConfig(system_instruction=SYSTEM_PROMPT, tools=self.gemini_tools)
+        self._cached_configs = {}
+
+    def cached_config(self, cache_name: str):
+        config = self._cached_configs.get(cache_name)
+        if config is None:
+            if len(self._cached_configs) >= self.MAX_CACHED_CONFIGS:
+                self._cached_configs.clear()
+            config = self._cached_configs[cache_name] = types.GenerateContentConfig(cached_content=cache_name)
+        return config
+
+
+def _unit_end(openai_messages, i):
+    """End (exclusive) of the unit starting at i: an assistant with tool_calls takes its tool results."""
+    msg = openai_messages[i]
+    if msg.get("role") == "assistant" and msg.get("tool_calls"):
+        j = i + 1
+        while j < len(openai_messages) and openai_messages[j].get("role") == "tool":
+            j += 1
+        return j
+    return i + 1
+
+
+def _convert_unit(unit):
+    """Gemini contents for one unit of history (see _unit_end)."""
+    msg = unit[0]
+    role = msg.get("role")
+
+    if role == "user":
+        content = msg.get("content") or ""
+        return [types.Content(role="user", parts=[types.Part(text=content)])]
+
+    if role != "assistant":
+        # Orphaned tool message or unknown role — skip
+        return []
+
+    tool_calls = msg.get("tool_calls")
+    if not tool_calls:
+        content = msg.get("content") or ""
+        return [types.Content(role="model", parts=[types.Part(text=content)])]
+
+    parts = []
+    text = msg.get("content")
+    if text:
+        parts.append(types.Part(text=text))
+
+    for tc in tool_calls:
+        if isinstance(tc, dict):
+            name = tc["function"]["name"]
+            arguments = tc["function"]["arguments"]
+        else:
+            name = tc.function.name
+            arguments = tc.function.arguments
+
+        try:
+            args = json.loads(arguments) if isinstance(arguments, str) else arguments
+        except Exception:
+            args = {}
+
+        parts.append(types.Part(function_call=types.FunctionCall(name=name, args=args)))
+
+    contents = [types.Content(role="model", parts=parts)]
+
+    # All consecutive tool results → one user message
+    tool_result_parts = []
+    for tr in unit[1:]:
+        content_str = tr.get("content") or ""
+        try:
+            content_val = json.loads(content_str)
+            if not isinstance(content_val, dict):
+                content_val = {"result": content_val}
+        except Exception:
+            content_val = {"result": content_str}
+
+        tool_result_parts.append(
+            types.Part(
+                function_response=types.FunctionResponse(
+                    name=tr.get("name", "unknown"),
+                    response=content_val,
+                )
+            )
+        )
+
+    if tool_result_parts:
+        contents.append(types.Content(role="user", parts=tool_result_parts))
+    return contents
+
+
+class _ContentMemo:
+    """
+    Converted contents of one user's history, keyed by the identity of the source messages.
+
+    History dicts are shared and never mutated (see ConversationCache), so a
+    unit whose messages are the very same objects converts to the same
+    contents. The memo keeps strong refs to those messages, so ids cannot be
+    reused, and after each conversion only the units still in the window are
+    kept. Cached contents are shared between calls and must not be mutated.
+    """
+
+    __slots__ = ("units", "hits", "misses")
+
+    def __init__(self):
+        self.units = {}
+        self.hits = 0
+        self.misses = 0
+
+
+def _convert_messages_to_gemini(openai_messages, summary: str = None, memo: _ContentMemo = None):
     """
     Convert OpenAI-format message list to Gemini (google-genai) format.
 
@@ -81,87 +253,44 @@ def _convert_messages_to_gemini(openai_messages):
     - tool_calls in assistant message → function_call parts
     - tool results → function_response parts grouped in a 'user' message
     - Must start with a 'user' message
+
+    The rolling summary of older turns, if any, is prepended to the first user message.
+    With a memo, only the messages not converted in a previous call are converted.
     """
     result = []
+    used = {}
     i = 0
 
     while i < len(openai_messages):
-        msg = openai_messages[i]
-        role = msg.get("role")
-
-        if role == "user":
-            content = msg.get("content") or ""
-            result.append(types.Content(role="user", parts=[types.Part(text=content)]))
-            i += 1
-
-        elif role == "assistant":
-            tool_calls = msg.get("tool_calls")
-            if tool_calls:
-                parts = []
-                text = msg.get("content")
-                if text:
-                    parts.append(types.Part(text=text))
-
-                for tc in tool_calls:
-                    if isinstance(tc, dict):
-                        name = tc["function"]["name"]
-                        arguments = tc["function"]["arguments"]
-                    else:
-                        name = tc.function.name
-                        arguments = tc.function.arguments
-
-                    try:
-                        args = json.loads(arguments) if isinstance(arguments, str) else arguments
-                    except Exception:
-                        args = {}
-
-                    parts.append(types.Part(function_call=types.FunctionCall(name=name, args=args)))
-
-                result.append(types.Content(role="model", parts=parts))
-
-                # Collect all consecutive tool results → one user message
-                tool_result_parts = []
-                j = i + 1
-                while j < len(openai_messages) and openai_messages[j].get("role") == "tool":
-                    tr = openai_messages[j]
-                    content_str = tr.get("content") or ""
-                    try:
-                        content_val = json.loads(content_str)
-                        if not isinstance(content_val, dict):
-                            content_val = {"result": content_val}
-                    except Exception:
-                        content_val = {"result": content_str}
-
-                    tool_result_parts.append(
-                        types.Part(
-                            function_response=types.FunctionResponse(
-                                name=tr.get("name", "unknown"),
-                                response=content_val,
-                            )
-                        )
-                    )
-                    j += 1
-
-                if tool_result_parts:
-                    result.append(types.Content(role="user", parts=tool_result_parts))
-                    i = j
-                else:
-                    i += 1
+        j = _unit_end(openai_messages, i)
+        unit = openai_messages[i:j]
+        contents = None
+        if memo is not None:
+            key = tuple(id(m) for m in unit)
+            cached = memo.units.get(key)
+            if cached is not None and all(a is b for a, b in zip(cached[0], unit)):
+                contents = cached[1]
+                memo.hits += 1
             else:
-                content = msg.get("content") or ""
-                result.append(types.Content(role="model", parts=[types.Part(text=content)]))
-                i += 1
+                memo.misses += 1
+        if contents is None:
+            contents = _convert_unit(unit)
+        if memo is not None:
+            used[key] = (unit, contents)
+        result.extend(contents)
+        i = j
 
-        elif role == "tool":
-            # Orphaned tool message — skip
-            i += 1
-        else:
-            i += 1
+    if memo is not None:
+        memo.units = used
 
     # Gemini requires the first message to be 'user'
     while result and result[0].role != "user":
         result.pop(0)
 
+    if summary and result:
+        summary_part = types.Part(text=f"Resumen de la conversación anterior:\n{summary}")
+        result[0] = types.Content(role="user", parts=[summary_part, *(result[0].parts or [])])
+
     return result
 
 
@@ -208,65 +337,161 @@ class _MessageStub:
         return {"role": "assistant", "content": self.content or ""}
 
 
+def _collect_parts(response, text_content: str, tool_calls: list):
+    """Append the text and function calls of a response (or stream chunk) to the accumulators."""
+    if not response.candidates or not response.candidates[0].content:
+        return text_content, tool_calls
+
+    for part in response.candidates[0].content.parts or []:
+        if hasattr(part, "text") and part.text:
+            text_content += part.text
+        elif hasattr(part, "function_call") and part.function_call and part.function_call.name:
+            fc = part.function_call
+            tool_calls.append(
+                _ToolCallStub(
+                    id=f"call_{fc.name}_{len(tool_calls)}",
+                    name=fc.name,
+                    arguments=json.dumps(fc.args if fc.args else {}),
+                )
+            )
+    return text_content, tool_calls
+
+
 # ---------------------------------------------------------------------------
 # AIService
 # ---------------------------------------------------------------------------
 
 class AIService:
-    def __init__(self):
+    def __init__(self, max_concurrency: int = GEMINI_MAX_CONCURRENCY, timeout: float = GEMINI_TIMEOUT_SECONDS):
         self.model_name = "gemini-2.5-flash"
+        self.timeout = timeout
+        # Limita las llamadas simultáneas a Gemini para no saturar la cuota
+        # ni el proceso cuando muchos usuarios escriben a la vez.
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        # Últimas latencias de streaming (segundos) para /stats
+        self._streams = 0
+        self._ttft = deque(maxlen=GEMINI_STATS_WINDOW)
+        self._stream_totals = deque(maxlen=GEMINI_STATS_WINDOW)
+        # System prompt y herramientas en cachedContents, compartidos por todos los usuarios
+        self._context_cache = ContextCache(client, timeout=timeout)
+        self._tools = None
+        self._calls = 0
+        self._background = set()
+        # user_id -> _ContentMemo (LRU): cada turno solo convierte los mensajes nuevos
+        self._content_memos = OrderedDict()
+
+    async def _generate(self, **kwargs):
+        """Async generate_content call bounded by the semaphore and the per-call timeout."""
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                client.aio.models.generate_content(model=self.model_name, **kwargs),
+                timeout=self.timeout,
+            )
 
-    def transcribe_audio(self, audio_file_path: str) -> str:
-        """Transcribe audio using Gemini multimodal API."""
+    async def transcribe_audio(self, audio_bytes: bytes, mime_type: str = "audio/ogg"):
+        """Transcribe in-memory audio using Gemini multimodal API. Returns None if it fails."""
         try:
-            audio_bytes = pathlib.Path(audio_file_path).read_bytes()
-            response = client.models.generate_content(
-                model=self.model_name,
+            response = await self._generate(
                 contents=[
-                    types.Part.from_bytes(data=audio_bytes, mime_type="audio/ogg"),
+                    types.Part.from_bytes(data=audio_bytes, mime_type=mime_type),
                     "Transcribe exactly what is said in this audio. Return only the transcription, no extra commentary.",
                 ],
             )
             return response.text.strip()
         except Exception as e:
             logger.warning(f"Audio transcription unavailable: {e}")
-            return "No se pudo transcribir el audio (servicio no disponible)."
-
-    def get_agent_response(self, messages: list, tools: list) -> _MessageStub:
-        gemini_tools = _build_gemini_tools(tools)
-        gemini_messages = _convert_messages_to_gemini(messages)
-
+            return None
+
+    def _compiled_tools(self, tools: list) -> _CompiledTools:
+        """Tool declarations and configs compiled once; recompiled only if the registry changes."""
+        compiled = self._tools
+        if compiled is None or compiled.signature != _tools_signature(tools):
+            compiled = self._tools = _CompiledTools(tools, self.model_name)
+        return compiled
+
+    def _content_memo(self, user_id: str):
+        if user_id is None:
+            return None
+        memo = self._content_memos.get(user_id)
+        if memo is None:
+            memo = self._content_memos[user_id] = _ContentMemo()
+            while len(self._content_memos) > CONTENT_MEMO_USERS:
+                self._content_memos.popitem(last=False)
+        else:
+            self._content_memos.move_to_end(user_id)
+        return memo
+
+    def forget_user(self, user_id: str):
+        """Drop the user's converted history (used by /reset)."""
+        self._content_memos.pop(user_id, None)
+
+    def _maybe_calibrate(self, messages: list, gemini_messages: list, summary: str = None):
+        """Every TOKEN_CALIBRATION_EVERY calls, check the local token estimate against Gemini's count_tokens."""
+        self._calls += 1
+        if not TOKEN_CALIBRATION_EVERY or (self._calls - 1) % TOKEN_CALIBRATION_EVERY:
+            return
+        if summary:
+            # The estimate only covers the history messages: count them without the summary part
+            first = gemini_messages[0]
+            gemini_messages = [types.Content(role=first.role, parts=first.parts[1:]), *gemini_messages[1:]]
+        task = asyncio.create_task(self._calibrate(list(messages), gemini_messages))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _calibrate(self, messages: list, gemini_messages: list):
+        try:
+            result = await asyncio.wait_for(
+                client.aio.models.count_tokens(model=self.model_name, contents=gemini_messages),
+                timeout=self.timeout,
+            )
+        except Exception as e:
+            logger.info(f"count_tokens no disponible, se mantiene la estimación local: {e}")
+            return
+        estimator.calibrate(messages, result.total_tokens or 0)
+
+    async def _with_context(self, call, tools: list, can_retry=None):
+        """
+        Run call(config) using the cached system prompt + tools when available.
+
+        If Gemini rejects the cache entry (expired or deleted), the entry is
+        dropped and the call is retried once with everything inline, unless
+        can_retry() says part of the answer was already delivered.
+        """
+        compiled = self._compiled_tools(tools)
+        cache_name = await self._context_cache.get(
+            self.model_name, SYSTEM_PROMPT, compiled.gemini_tools, key=compiled.cache_key
+        )
+        if cache_name:
+            try:
+                return await call(compiled.cached_config(cache_name))
+            except Exception as e:
+                if not is_cache_error(e):
+                    raise
+                self._context_cache.invalidate(cache_name)
+                if can_retry is not None and not can_retry():
+                    raise
+                logger.warning(f"Gemini rechazó la cache de contexto {cache_name}, reintento sin ella: {e}")
+        return await call(compiled.inline_config)
+
+    async def get_agent_response(self, messages: list, tools: list, summary: str = None,
+                                 user_id: str = None) -> _MessageStub:
+        gemini_messages = _convert_messages_to_gemini(messages, summary, self._content_memo(user_id))
         if not gemini_messages:
             return _MessageStub("No recibí ningún mensaje.")
+        self._maybe_calibrate(messages, gemini_messages, summary)
+        gemini_messages = _with_time_context(gemini_messages)
 
-        config = types.GenerateContentConfig(
-            system_instruction=get_system_prompt(),
-            tools=gemini_tools,
-        )
+        async def call(config):
+            return await self._generate(contents=gemini_messages, config=config)
 
-        response = client.models.generate_content(
-            model=self.model_name,
-            contents=gemini_messages,
-            config=config,
-        )
+        try:
+            response = await self._with_context(call, tools)
+        except asyncio.TimeoutError:
+            logger.warning(f"Gemini no respondió en {self.timeout}s")
+            raise
 
-        text_content = ""
-        tool_calls = []
-
-        parts = response.candidates[0].content.parts or []
-
-        for part in parts:
-            if hasattr(part, "text") and part.text:
-                text_content += part.text
-            elif hasattr(part, "function_call") and part.function_call and part.function_call.name:
-                fc = part.function_call
-                tool_calls.append(
-                    _ToolCallStub(
-                        id=f"call_{fc.name}_{len(tool_calls)}",
-                        name=fc.name,
-                        arguments=json.dumps(fc.args if fc.args else {}),
-                    )
-                )
+        self._context_cache.record_usage(response.usage_metadata)
+        text_content, tool_calls = _collect_parts(response, "", [])
 
         logger.info(f"Gemini response — tool_calls: {len(tool_calls)}, text_len: {len(text_content)}")
         return _MessageStub(
@@ -274,9 +499,114 @@ class AIService:
             tool_calls=tool_calls if tool_calls else None,
         )
 
+    async def stream_agent_response(self, messages: list, tools: list, on_text=None,
+                                    summary: str = None, user_id: str = None) -> _MessageStub:
+        """
+        Streaming variant of get_agent_response.
+
+        on_text(text) is called with the text accumulated so far every time a
+        chunk adds text. Function calls are collected as they arrive, so the
+        returned message is the same one get_agent_response would build.
+        """
+        gemini_messages = _convert_messages_to_gemini(messages, summary, self._content_memo(user_id))
+        if not gemini_messages:
+            return _MessageStub("No recibí ningún mensaje.")
+        self._maybe_calibrate(messages, gemini_messages, summary)
+        gemini_messages = _with_time_context(gemini_messages)
+
+        started = time.perf_counter()
+        first_chunk = None
+        text_content, tool_calls = "", []
+
+        async def consume(config):
+            nonlocal first_chunk, text_content, tool_calls
+            # Each attempt starts from scratch (see can_retry below)
+            first_chunk = None
+            text_content, tool_calls = "", []
+            usage = None
+            stream = await client.aio.models.generate_content_stream(
+                model=self.model_name, contents=gemini_messages, config=config
+            )
+            async for chunk in stream:
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                usage = chunk.usage_metadata or usage
+                previous_len = len(text_content)
+                text_content, tool_calls = _collect_parts(chunk, text_content, tool_calls)
+                if on_text and len(text_content) > previous_len:
+                    on_text(text_content)
+            self._context_cache.record_usage(usage)
+
+        async def call(config):
+            async with self._semaphore:
+                return await asyncio.wait_for(consume(config), timeout=self.timeout)
+
+        try:
+            # Once a chunk has arrived its text may already be on Telegram: no inline retry
+            await self._with_context(call, tools, can_retry=lambda: first_chunk is None)
+        except asyncio.TimeoutError:
+            logger.warning(f"Gemini no terminó el stream en {self.timeout}s")
+            raise
+
+        total = time.perf_counter() - started
+        self._streams += 1
+        if first_chunk is not None:
+            self._ttft.append(first_chunk)
+        self._stream_totals.append(total)
+
+        logger.info(
+            f"Gemini stream — tool_calls: {len(tool_calls)}, text_len: {len(text_content)}, "
+            f"ttft: {(first_chunk or 0) * 1000:.0f} ms, total: {total * 1000:.0f} ms"
+        )
+        return _MessageStub(
+            content=text_content,
+            tool_calls=tool_calls if tool_calls else None,
+        )
+
+    async def summarize_conversation(self, previous_summary: str, transcript: str):
+        """Fold a stretch of older conversation into the running summary. Returns None if it fails."""
+        prompt = f"Resumen anterior:\n{previous_summary or '(vacío)'}\n\nConversación a incorporar:\n{transcript}"
+        config = types.GenerateContentConfig(
+            system_instruction=SUMMARY_PROMPT,
+            max_output_tokens=SUMMARY_MAX_TOKENS,
+            thinking_config=types.ThinkingConfig(thinking_budget=0),
+        )
+        try:
+            response = await self._generate(contents=prompt, config=config)
+            return (response.text or "").strip() or None
+        except Exception as e:
+            logger.warning(f"Conversation summary unavailable: {e}")
+            return None
+
+    async def close(self):
+        await self._context_cache.close()
+
+    def stats(self) -> dict:
+        """Streaming latency: time to first chunk (perceived latency) vs full response."""
+        ttft = sorted(self._ttft)
+        totals = list(self._stream_totals)
+
+        def ms(value):
+            return round(value * 1000, 2)
+
+        return {
+            "streams": self._streams,
+            "ttft_avg_ms": ms(sum(ttft) / len(ttft)) if ttft else 0.0,
+            "ttft_p50_ms": ms(ttft[len(ttft) // 2]) if ttft else 0.0,
+            "ttft_p95_ms": ms(ttft[min(len(ttft) - 1, int(len(ttft) * 0.95))]) if ttft else 0.0,
+            "total_avg_ms": ms(sum(totals) / len(totals)) if totals else 0.0,
+            "context_cache": self._context_cache.stats(),
+            "token_estimator": estimator.stats(),
+            "content_memo": {
+                "users": len(self._content_memos),
+                "hits": sum(m.hits for m in self._content_memos.values()),
+                "misses": sum(m.misses for m in self._content_memos.values()),
+            },
+        }
+
 
 # ---------------------------------------------------------------------------
-# TOOLS (OpenAI format — converted to Gemini format on each call)
+# TOOLS (OpenAI format — compiled to Gemini declarations once per AIService)
 # ---------------------------------------------------------------------------
 
 TOOLS = [
@@ -297,6 +627,10 @@ TOOLS = [
                         "description": "Lista de correos electrónicos de los asistentes",
                     },
                     "enable_meet": {"type": "boolean", "description": "¿Generar un enlace de Google Meet?"},
+                    "ignore_conflicts": {
+                        "type": "boolean",
+                        "description": "Agendar aunque el horario se cruce con otros eventos (solo si el usuario lo confirmó)",
+                    },
                 },
                 "required": ["summary", "start_time", "user_emails"],
             },
@@ -315,6 +649,27 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "find_free_slots",
+            "description": "Busca horarios libres dentro del horario laboral, para el usuario y opcionalmente sus invitados",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "duration_minutes": {"type": "integer", "description": "Duración del evento en minutos (por defecto 60)"},
+                    "time_min": {"type": "string", "description": "Desde cuándo buscar (formato ISO, por defecto ahora)"},
+                    "time_max": {"type": "string", "description": "Hasta cuándo buscar (formato ISO, por defecto 7 días después)"},
+                    "attendees": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                        "description": "Correos de los invitados cuya disponibilidad también se debe respetar",
+                    },
+                    "max_results": {"type": "integer", "description": "Cantidad máxima de horarios a proponer (por defecto 5)"},
+                },
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -326,6 +681,10 @@ TOOLS = [
                     "event_id": {"type": "string", "description": "ID del evento a modificar"},
                     "summary": {"type": "string", "description": "Nuevo resumen"},
                     "start_time": {"type": "string", "description": "Nueva fecha/hora de inicio"},
+                    "ignore_conflicts": {
+                        "type": "boolean",
+                        "description": "Mover aunque el nuevo horario se cruce con otros eventos (solo si el usuario lo confirmó)",
+                    },
                 },
                 "required": ["event_id"],
             },
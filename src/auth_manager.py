@@ -1,66 +1,134 @@
+import asyncio
 import logging
+import time
+import weakref
+from collections import OrderedDict
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from src.database import SessionLocal, UserAuth
-from src.calendar_api import CalendarService
-from src.gmail_api import GmailService
+from sqlalchemy import select
+from src.config import CREDENTIAL_CACHE_TTL_SECONDS, CREDENTIAL_CACHE_MAX_USERS
+from src.database import AsyncSessionLocal, UserAuth
+from src.google_clients import GoogleServicePool
 
 logger = logging.getLogger(__name__)
 
+# Cache en proceso (LRU): telegram_id -> (Credentials, momento de carga). Quien no
+# vinculó su cuenta no entra: /conectar puede completarse en otra réplica
+_credential_cache = OrderedDict()
+# Un lock por usuario para que turnos simultáneos hagan una sola consulta/refresh;
+# referencias débiles: el lock vive mientras alguien lo tiene o lo espera
+_user_locks = weakref.WeakValueDictionary()
+# Clientes de Google construidos, reutilizados entre turnos
+_service_pool = GoogleServicePool()
+
 class AuthManager:
     @staticmethod
-    def _get_credentials(user_id: str):
-        """Método interno para obtener y refrescar credenciales"""
-        db = SessionLocal()
-        try:
-            user_auth = db.query(UserAuth).filter(UserAuth.telegram_id == user_id).first()
-            if not user_auth:
-                return None, None
-
-            creds = Credentials(
-                token=user_auth.access_token,
-                refresh_token=user_auth.refresh_token,
-                token_uri=user_auth.token_uri,
-                client_id=user_auth.client_id,
-                client_secret=user_auth.client_secret,
-                scopes=user_auth.scopes.replace(",", " ").split()
-            )
-
-            if creds.expired and creds.refresh_token:
+    async def _load_credentials(user_id: str):
+        """Lee las credenciales guardadas del usuario (None si no vinculó su cuenta)"""
+        async with AsyncSessionLocal() as db:
+            user_auth = (await db.scalars(select(UserAuth).where(UserAuth.telegram_id == user_id))).first()
+        if not user_auth:
+            return None
+
+        return Credentials(
+            token=user_auth.access_token,
+            refresh_token=user_auth.refresh_token,
+            token_uri=user_auth.token_uri,
+            client_id=user_auth.client_id,
+            client_secret=user_auth.client_secret,
+            scopes=user_auth.scopes.replace(",", " ").split(),
+            # Con la expiración conocida se refresca antes de usar un token vencido
+            expiry=user_auth.expires_at
+        )
+
+    @staticmethod
+    async def _save_refreshed_token(user_id: str, creds: Credentials):
+        async with AsyncSessionLocal() as db:
+            user_auth = (await db.scalars(select(UserAuth).where(UserAuth.telegram_id == user_id))).first()
+            if user_auth:
+                user_auth.access_token = creds.token
+                user_auth.expires_at = creds.expiry.replace(tzinfo=None) if creds.expiry else None
+                await db.commit()
+
+    @staticmethod
+    def _is_fresh(entry) -> bool:
+        if entry is None:
+            return False
+        creds, loaded_at = entry
+        if time.monotonic() - loaded_at > CREDENTIAL_CACHE_TTL_SECONDS:
+            return False
+        # Un token vencido (o por vencer) requiere pasar por el refresh
+        return creds.valid or not creds.refresh_token
+
+    @staticmethod
+    async def get_credentials(user_id: str):
+        """Obtiene credenciales válidas desde el cache, refrescando el token si hace falta"""
+        entry = _credential_cache.get(user_id)
+        if AuthManager._is_fresh(entry):
+            _credential_cache.move_to_end(user_id)
+            return entry[0]
+
+        lock = _user_locks.get(user_id)
+        if lock is None:
+            lock = _user_locks[user_id] = asyncio.Lock()
+        async with lock:
+            # Otro turno del mismo usuario pudo haberlo resuelto mientras esperábamos
+            entry = _credential_cache.get(user_id)
+            if AuthManager._is_fresh(entry):
+                return entry[0]
+
+            if entry is not None and time.monotonic() - entry[1] <= CREDENTIAL_CACHE_TTL_SECONDS:
+                creds = entry[0]
+            else:
+                creds = await AuthManager._load_credentials(user_id)
+
+            if creds and creds.expired and creds.refresh_token:
                 try:
                     logger.info(f"Refrescando token para usuario {user_id}")
-                    creds.refresh(Request())
-                    user_auth.access_token = creds.token
-                    user_auth.expires_at = creds.expiry.replace(tzinfo=None) if creds.expiry else None
-                    db.commit()
+                    # El refresh hace HTTP bloqueante: fuera del event loop
+                    await asyncio.to_thread(creds.refresh, Request())
+                    await AuthManager._save_refreshed_token(user_id, creds)
                 except Exception as e:
                     logger.error(f"Error al refrescar token de Google: {e}")
-            
-            return creds, db
-        except Exception as e:
-            db.close()
-            raise e
+
+            if creds is None:
+                _credential_cache.pop(user_id, None)
+                return None
+            _credential_cache[user_id] = (creds, time.monotonic())
+            _credential_cache.move_to_end(user_id)
+            while len(_credential_cache) > CREDENTIAL_CACHE_MAX_USERS:
+                _credential_cache.popitem(last=False)
+            return creds
+
+    @staticmethod
+    def invalidate(user_id: str):
+        """Descarta las credenciales cacheadas (por ejemplo, tras volver a /conectar)"""
+        _credential_cache.pop(user_id, None)
 
     @staticmethod
-    def get_calendar_service(user_id: str):
+    async def get_services(user_id: str):
+        """
+        Servicios de Google del usuario para ToolExecutor. Cada uno se toma del pool
+        (o se construye) recién cuando una herramienta lo pide.
+        """
+        creds = await AuthManager.get_credentials(user_id)
+        return _service_pool.services(user_id, creds)
+
+    @staticmethod
+    async def get_calendar_service(user_id: str):
         """Obtiene el servicio de calendario"""
-        creds, db = AuthManager._get_credentials(user_id)
-        if db: db.close()
-        return CalendarService(credentials=creds) if creds else None
+        return (await AuthManager.get_services(user_id)).get("calendar")
 
     @staticmethod
-    def get_gmail_service(user_id: str):
+    async def get_gmail_service(user_id: str):
         """Obtiene el servicio de Gmail"""
-        creds, db = AuthManager._get_credentials(user_id)
-        if db: db.close()
-        return GmailService(credentials=creds) if creds else None
+        return (await AuthManager.get_services(user_id)).get("gmail")
+
+    @staticmethod
+    def pool_stats() -> dict:
+        return _service_pool.stats()
 
     @staticmethod
-    def is_user_authenticated(user_id: str) -> bool:
+    async def is_user_authenticated(user_id: str) -> bool:
         """Verifica si el usuario ya vinculó su cuenta de Google"""
-        db = SessionLocal()
-        try:
-            user_auth = db.query(UserAuth).filter(UserAuth.telegram_id == user_id).first()
-            return user_auth is not None
-        finally:
-            db.close()
+        return await AuthManager.get_credentials(user_id) is not None
@@ -4,8 +4,10 @@ from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse
 from datetime import datetime, timedelta
 import requests
+from sqlalchemy import select
 from src.config import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET, WEBHOOK_URL
-from src.database import SessionLocal, UserAuth
+from src.database import AsyncSessionLocal, UserAuth
+from src.auth_manager import AuthManager
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -69,9 +71,8 @@ async def auth_callback(request: Request):
         expires_in = tokens.get('expires_in', 3600)
         expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
 
-        db = SessionLocal()
-        try:
-            user_auth = db.query(UserAuth).filter(UserAuth.telegram_id == telegram_id).first()
+        async with AsyncSessionLocal() as db:
+            user_auth = (await db.scalars(select(UserAuth).where(UserAuth.telegram_id == telegram_id))).first()
             if not user_auth:
                 user_auth = UserAuth(telegram_id=telegram_id)
                 db.add(user_auth)
@@ -86,10 +87,11 @@ async def auth_callback(request: Request):
             user_auth.scopes = tokens.get('scope', 'https://www.googleapis.com/auth/calendar https://www.googleapis.com/auth/gmail.send')
             user_auth.expires_at = expires_at
 
-            db.commit()
+            await db.commit()
             logger.info(f"Tokens guardados exitosamente para usuario {telegram_id}")
-        finally:
-            db.close()
+
+        # Que el próximo mensaje use los tokens nuevos
+        AuthManager.invalidate(telegram_id)
 
         return {"status": "success", "message": "¡Tu calendario ha sido conectado con éxito!"}
     except Exception as e:
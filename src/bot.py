@@ -1,21 +1,129 @@
+import asyncio
 import logging
 import json
-import os
 import traceback
+from collections import OrderedDict
+from contextlib import suppress
 from telegram import Update
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
 
 from src.ai import AIService, TOOLS
+from src.config import (
+    AUDIO_MAX_BYTES, AUDIO_MAX_SECONDS, TRANSCRIPT_CACHE_SIZE, GEMINI_STREAMING, STREAM_EDIT_INTERVAL_SECONDS
+)
 from src.auth_manager import AuthManager
+from src.calendar_sync import CalendarSync
 from src.history_manager import HistoryManager
+from src.summary_manager import SummaryManager
 from src.tool_executor import ToolExecutor
+from src.unit_of_work import TurnUnitOfWork
 
 logger = logging.getLogger(__name__)
 
+_MAX_TEXT = MessageLimit.MAX_TEXT_LENGTH
+
+
+class StreamingReply:
+    """
+    Respuesta de Telegram que se va editando mientras llega el texto de Gemini.
+
+    update() solo guarda el texto; una tarea aparte lo envía (primer chunk) o
+    edita el mensaje como mucho una vez cada 'interval' segundos, para no
+    chocar con el límite de ediciones de Telegram ni frenar la lectura del stream.
+    """
+
+    def __init__(self, message, interval: float = STREAM_EDIT_INTERVAL_SECONDS):
+        self._message = message
+        self._interval = interval
+        self._text = ""
+        self._shown = ""
+        self._sent = None
+        self._task = None
+        self._changed = asyncio.Event()
+        self._closing = asyncio.Event()
+        self.edits = 0
+
+    def update(self, text: str):
+        self._text = text[:_MAX_TEXT]
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._changed.set()
+
+    async def _run(self):
+        while not self._closing.is_set():
+            await self._changed.wait()
+            self._changed.clear()
+            if self._closing.is_set():
+                return
+            await self._flush()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._closing.wait(), self._interval)
+
+    async def _flush(self):
+        text = self._text
+        if not text.strip() or text == self._shown:
+            return
+        try:
+            if self._sent is None:
+                self._sent = await self._message.reply_text(text)
+            else:
+                await self._sent.edit_text(text)
+                self.edits += 1
+            self._shown = text
+        except RetryAfter as e:
+            logger.warning(f"Telegram limitó las ediciones: reintento en {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except TelegramError as e:
+            logger.warning(f"No se pudo actualizar la respuesta parcial: {e}")
+
+    async def finish(self, text: str):
+        """
+        Detiene las ediciones y deja el mensaje con el texto final.
+
+        No lanza errores de Telegram: también se usa para el mensaje de error
+        del turno. Si la edición falla se envía un mensaje nuevo.
+        """
+        self._closing.set()
+        self._changed.set()
+        if self._task is not None:
+            await self._task
+
+        self._text = text[:_MAX_TEXT]
+        if self._text != self._shown:
+            for _ in range(3):
+                try:
+                    if self._sent is None:
+                        self._sent = await self._message.reply_text(self._text)
+                    else:
+                        await self._sent.edit_text(self._text)
+                    break
+                except RetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                except TelegramError as e:
+                    if self._sent is None:
+                        logger.error(f"No se pudo enviar la respuesta: {e}")
+                        return
+                    if "not modified" in str(e).lower():
+                        break
+                    logger.warning(f"No se pudo editar la respuesta, se envía en un mensaje nuevo: {e}")
+                    self._sent = None
+        # Lo que no entra en un mensaje va en mensajes aparte
+        for offset in range(_MAX_TEXT, len(text), _MAX_TEXT):
+            try:
+                await self._message.reply_text(text[offset:offset + _MAX_TEXT])
+            except TelegramError as e:
+                logger.error(f"No se pudo enviar el resto de la respuesta: {e}")
+                return
+
+
 class TelegramBot:
     def __init__(self, token):
         self.token = token
         self.ai = AIService()
+        # file_unique_id -> transcripción (LRU): una nota reenviada no se vuelve a transcribir
+        self._transcripts = OrderedDict()
 
     async def start_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
@@ -35,81 +143,133 @@ class TelegramBot:
 
     async def reset_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = str(update.effective_user.id)
-        HistoryManager.delete_user_history(user_id)
+        await HistoryManager.delete_user_history(user_id)
+        await SummaryManager.delete(user_id)
+        self.ai.forget_user(user_id)
         await update.message.reply_text("Historial de conversación reiniciado. ¡Empecemos de cero!")
 
+    async def _transcribe(self, update: Update, media, context: ContextTypes.DEFAULT_TYPE):
+        """Transcribe una nota de voz o un audio sin pasar por disco. None si no hay texto que procesar."""
+        text = self._transcripts.get(media.file_unique_id)
+        if text is not None:
+            self._transcripts.move_to_end(media.file_unique_id)
+        else:
+            # Los límites se validan con los metadatos del mensaje, antes de descargar nada
+            if (media.file_size or 0) > AUDIO_MAX_BYTES or (media.duration or 0) > AUDIO_MAX_SECONDS:
+                await update.message.reply_text(
+                    f"⚠️ El audio es demasiado largo. Envíame uno de hasta {AUDIO_MAX_SECONDS // 60} minutos."
+                )
+                return None
+
+            await update.message.reply_text("Procesando tu audio...")
+            audio_file = await context.bot.get_file(media.file_id)
+            audio_bytes = bytes(await audio_file.download_as_bytearray())
+            if len(audio_bytes) > AUDIO_MAX_BYTES:
+                await update.message.reply_text("⚠️ El audio es demasiado grande.")
+                return None
+
+            text = await self.ai.transcribe_audio(audio_bytes, media.mime_type or "audio/ogg")
+            if text is None:
+                # Sin cache: el próximo intento vuelve a transcribir
+                text = "No se pudo transcribir el audio (servicio no disponible)."
+            else:
+                self._transcripts[media.file_unique_id] = text
+                if len(self._transcripts) > TRANSCRIPT_CACHE_SIZE:
+                    self._transcripts.popitem(last=False)
+
+        await update.message.reply_text(f"He escuchado: \"{text}\"")
+        return text
+
+    async def _agent_response(self, user_id: str, messages: list, reply: StreamingReply, summary: str):
+        if reply is None:
+            return await self.ai.get_agent_response(messages, TOOLS, summary=summary, user_id=user_id)
+        return await self.ai.stream_agent_response(messages, TOOLS, on_text=reply.update, summary=summary,
+                                                   user_id=user_id)
+
     async def message_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        reply = None
         try:
             user_id = str(update.effective_user.id)
             
             # 1. Verificar Autenticación
-            if not AuthManager.is_user_authenticated(user_id):
+            if not await AuthManager.is_user_authenticated(user_id):
                 await update.message.reply_text("Primero debes conectar tu cuenta de Google. Usa /conectar.")
                 return
 
             # 2. Obtener texto (Audio o Texto)
             text = update.message.text
-            if update.message.voice or update.message.audio:
-                await update.message.reply_text("Procesando tu audio...")
-                audio_file = await context.bot.get_file(update.message.voice.file_id or update.message.audio.file_id)
-                audio_path = f"downloads/{update.message.voice.file_unique_id}.ogg"
-                os.makedirs("downloads", exist_ok=True)
-                await audio_file.download_to_drive(audio_path)
-                text = self.ai.transcribe_audio(audio_path)
-                await update.message.reply_text(f"He escuchado: \"{text}\"")
+            media = update.message.voice or update.message.audio
+            if media:
+                text = await self._transcribe(update, media, context)
+                if text is None:
+                    return
 
             if not text: return
 
             # 3. Gestionar Historial y obtener respuesta de IA
-            messages = HistoryManager.get_user_history(user_id)
-            messages.append({"role": "user", "content": text})
-            HistoryManager.save_message(user_id, "user", text)
+            # Todas las escrituras del turno (historial y citas) se confirman juntas al final
+            # El lock del usuario frena la sincronización de calendario en segundo plano mientras dura el turno
+            async with CalendarSync.user_lock(user_id):
+                async with TurnUnitOfWork(user_id) as uow:
+                    # Lo anterior a la ventana llega como resumen
+                    messages, summary = await asyncio.gather(
+                        HistoryManager.get_user_history(user_id), SummaryManager.get(user_id)
+                    )
+                    messages.append(uow.add_message("user", text))
 
-            logger.info(f"Solicitando respuesta de IA para {user_id}...")
-            response_msg = self.ai.get_agent_response(messages, TOOLS)
-            
-            # Guardar respuesta assistant (puede ser el texto o el objeto con tool_calls)
-            HistoryManager.save_message(
-                user_id, 
-                "assistant", 
-                response_msg.model_dump() if response_msg.tool_calls else response_msg.content
-            )
-            
-            messages.append(response_msg.model_dump() if hasattr(response_msg, 'model_dump') else response_msg)
-
-            # 4. Procesar Herramientas si es necesario
-            reply_text = response_msg.content
-            if response_msg.tool_calls:
-                logger.info(f"IA solicitó {len(response_msg.tool_calls)} herramientas para {user_id}")
+                    logger.info(f"Solicitando respuesta de IA para {user_id}...")
+                    # Con streaming el usuario ve el texto a medida que Gemini lo genera
+                    reply = StreamingReply(update.message) if GEMINI_STREAMING else None
+                    response_msg = await self._agent_response(user_id, messages, reply, summary)
                 
-                # Obtener servicios necesarios
-                services = {
-                    "calendar": AuthManager.get_calendar_service(user_id),
-                    "gmail": AuthManager.get_gmail_service(user_id)
-                }
+                    # Guardar respuesta assistant (puede ser el texto o el objeto con tool_calls)
+                    assistant_msg = uow.add_message(
+                        "assistant", 
+                        response_msg.model_dump() if response_msg.tool_calls else response_msg.content
+                    )
                 
-                for tool_call in response_msg.tool_calls:
-                    function_name = tool_call.function.name
-                    args = json.loads(tool_call.function.arguments)
+                    messages.append(assistant_msg or response_msg.model_dump())
+
+                    # 4. Procesar Herramientas si es necesario
+                    reply_text = response_msg.content
+                    if response_msg.tool_calls:
+                        logger.info(f"IA solicitó {len(response_msg.tool_calls)} herramientas para {user_id}")
                     
-                    result = await ToolExecutor.execute(function_name, args, user_id, services)
+                        # Servicios de Google del pool; cada uno se construye solo si una herramienta lo usa
+                        services = await AuthManager.get_services(user_id)
                     
-                    HistoryManager.save_message(user_id, "tool", json.dumps(result), 
-                                              tool_call_id=tool_call.id, name=function_name)
-                    messages.append({"role": "tool", "tool_call_id": tool_call.id, "name": function_name, "content": json.dumps(result)})
+                        # Las herramientas independientes corren en paralelo; los resultados
+                        # vuelven en el orden de tool_calls para el historial
+                        calls = [(tc.function.name, json.loads(tc.function.arguments)) for tc in response_msg.tool_calls]
+                        results = await ToolExecutor.execute_many(calls, user_id, services, db=uow.db)
+
+                        for tool_call, result in zip(response_msg.tool_calls, results):
+                            messages.append(uow.add_message("tool", json.dumps(result),
+                                                            tool_call_id=tool_call.id, name=tool_call.function.name))
+
+                        logger.info(f"Solicitando respuesta final de IA tras herramientas para {user_id}...")
+                        final_response = await self._agent_response(user_id, messages, reply, summary)
+                        reply_text = final_response.content
+                        uow.add_message("assistant", reply_text)
 
-                logger.info(f"Solicitando respuesta final de IA tras herramientas para {user_id}...")
-                final_response = self.ai.get_agent_response(messages, TOOLS)
-                reply_text = final_response.content
-                HistoryManager.save_message(user_id, "assistant", reply_text)
+            # Fuera del turno: pliega en el resumen los mensajes que ya quedaron fuera de la ventana
+            SummaryManager.schedule(user_id, self.ai)
 
             logger.info(f"Enviando respuesta a {user_id}: {reply_text[:50] if reply_text else 'None'}...")
-            await update.message.reply_text(reply_text or "No recibí respuesta de la IA.")
+            if reply is not None:
+                await reply.finish(reply_text or "No recibí respuesta de la IA.")
+            else:
+                await update.message.reply_text(reply_text or "No recibí respuesta de la IA.")
             
         except Exception as e:
             logger.error(f"Error en message_handler: {e}")
             logger.error(traceback.format_exc())
-            await update.message.reply_text(f"⚠️ Error interno: {type(e).__name__}: {str(e)[:300]}")
+            error_text = f"⚠️ Error interno: {type(e).__name__}: {str(e)[:300]}"
+            if reply is not None:
+                # Reemplaza la respuesta parcial, si ya se había mostrado algo
+                await reply.finish(error_text)
+            else:
+                await update.message.reply_text(error_text)
 
     def send_message(self, chat_id, text):
         # Implementado mediante inyección en main.py (context.bot.send_message)
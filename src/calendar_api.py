@@ -2,25 +2,44 @@ import uuid
 from datetime import datetime, timedelta, timezone
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 import pytz
 import logging
 
 logger = logging.getLogger(__name__)
 
+class SyncTokenExpired(Exception):
+    """Google invalidó el syncToken (410 Gone): hay que hacer una sincronización completa"""
+
 class CalendarService:
-    def __init__(self, credentials=None):
+    # Máximo de eventos por página que acepta events.list
+    LIST_PAGE_SIZE = 250
+    # Máximo de llamadas por request batch en la API de Calendar
+    BATCH_SIZE = 50
+
+    def __init__(self, credentials=None, service=None):
         self.scopes = ['https://www.googleapis.com/auth/calendar']
         from src.config import TIMEZONE_STR, CALENDAR_ID
         
         self.calendar_id = CALENDAR_ID or "primary"
         self.creds = credentials
-        if self.creds:
+        if service is not None:
+            # Cliente ya construido (pool de src.google_clients)
+            self.service = service
+        elif self.creds:
             self.service = build('calendar', 'v3', credentials=self.creds)
         else:
             self.service = None
             logger.warning("CalendarService inicializado sin credenciales.")
         
         self.timezone = TIMEZONE_STR
+        self._events_resource = None
+
+    def _events(self):
+        # service.events() arma el recurso (y sus docstrings) en cada llamada: se reutiliza
+        if self._events_resource is None:
+            self._events_resource = self.service.events()
+        return self._events_resource
 
     def create_event(self, summary, start_time: datetime, end_time: datetime = None, description="", user_emails=None, enable_meet=False):
         try:
@@ -60,7 +79,7 @@ class CalendarService:
                 }
 
             logger.info(f"Insertando evento en calendario {self.calendar_id}: {summary}")
-            event = self.service.events().insert(
+            event = self._events().insert(
                 calendarId=self.calendar_id, 
                 body=event,
                 sendUpdates='all',
@@ -77,7 +96,7 @@ class CalendarService:
                 time_min = datetime.now(timezone.utc).isoformat()
             
             logger.info(f"Listando eventos en calendario {self.calendar_id} desde {time_min}")
-            events_result = self.service.events().list(
+            events_result = self._events().list(
                 calendarId=self.calendar_id, timeMin=time_min,
                 maxResults=max_results, singleEvents=True,
                 orderBy='startTime'
@@ -87,9 +106,40 @@ class CalendarService:
             logger.error(f"Error en list_events: {e}")
             raise e
 
+    def sync_events(self, sync_token=None, time_min=None):
+        """
+        Cambios del calendario desde 'sync_token' (o todos los eventos si es None).
+
+        En la sincronización completa 'time_min' (ISO) deja afuera lo que terminó
+        antes: sin él se recorre toda la historia del calendario. Con un token no
+        se envía, Google conserva el filtro de la sincronización inicial.
+
+        Recorre todas las páginas y devuelve (eventos, next_sync_token). En modo
+        incremental los eventos borrados llegan con status 'cancelled'. Lanza
+        SyncTokenExpired si Google ya no acepta el token.
+        """
+        items = []
+        page_token = None
+        bounds = {} if sync_token or not time_min else {"timeMin": time_min}
+        try:
+            while True:
+                result = self._events().list(
+                    calendarId=self.calendar_id, syncToken=sync_token, pageToken=page_token,
+                    maxResults=self.LIST_PAGE_SIZE, singleEvents=True, **bounds,
+                    fields='nextPageToken,nextSyncToken,items(id,status,summary,start,end,transparency)'
+                ).execute()
+                items.extend(result.get('items', []))
+                page_token = result.get('nextPageToken')
+                if not page_token:
+                    return items, result.get('nextSyncToken')
+        except HttpError as e:
+            if sync_token and e.resp.status == 410:
+                raise SyncTokenExpired() from e
+            raise
+
     def update_event(self, event_id, summary=None, start_time=None, end_time=None):
         try:
-            event = self.service.events().get(calendarId=self.calendar_id, eventId=event_id).execute()
+            event = self._events().get(calendarId=self.calendar_id, eventId=event_id).execute()
             
             if summary:
                 event['summary'] = summary
@@ -107,7 +157,7 @@ class CalendarService:
                 event['end']['dateTime'] = end_time.isoformat()
 
             logger.info(f"Actualizando evento {event_id} en calendario {self.calendar_id}")
-            updated_event = self.service.events().update(calendarId=self.calendar_id, eventId=event_id, body=event).execute()
+            updated_event = self._events().update(calendarId=self.calendar_id, eventId=event_id, body=event).execute()
             return updated_event
         except Exception as e:
             logger.error(f"Error en update_event: {e}")
@@ -116,7 +166,7 @@ class CalendarService:
     def delete_event(self, event_id):
         try:
             logger.info(f"Eliminando evento {event_id} en calendario {self.calendar_id}")
-            self.service.events().delete(calendarId=self.calendar_id, eventId=event_id).execute()
+            self._events().delete(calendarId=self.calendar_id, eventId=event_id).execute()
             return True
         except Exception as e:
             # Si el código es 404 o 410, ya se borró, no es un error fatal
@@ -126,28 +176,100 @@ class CalendarService:
             logger.error(f"Error en delete_event: {e}")
             raise e
 
+    def list_future_event_ids(self):
+        """Ids de todos los eventos futuros, recorriendo todas las páginas de la API"""
+        time_min = datetime.now(timezone.utc).isoformat()
+        event_ids = []
+        page_token = None
+        while True:
+            result = self._events().list(
+                calendarId=self.calendar_id, timeMin=time_min,
+                maxResults=self.LIST_PAGE_SIZE, singleEvents=True,
+                pageToken=page_token, fields='nextPageToken,items(id)'
+            ).execute()
+            event_ids.extend(item['id'] for item in result.get('items', []))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return event_ids
+
     def delete_all_events(self):
-        """Elimina todos los eventos futuros del calendario del usuario"""
+        """
+        Elimina todos los eventos futuros del calendario del usuario.
+
+        Los borrados van en requests batch de hasta BATCH_SIZE eventos. Devuelve los
+        ids efectivamente eliminados (incluye los que Google ya no tenía: 404/410);
+        los que fallan por otro motivo se registran y se omiten.
+        """
         try:
-            events = self.list_events() # list_events ya usa datetime.now(timezone.utc)
-            deleted_count = 0
-            for event in events:
-                self.delete_event(event['id'])
-                deleted_count += 1
-            return deleted_count
+            event_ids = self.list_future_event_ids()
+            logger.info(f"Eliminando {len(event_ids)} eventos en calendario {self.calendar_id}")
+            deleted = []
+            failed = []
+
+            def on_response(request_id, response, exception):
+                if exception is None or getattr(getattr(exception, 'resp', None), 'status', None) in (404, 410):
+                    deleted.append(request_id)
+                else:
+                    failed.append(request_id)
+                    logger.warning(f"No se pudo eliminar el evento {request_id}: {exception}")
+
+            for i in range(0, len(event_ids), self.BATCH_SIZE):
+                batch = self.service.new_batch_http_request(callback=on_response)
+                for event_id in event_ids[i:i + self.BATCH_SIZE]:
+                    batch.add(
+                        self._events().delete(calendarId=self.calendar_id, eventId=event_id),
+                        request_id=event_id
+                    )
+                batch.execute()
+
+            if failed:
+                logger.error(f"delete_all_events: {len(failed)} eventos no se pudieron eliminar")
+            return deleted
         except Exception as e:
             logger.error(f"Error en delete_all_events: {e}")
             raise e
 
-    def check_conflicts(self, start_time: datetime, end_time: datetime):
-        events = self.list_events(time_min=start_time.isoformat() + 'Z')
-        for event in events:
-            ev_start = event['start'].get('dateTime') or event['start'].get('date')
-            ev_end = event['end'].get('dateTime') or event['end'].get('date')
-            
-            # Simple overlap check
-            # (StartA < EndB) and (EndA > StartB)
-            # This needs proper parsing of the event times
-            # For brevity in this agentic flow, I'll keep it simple or implement a more robust one if needed
-            pass
-        return False # Placeholder
+    def free_busy(self, time_min: datetime, time_max: datetime, emails=None):
+        """
+        Una consulta freebusy para el calendario del usuario y los correos dados.
+
+        Devuelve (ocupados, errores): la lista de (inicio, fin) aware de todos los
+        calendarios consultados y los calendarios que Google no pudo consultar.
+        """
+        items = [{'id': self.calendar_id}] + [{'id': email.strip()} for email in (emails or []) if email.strip()]
+        result = self.service.freebusy().query(body={
+            'timeMin': time_min.isoformat(),
+            'timeMax': time_max.isoformat(),
+            'timeZone': self.timezone,
+            'items': items,
+        }).execute()
+
+        busy = []
+        errors = {}
+        for calendar_id, info in result.get('calendars', {}).items():
+            if info.get('errors'):
+                errors[calendar_id] = info['errors'][0].get('reason', 'error')
+                continue
+            for block in info.get('busy', []):
+                busy.append((
+                    datetime.fromisoformat(block['start'].replace('Z', '+00:00')),
+                    datetime.fromisoformat(block['end'].replace('Z', '+00:00'))
+                ))
+        return busy, errors
+
+    def check_conflicts(self, start_time: datetime, end_time: datetime, exclude_event_id=None):
+        """Eventos que se solapan con [start_time, end_time) consultando directo a Google"""
+        if start_time.tzinfo is None:
+            start_time = start_time.replace(tzinfo=timezone.utc)
+        if end_time.tzinfo is None:
+            end_time = end_time.replace(tzinfo=timezone.utc)
+        # Con timeMin/timeMax Google devuelve justo los eventos que terminan después
+        # del inicio y empiezan antes del fin, es decir, los que se solapan
+        result = self._events().list(
+            calendarId=self.calendar_id, timeMin=start_time.isoformat(), timeMax=end_time.isoformat(),
+            singleEvents=True, orderBy='startTime', maxResults=self.LIST_PAGE_SIZE
+        ).execute()
+        return [
+            event for event in result.get('items', [])
+            if event.get('id') != exclude_event_id and event.get('transparency') != 'transparent'
+        ]
@@ -0,0 +1,302 @@
+import asyncio
+import logging
+import weakref
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select
+from src.config import (
+    TIMEZONE, TIMEZONE_STR, CALENDAR_SYNC_MAX_AGE_SECONDS, CALENDAR_SYNC_CONCURRENCY, CALENDAR_SYNC_LOOKBACK_HOURS
+)
+from src.database import AsyncSessionLocal, Appointment, CalendarEvent, CalendarSyncState, UserAuth, session_lock
+from src.calendar_api import SyncTokenExpired
+from src.conflicts import ConflictChecker
+from src.google_clients import run_google_io
+from src.reminders import refresh_next_reminder, reset_reminders
+
+logger = logging.getLogger(__name__)
+
+# Un lock por usuario: el turno en curso lo toma para que la sincronización en
+# segundo plano no escriba las mismas filas a la vez (ver TelegramBot.message_handler).
+# Referencias débiles: el lock vive mientras alguien lo tiene o lo espera
+_user_locks = weakref.WeakValueDictionary()
+
+_CHUNK = 500
+
+
+@asynccontextmanager
+async def _session_scope(db=None):
+    """La sesión recibida (la del turno, sin commit y de a una tarea) o una propia con commit al salir"""
+    if db is not None:
+        async with session_lock(db):
+            yield db
+        return
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+def _to_utc_naive(value: str) -> datetime:
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _date_to_utc_naive(value: str) -> datetime:
+    # Los eventos de día completo empiezan a medianoche de la zona horaria del bot
+    local = TIMEZONE.localize(datetime.fromisoformat(value))
+    return local.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def parse_event_times(event):
+    """(inicio, fin, día completo, fecha) de un evento de Google, con horas en naive UTC"""
+    start = event.get('start', {})
+    end = event.get('end', {})
+    if 'dateTime' in start:
+        start_time = _to_utc_naive(start['dateTime'])
+        end_time = _to_utc_naive(end['dateTime']) if 'dateTime' in end else start_time + timedelta(hours=1)
+        return start_time, end_time, False, None
+    start_time = _date_to_utc_naive(start['date'])
+    end_time = _date_to_utc_naive(end['date']) if 'date' in end else start_time + timedelta(days=1)
+    return start_time, end_time, True, start['date']
+
+
+class CalendarSync:
+    """
+    Copia local (tabla calendar_events) del Google Calendar de cada usuario.
+
+    Se mantiene con la sincronización incremental de Google: cada pasada pide
+    solo los cambios desde el último syncToken y, si Google lo invalida (410),
+    rehace la copia completa. Los cambios también actualizan las citas de
+    Appointment, así los recordatorios siguen a eventos creados o movidos
+    directamente en Google Calendar.
+    """
+
+    @staticmethod
+    def user_lock(telegram_id: str) -> asyncio.Lock:
+        lock = _user_locks.get(telegram_id)
+        if lock is None:
+            lock = _user_locks[telegram_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    async def load_rows(session, model, event_ids, telegram_id=None):
+        """
+        Filas de 'model' por event_id vistas desde la sesión: incluye las agregadas
+        y excluye las borradas que aún no se enviaron a la DB (autoflush está apagado).
+        """
+        rows = {}
+        event_ids = list(event_ids)
+        for i in range(0, len(event_ids), _CHUNK):
+            query = select(model).where(model.event_id.in_(event_ids[i:i + _CHUNK]))
+            if telegram_id is not None:
+                query = query.where(model.telegram_id == telegram_id)
+            for row in await session.scalars(query):
+                if row not in session.deleted:
+                    rows[row.event_id] = row
+        wanted = set(event_ids)
+        for obj in session.new:
+            if isinstance(obj, model) and obj.event_id in wanted and (telegram_id is None or obj.telegram_id == telegram_id):
+                rows[obj.event_id] = obj
+        return rows
+
+    @staticmethod
+    async def discard(session, row):
+        """Borra una fila de load_rows: si se agregó en esta sesión y no se envió a la DB, basta con sacarla"""
+        if row in session.new:
+            session.expunge(row)
+        else:
+            await session.delete(row)
+
+    @staticmethod
+    def _apply_to_mirror(session, telegram_id: str, event, row=None):
+        start_time, end_time, all_day, start_date = parse_event_times(event)
+        if row is None:
+            row = CalendarEvent(telegram_id=telegram_id, event_id=event['id'])
+            session.add(row)
+        row.summary = event.get('summary')
+        row.start_time = start_time
+        row.end_time = end_time
+        row.all_day = all_day
+        row.start_date = start_date
+        row.transparent = event.get('transparency') == 'transparent'
+        row.updated_at = datetime.utcnow()
+        return row
+
+    @staticmethod
+    async def upsert_events(session, telegram_id: str, events):
+        """Escribe en la copia local los eventos devueltos por Google (create / update)"""
+        ConflictChecker.invalidate(telegram_id)
+        existing = await CalendarSync.load_rows(session, CalendarEvent, [e['id'] for e in events], telegram_id)
+        for event in events:
+            CalendarSync._apply_to_mirror(session, telegram_id, event, existing.get(event['id']))
+
+    @staticmethod
+    async def remove_events(session, telegram_id: str, event_ids):
+        ConflictChecker.invalidate(telegram_id)
+        for row in (await CalendarSync.load_rows(session, CalendarEvent, event_ids, telegram_id)).values():
+            await CalendarSync.discard(session, row)
+
+    @staticmethod
+    async def _apply_to_appointments(session, telegram_id: str, events, now_utc: datetime):
+        """Crea, mueve o borra las citas con recordatorio según los cambios de Google"""
+        appointments = await CalendarSync.load_rows(session, Appointment, [e['id'] for e in events])
+        for event in events:
+            appt = appointments.get(event['id'])
+            if appt is not None and appt.telegram_id != telegram_id:
+                # Evento compartido que ya sigue otro usuario
+                continue
+            if event.get('status') == 'cancelled':
+                if appt is not None:
+                    await CalendarSync.discard(session, appt)
+                continue
+
+            start_time, end_time, all_day, _ = parse_event_times(event)
+            if all_day:
+                continue
+            if appt is None:
+                if start_time <= now_utc:
+                    continue
+                appt = Appointment(
+                    telegram_id=telegram_id, event_id=event['id'],
+                    rem_24h_sent=False, rem_3h_sent=False, rem_1h_sent=False, rem_15m_sent=False
+                )
+                session.add(appt)
+            elif appt.start_time == start_time:
+                appt.title = event.get('summary') or appt.title
+                appt.end_time = end_time
+                continue
+            else:
+                # La cita se movió en Google: los recordatorios vuelven a empezar
+                reset_reminders(appt)
+
+            appt.title = event.get('summary') or "(Sin título)"
+            appt.start_time = start_time
+            appt.end_time = end_time
+            refresh_next_reminder(appt, session)
+
+    @staticmethod
+    async def apply_changes(session, telegram_id: str, calendar_id: str, items, sync_token, full: bool):
+        now_utc = datetime.utcnow()
+        cancelled = [e['id'] for e in items if e.get('status') == 'cancelled']
+        active = [e for e in items if e.get('status') != 'cancelled']
+
+        await CalendarSync.upsert_events(session, telegram_id, active)
+        await CalendarSync.remove_events(session, telegram_id, cancelled)
+        await CalendarSync._apply_to_appointments(session, telegram_id, items, now_utc)
+
+        ConflictChecker.invalidate(telegram_id)
+        if full:
+            # La lista completa es la verdad: se descarta lo que ya no existe en Google
+            synced = {e['id'] for e in active}
+            for row in await session.scalars(select(CalendarEvent).where(CalendarEvent.telegram_id == telegram_id)):
+                if row.event_id not in synced:
+                    await session.delete(row)
+            for appt in await session.scalars(select(Appointment).where(
+                Appointment.telegram_id == telegram_id,
+                Appointment.start_time > now_utc
+            )):
+                if appt.event_id not in synced:
+                    await session.delete(appt)
+
+        state = await CalendarSync._get_state(session, telegram_id)
+        if state is None:
+            state = next((obj for obj in session.new
+                          if isinstance(obj, CalendarSyncState) and obj.telegram_id == telegram_id), None)
+        if state is None:
+            state = CalendarSyncState(telegram_id=telegram_id)
+            session.add(state)
+        state.calendar_id = calendar_id
+        state.sync_token = sync_token
+        state.last_synced_at = now_utc
+
+    @staticmethod
+    async def _get_state(session, telegram_id: str):
+        return (await session.scalars(
+            select(CalendarSyncState).where(CalendarSyncState.telegram_id == telegram_id)
+        )).first()
+
+    @staticmethod
+    async def sync_user(telegram_id: str, calendar_service, db=None):
+        """
+        Trae los cambios de Google y los aplica a la copia local.
+
+        Con 'db' (sesión del turno) los cambios se confirman con el resto del turno.
+        """
+        async with _session_scope(db) as session:
+            state = await CalendarSync._get_state(session, telegram_id)
+            token = None
+            if state is not None and state.calendar_id == calendar_service.calendar_id:
+                token = state.sync_token
+
+        full = token is None
+        time_min = (datetime.now(timezone.utc) - timedelta(hours=CALENDAR_SYNC_LOOKBACK_HOURS)).isoformat()
+        try:
+            items, next_token = await run_google_io(calendar_service.sync_events, token, time_min)
+        except SyncTokenExpired:
+            logger.info(f"syncToken vencido para {telegram_id}, sincronización completa")
+            full = True
+            items, next_token = await run_google_io(calendar_service.sync_events, None, time_min)
+
+        async with _session_scope(db) as session:
+            await CalendarSync.apply_changes(session, telegram_id, calendar_service.calendar_id, items, next_token, full)
+        logger.info(f"Calendario de {telegram_id} sincronizado ({'completo' if full else 'incremental'}, {len(items)} cambios)")
+
+    @staticmethod
+    async def ensure_fresh(telegram_id: str, calendar_service, db=None):
+        """Sincroniza si la copia local no existe, es de otro calendario o es vieja"""
+        async with _session_scope(db) as session:
+            state = await CalendarSync._get_state(session, telegram_id)
+            fresh = (
+                state is not None and state.last_synced_at is not None
+                and state.calendar_id == calendar_service.calendar_id
+                and datetime.utcnow() - state.last_synced_at <= timedelta(seconds=CALENDAR_SYNC_MAX_AGE_SECONDS)
+            )
+        if not fresh:
+            await CalendarSync.sync_user(telegram_id, calendar_service, db=db)
+
+    @staticmethod
+    def render_start(row):
+        if row.all_day:
+            return {"date": row.start_date}
+        start_local = row.start_time.replace(tzinfo=timezone.utc).astimezone(TIMEZONE)
+        return {"dateTime": start_local.isoformat(), "timeZone": TIMEZONE_STR}
+
+    @staticmethod
+    async def list_events(telegram_id: str, time_min: datetime, max_results: int = 10, db=None):
+        """Próximos eventos desde la copia local, con la forma que devuelve events.list"""
+        async with _session_scope(db) as session:
+            rows = (await session.scalars(select(CalendarEvent).where(
+                CalendarEvent.telegram_id == telegram_id,
+                CalendarEvent.end_time > time_min
+            ).order_by(CalendarEvent.start_time.asc()).limit(max_results))).all()
+            return [{"id": r.event_id, "summary": r.summary, "start": CalendarSync.render_start(r)} for r in rows]
+
+    @staticmethod
+    async def sync_all(get_calendar_service):
+        """
+        Sincroniza a todos los usuarios con cuenta vinculada. Los que tienen un
+        turno en curso se saltan: su turno ya sincroniza al listar.
+        """
+        async with AsyncSessionLocal() as db:
+            user_ids = (await db.scalars(select(UserAuth.telegram_id))).all()
+
+        semaphore = asyncio.Semaphore(CALENDAR_SYNC_CONCURRENCY)
+
+        async def sync_one(telegram_id):
+            lock = CalendarSync.user_lock(telegram_id)
+            if lock.locked():
+                return
+            async with semaphore, lock:
+                try:
+                    calendar_service = await get_calendar_service(telegram_id)
+                    if calendar_service is not None:
+                        await CalendarSync.sync_user(telegram_id, calendar_service)
+                except Exception as e:
+                    logger.error(f"Error sincronizando el calendario de {telegram_id}: {e}")
+
+        await asyncio.gather(*(sync_one(telegram_id) for telegram_id in user_ids))
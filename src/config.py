@@ -1,4 +1,5 @@
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 import pytz
 
@@ -24,11 +25,116 @@ CALENDAR_ID = os.getenv("CALENDAR_ID", "primary")
 GOOGLE_CLIENT_ID = clean_env_var(os.getenv("GOOGLE_CLIENT_ID"))
 GOOGLE_CLIENT_SECRET = clean_env_var(os.getenv("GOOGLE_CLIENT_SECRET"))
 
+# Cache de credenciales de Google por usuario (segundos antes de releer la DB y
+# usuarios retenidos). Un usuario sin cuenta vinculada no se cachea
+CREDENTIAL_CACHE_TTL_SECONDS = float(os.getenv("CREDENTIAL_CACHE_TTL_SECONDS", "300"))
+CREDENTIAL_CACHE_MAX_USERS = int(os.getenv("CREDENTIAL_CACHE_MAX_USERS", "1000"))
+
+# Pool de clientes de Google: usuarios retenidos, expiración por inactividad,
+# conexiones keep-alive por usuario y timeout HTTP (segundos)
+GOOGLE_POOL_MAX_USERS = int(os.getenv("GOOGLE_POOL_MAX_USERS", "500"))
+GOOGLE_POOL_IDLE_SECONDS = float(os.getenv("GOOGLE_POOL_IDLE_SECONDS", "900"))
+GOOGLE_POOL_CONNECTIONS = int(os.getenv("GOOGLE_POOL_CONNECTIONS", "4"))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "30"))
+# Hilos para las llamadas bloqueantes a Google (compartidos por todos los turnos)
+GOOGLE_IO_MAX_WORKERS = int(os.getenv("GOOGLE_IO_MAX_WORKERS", "32"))
+
+# Copia local del calendario: cada cuánto se sincronizan todos los usuarios, antigüedad
+# máxima antes de resincronizar al listar, usuarios sincronizados a la vez y desde
+# cuántas horas atrás trae eventos la sincronización completa (los incrementales
+# mantienen el mismo filtro)
+CALENDAR_SYNC_INTERVAL_SECONDS = float(os.getenv("CALENDAR_SYNC_INTERVAL_SECONDS", "300"))
+CALENDAR_SYNC_MAX_AGE_SECONDS = float(os.getenv("CALENDAR_SYNC_MAX_AGE_SECONDS", "60"))
+CALENDAR_SYNC_CONCURRENCY = int(os.getenv("CALENDAR_SYNC_CONCURRENCY", "8"))
+CALENDAR_SYNC_LOOKBACK_HOURS = float(os.getenv("CALENDAR_SYNC_LOOKBACK_HOURS", "24"))
+
 # Settings
 TIMEZONE_STR = os.getenv("TIMEZONE", "America/Bogota")
 TIMEZONE = pytz.timezone(TIMEZONE_STR)
+# Horario laboral para proponer horarios libres (hora local de TIMEZONE; días 0=lunes ... 6=domingo)
+WORK_DAY_START = datetime.strptime(os.getenv("WORK_DAY_START", "09:00"), "%H:%M").time()
+WORK_DAY_END = datetime.strptime(os.getenv("WORK_DAY_END", "18:00"), "%H:%M").time()
+WORK_DAYS = {int(d) for d in os.getenv("WORK_DAYS", "0,1,2,3,4").split(",") if d.strip()}
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./appointments.db")
 
+# Pool del engine asíncrono de la base de datos: conexiones fijas, extra en picos,
+# espera máxima por una conexión libre y reciclado de conexiones viejas (segundos)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "32"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "16"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+# Gemini: límites de concurrencia y tiempo máximo por llamada
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "60"))
+
+# Respuestas en streaming: el mensaje de Telegram se edita a medida que llega el texto
+GEMINI_STREAMING = os.getenv("GEMINI_STREAMING", "true").lower() == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.0"))
+GEMINI_STATS_WINDOW = int(os.getenv("GEMINI_STATS_WINDOW", "500"))
+
+# Cache de contexto de Gemini (system prompt + herramientas): vida de cada entrada
+# y espera antes de reintentar si la API de caching falla
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() == "true"
+GEMINI_CACHE_TTL_SECONDS = int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "3600"))
+GEMINI_CACHE_RETRY_SECONDS = float(os.getenv("GEMINI_CACHE_RETRY_SECONDS", "600"))
+
+# Procesamiento concurrente de updates de Telegram
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "1024"))
+
+# Bandeja de entrada del webhook (persistencia y workers en segundo plano)
+INBOX_WORKERS = int(os.getenv("INBOX_WORKERS", "32"))
+INBOX_POLL_SECONDS = float(os.getenv("INBOX_POLL_SECONDS", "5"))
+# Intentos por update: cuentan los errores al leerlo o entregarlo y las excepciones
+# que un handler no atrapa (las que manejó el propio handler no se reintentan)
+INBOX_MAX_ATTEMPTS = int(os.getenv("INBOX_MAX_ATTEMPTS", "3"))
+INBOX_RETENTION_HOURS = int(os.getenv("INBOX_RETENTION_HOURS", "24"))
+# Lease de los updates en proceso: la réplica que los reclamó lo renueva mientras
+# trabaja; si se cae, al vencer vuelven a la cola para cualquier otra réplica
+INBOX_LEASE_SECONDS = float(os.getenv("INBOX_LEASE_SECONDS", "300"))
+
+# Notas de voz: tamaño y duración máximos, y transcripciones recordadas (por file_unique_id)
+AUDIO_MAX_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIO_MAX_SECONDS = int(os.getenv("AUDIO_MAX_SECONDS", "300"))
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "1000"))
+
+# Cache en memoria del historial de conversación
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+HISTORY_CACHE_TTL_SECONDS = float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "1800"))
+HISTORY_CACHE_MAX_MESSAGES = int(os.getenv("HISTORY_CACHE_MAX_MESSAGES", "60"))
+
+# Ventana del historial enviada a Gemini: presupuesto de tokens (estimados) y
+# máximo de mensajes a considerar. La estimación local se calibra con
+# count_tokens de Gemini cada TOKEN_CALIBRATION_EVERY llamadas (0 = nunca)
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "60"))
+TOKEN_CHARS_PER_TOKEN = float(os.getenv("TOKEN_CHARS_PER_TOKEN", "4"))
+TOKEN_CALIBRATION_EVERY = int(os.getenv("TOKEN_CALIBRATION_EVERY", "50"))
+
+# Resumen de la conversación antigua: cuando hay al menos SUMMARY_BATCH_MESSAGES
+# mensajes sin resumir anteriores a la ventana del historial (la que entra en
+# HISTORY_TOKEN_BUDGET), se pliegan en el resumen (hasta SUMMARY_MAX_FOLD_MESSAGES por pasada)
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "20"))
+SUMMARY_MAX_FOLD_MESSAGES = int(os.getenv("SUMMARY_MAX_FOLD_MESSAGES", "200"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "600"))
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1000"))
+
+# Usuarios con el historial ya convertido al formato de Gemini en memoria
+CONTENT_MEMO_USERS = int(os.getenv("CONTENT_MEMO_USERS", "1000"))
+
+# Recordatorios: espera máxima entre revisiones, lote por revisión y reintento tras un fallo
+REMINDER_MAX_SLEEP_SECONDS = float(os.getenv("REMINDER_MAX_SLEEP_SECONDS", "300"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+REMINDER_RETRY_SECONDS = float(os.getenv("REMINDER_RETRY_SECONDS", "60"))
+REMINDER_LEASE_SECONDS = float(os.getenv("REMINDER_LEASE_SECONDS", "120"))
+
+# Límites de envío de Telegram (mensajes por segundo) y reintentos ante 429
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_PER_CHAT_RATE = float(os.getenv("TELEGRAM_PER_CHAT_RATE", "1"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "3"))
+
 # Validation
 if not GEMINI_API_KEY:
     print("Warning: GEMINI_API_KEY not found in environment variables.")
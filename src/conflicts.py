@@ -0,0 +1,126 @@
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from src.config import CALENDAR_SYNC_MAX_AGE_SECONDS
+from src.database import CalendarEvent
+
+# Límites de duración de cada nivel del índice. Separar por duración mantiene
+# chica la ventana de búsqueda aunque haya eventos de varios días o semanas
+_TIER_LIMITS = [timedelta(hours=12), timedelta(days=3), timedelta(days=14), timedelta(days=90), None]
+
+
+class _Tier:
+    def __init__(self, intervals):
+        intervals.sort(key=lambda interval: interval[0])
+        self.starts = [s for s, _, _ in intervals]
+        self.ends = [e for _, e, _ in intervals]
+        self.items = [i for _, _, i in intervals]
+        self.max_len = max((e - s for s, e, _ in intervals), default=timedelta(0))
+
+    def overlaps(self, start, end):
+        lo = bisect_left(self.starts, start - self.max_len)
+        hi = bisect_left(self.starts, end)
+        return [(self.starts[i], self.items[i]) for i in range(lo, hi) if self.ends[i] > start]
+
+
+class IntervalIndex:
+    """
+    Índice de intervalos [inicio, fin) sobre arreglos ordenados por inicio.
+
+    Un evento de duración <= max_len que se solapa con [start, end) tiene que
+    empezar en [start - max_len, end), así que una consulta son dos bisect más
+    el recorrido de esa ventana: O(log n + k). Para que un evento largo no
+    agrande la ventana de todos, los eventos se reparten en niveles por duración,
+    cada uno con su propio max_len.
+    """
+
+    def __init__(self, intervals):
+        buckets = [[] for _ in _TIER_LIMITS]
+        for start, end, item in intervals:
+            length = end - start
+            tier = next(i for i, limit in enumerate(_TIER_LIMITS) if limit is None or length <= limit)
+            buckets[tier].append((start, end, item))
+        self._tiers = [_Tier(bucket) for bucket in buckets if bucket]
+
+    def __len__(self):
+        return sum(len(tier.starts) for tier in self._tiers)
+
+    def overlaps(self, start: datetime, end: datetime):
+        """Elementos cuyo intervalo se cruza con [start, end), ordenados por inicio"""
+        found = []
+        for tier in self._tiers:
+            found.extend(tier.overlaps(start, end))
+        found.sort(key=lambda pair: pair[0])
+        return [item for _, item in found]
+
+
+class ConflictChecker:
+    """
+    Índices por usuario construidos desde la copia local del calendario
+    (calendar_events). CalendarSync los invalida cada vez que cambia la copia.
+    """
+
+    MAX_USERS = 1000
+
+    _indexes = OrderedDict()
+
+    @staticmethod
+    def invalidate(telegram_id: str):
+        ConflictChecker._indexes.pop(telegram_id, None)
+
+    @staticmethod
+    def _pending_changes(session, telegram_id: str) -> bool:
+        return any(
+            isinstance(obj, CalendarEvent) and obj.telegram_id == telegram_id
+            for obj in (*session.new, *session.dirty, *session.deleted)
+        )
+
+    @staticmethod
+    async def _build(session, telegram_id: str) -> IntervalIndex:
+        now_utc = datetime.utcnow()
+        rows = (await session.execute(select(
+            CalendarEvent.event_id, CalendarEvent.summary, CalendarEvent.start_time, CalendarEvent.end_time,
+            CalendarEvent.all_day, CalendarEvent.start_date
+        ).where(
+            CalendarEvent.telegram_id == telegram_id,
+            CalendarEvent.end_time > now_utc,
+            CalendarEvent.transparent.isnot(True)
+        ))).all()
+        intervals = {row.event_id: (row.start_time, row.end_time, row) for row in rows}
+        # Cambios del turno que aún no están en la DB (autoflush apagado)
+        for obj in session.deleted:
+            if isinstance(obj, CalendarEvent) and obj.telegram_id == telegram_id:
+                intervals.pop(obj.event_id, None)
+        for obj in (*session.new, *session.dirty):
+            if isinstance(obj, CalendarEvent) and obj.telegram_id == telegram_id and obj not in session.deleted:
+                if obj.transparent or obj.end_time <= now_utc:
+                    intervals.pop(obj.event_id, None)
+                else:
+                    intervals[obj.event_id] = (obj.start_time, obj.end_time, obj)
+        return IntervalIndex(intervals.values())
+
+    @staticmethod
+    async def get_index(session, telegram_id: str) -> IntervalIndex:
+        if ConflictChecker._pending_changes(session, telegram_id):
+            # Con cambios sin confirmar el índice solo vale para este turno: no se guarda
+            return await ConflictChecker._build(session, telegram_id)
+
+        cached = ConflictChecker._indexes.get(telegram_id)
+        if cached is not None and time.monotonic() - cached[1] <= CALENDAR_SYNC_MAX_AGE_SECONDS:
+            ConflictChecker._indexes.move_to_end(telegram_id)
+            return cached[0]
+
+        index = await ConflictChecker._build(session, telegram_id)
+        ConflictChecker._indexes[telegram_id] = (index, time.monotonic())
+        ConflictChecker._indexes.move_to_end(telegram_id)
+        while len(ConflictChecker._indexes) > ConflictChecker.MAX_USERS:
+            ConflictChecker._indexes.popitem(last=False)
+        return index
+
+    @staticmethod
+    async def find(session, telegram_id: str, start: datetime, end: datetime, exclude_event_id: str = None):
+        """Eventos del usuario que se solapan con [start, end) (naive UTC)"""
+        found = (await ConflictChecker.get_index(session, telegram_id)).overlaps(start, end)
+        return [row for row in found if row.event_id != exclude_event_id]
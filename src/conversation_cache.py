@@ -0,0 +1,122 @@
+import json
+import time
+from collections import OrderedDict
+from src.config import HISTORY_CACHE_MAX_BYTES, HISTORY_CACHE_TTL_SECONDS, HISTORY_CACHE_MAX_MESSAGES
+
+# Sobrecosto aproximado de un dict de mensaje en memoria, además del texto
+_MESSAGE_OVERHEAD_BYTES = 240
+
+
+def _message_size(msg: dict) -> int:
+    return len(json.dumps(msg, ensure_ascii=False)) + _MESSAGE_OVERHEAD_BYTES
+
+
+class _Entry:
+    __slots__ = ("messages", "complete", "size", "last_access")
+
+    def __init__(self, messages, complete):
+        self.messages = messages
+        # True si 'messages' contiene el historial completo del usuario
+        self.complete = complete
+        self.size = sum(_message_size(m) for m in messages)
+        self.last_access = time.monotonic()
+
+
+class ConversationCache:
+    """
+    Cache en memoria de la cola reciente del historial de cada usuario.
+
+    LRU acotado por bytes totales, con expiración de usuarios inactivos. Las
+    escrituras pasan primero por la base de datos y luego se agregan aquí
+    (write-through), así que un usuario activo no vuelve a leer de la DB.
+    Los mensajes cacheados se comparten con quien los lee: no deben mutarse.
+    """
+
+    def __init__(self, max_bytes: int = HISTORY_CACHE_MAX_BYTES, ttl_seconds: float = HISTORY_CACHE_TTL_SECONDS,
+                 max_messages: int = HISTORY_CACHE_MAX_MESSAGES):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, user_id: str, min_messages: int):
+        """Devuelve la cola cacheada si alcanza para 'min_messages' mensajes, o None"""
+        entry = self._entries.get(user_id)
+        now = time.monotonic()
+        if entry is not None and now - entry.last_access > self.ttl_seconds:
+            self._remove(user_id)
+            entry = None
+        if entry is None or (not entry.complete and len(entry.messages) < min_messages):
+            self._misses += 1
+            return None
+
+        entry.last_access = now
+        self._entries.move_to_end(user_id)
+        self._hits += 1
+        return entry.messages
+
+    def put(self, user_id: str, messages: list, complete: bool):
+        self._remove(user_id)
+        entry = _Entry(list(messages), complete)
+        self._trim(entry)
+        self._entries[user_id] = entry
+        self._bytes += entry.size
+        self._evict()
+
+    def append(self, user_id: str, messages: list):
+        """Agrega mensajes ya persistidos; si el usuario no está en cache no hace nada"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        for msg in messages:
+            entry.messages.append(msg)
+            size = _message_size(msg)
+            entry.size += size
+            self._bytes += size
+        before = entry.size
+        self._trim(entry)
+        self._bytes -= before - entry.size
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(user_id)
+        self._evict()
+
+    def invalidate(self, user_id: str):
+        self._remove(user_id)
+
+    def _trim(self, entry):
+        excess = len(entry.messages) - self.max_messages
+        if excess > 0:
+            entry.size -= sum(_message_size(m) for m in entry.messages[:excess])
+            del entry.messages[:excess]
+            entry.complete = False
+
+    def _remove(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _evict(self):
+        now = time.monotonic()
+        # Primero los inactivos (los más antiguos están al inicio del OrderedDict)
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if now - entry.last_access <= self.ttl_seconds and self._bytes <= self.max_bytes:
+                break
+            self._remove(user_id)
+            self._evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self._hits + self._misses
+        return {
+            "users": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / lookups, 4) if lookups else 0.0,
+            "evictions": self._evictions,
+        }
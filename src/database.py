@@ -1,13 +1,26 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean
+from sqlalchemy import (
+    create_engine, inspect, text, cast, Column, Integer, BigInteger, String, Text, DateTime, Boolean, Index, JSON
+)
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, column_property, deferred
+from src.config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE
+from contextlib import asynccontextmanager
+import asyncio
 import datetime
+import functools
+import json
 import os
+import weakref
 
 # TEMPORAL: Usar SQLite para evitar problemas de encoding de psycopg2 en Windows
 # Para producción, cambiar a PostgreSQL cuando se resuelva el problema de encoding
 USE_SQLITE = os.getenv("USE_SQLITE", "true").lower() == "true"
 
+# Columnas JSON sin espacios ni escapes \uXXXX (el historial es mayormente en español)
+_json_serializer = functools.partial(json.dumps, ensure_ascii=False, separators=(",", ":"))
+
 # Configuración de base de datos
 DATABASE_URL = os.getenv("DATABASE_URL")
 
@@ -19,7 +32,8 @@ if USE_SQLITE or not DATABASE_URL:
     engine = create_engine(
         DATABASE_URL,
         connect_args={'check_same_thread': False},
-        pool_pre_ping=True
+        pool_pre_ping=True,
+        json_serializer=_json_serializer
     )
 else:
     # Soporte para Railway (cambia postgres:// a postgresql:// si es necesario)
@@ -28,11 +42,143 @@ else:
     
     engine = create_engine(
         DATABASE_URL,
-        pool_pre_ping=True
+        pool_pre_ping=True,
+        json_serializer=_json_serializer
     )
+
+
+def async_url(url: str) -> str:
+    """URL con el driver asíncrono: aiosqlite para SQLite, asyncpg para PostgreSQL"""
+    if url.startswith("sqlite://"):
+        return url.replace("sqlite://", "sqlite+aiosqlite://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    return url
+
+
+# El engine síncrono queda solo para crear y migrar el esquema al arrancar;
+# los handlers del bot, el scheduler y las rutas usan el asíncrono, así una
+# consulta lenta (o una espera por el lock de SQLite) no frena el event loop.
+# Cada worker de updates tiene a lo sumo una sesión abierta: el pool debería
+# alcanzar para UPDATE_WORKERS más el scheduler y la bandeja de entrada.
+async_engine = create_async_engine(
+    async_url(DATABASE_URL),
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+    pool_pre_ping=True,
+    json_serializer=_json_serializer
+)
+
+
+def _jsonb_key_order(value):
+    """Claves en el orden en que las guarda jsonb: primero las más cortas, después por bytes"""
+    if isinstance(value, dict):
+        keys = sorted(value, key=lambda k: (len(k.encode()), k.encode()))
+        return {k: _jsonb_key_order(value[k]) for k in keys}
+    if isinstance(value, list):
+        return [_jsonb_key_order(v) for v in value]
+    return value
+
+
+def json_column_text(value) -> str:
+    """
+    Texto que devuelve cast(<columna JSON>, Text) para 'value' en el backend en uso:
+    en SQLite es el texto que escribió _json_serializer; en PostgreSQL, jsonb lo
+    normaliza (claves reordenadas, separadores ", " y ": ").
+    """
+    if engine.dialect.name == "postgresql":
+        return json.dumps(_jsonb_key_order(value), ensure_ascii=False, separators=(", ", ": "))
+    return _json_serializer(value)
+
+# Un lock de escritura por event loop (los tests corren varios asyncio.run en un proceso)
+_write_locks = weakref.WeakKeyDictionary()
+
+
+def _write_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _write_locks.get(loop)
+    if lock is None:
+        lock = _write_locks[loop] = asyncio.Lock()
+    return lock
+
+
+class SQLiteAsyncSession(AsyncSession):
+    """
+    AsyncSession cuyas escrituras hacen fila en el event loop.
+
+    SQLite admite un solo escritor: con muchas conexiones escribiendo a la vez,
+    las que no consiguen el lock de la base reintentan con las esperas
+    crecientes del busy handler (de hasta 100 ms). El lock del proceso se
+    toma antes de que la base tome el suyo y se suelta después del commit.
+    La conexión del pool se pide antes de tomarlo: quien espera el lock ya
+    tiene la suya y el que lo tiene nunca queda esperando una conexión ajena:
+
+    - commit() lo toma para los cambios a nivel ORM (con autoflush apagado,
+      el INSERT / UPDATE recién sale en el flush del commit);
+    - los UPDATE / DELETE explícitos van dentro de write_transaction(), que
+      lo toma desde antes de la primera sentencia hasta el commit.
+
+    En PostgreSQL no hace falta y se usa la AsyncSession normal.
+    """
+
+    async def commit(self):
+        if self.info.get("write_locked"):
+            await super().commit()
+            return
+        await self.connection()
+        async with _write_lock():
+            await super().commit()
+
+
+@asynccontextmanager
+async def write_transaction(session):
+    """
+    Bloque de escrituras explícitas (update / delete) que termina en commit,
+    o en rollback si falla. En SQLite lo recorre con el lock de escritura del
+    proceso tomado: si no, una sesión con un UPDATE sin confirmar y otra
+    esperando el lock en su commit se bloquean entre sí hasta el timeout.
+    """
+    if not isinstance(session, SQLiteAsyncSession):
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        return
+
+    await session.connection()
+    async with _write_lock():
+        session.info["write_locked"] = True
+        try:
+            yield session
+            await session.commit()
+        except BaseException:
+            await session.rollback()
+            raise
+        finally:
+            session.info.pop("write_locked", None)
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Sin expire_on_commit: los objetos se siguen leyendo después del commit y en
+# una AsyncSession no hay carga perezosa implícita que los recargue
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False,
+    class_=SQLiteAsyncSession if async_engine.dialect.name == "sqlite" else AsyncSession
+)
 Base = declarative_base()
 
+# JSON nativo: JSONB en PostgreSQL, JSON (texto) en SQLite
+JSONType = JSON(none_as_null=True).with_variant(JSONB(none_as_null=True), "postgresql")
+
+# Formato de las filas de conversation_history:
+#   1 (o NULL): tool_calls como JSON dentro de 'content' y resultados de herramientas como texto
+#   2: tool_calls y tool_result en columnas JSON propias; 'content' solo lleva texto
+HISTORY_SCHEMA_VERSION = 2
+
 class Appointment(Base):
     __tablename__ = "appointments"
 
@@ -46,6 +192,11 @@ class Appointment(Base):
     rem_3h_sent = Column(Boolean, default=False)
     rem_1h_sent = Column(Boolean, default=False)
     rem_15m_sent = Column(Boolean, default=False)
+    # Próximo recordatorio pendiente (naive UTC); NULL si ya no quedan. Mantenido por src/reminders.py
+    next_reminder_at = Column(DateTime, nullable=True, index=True)
+    # Lease del envío de recordatorios: qué instancia del scheduler tomó la fila y hasta cuándo
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True, index=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
 class UserAuth(Base):
@@ -68,17 +219,115 @@ class ConversationHistory(Base):
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(String, index=True)
     role = Column(String) # user, assistant, tool
-    content = Column(String)
+    content = Column(String) # texto del mensaje (vacío en los resultados de herramientas)
+    tool_calls = Column(JSONType, nullable=True) # assistant: [{"id", "name", "arguments": {...}}]
+    tool_result = deferred(Column(JSONType, nullable=True)) # tool: resultado como JSON
     tool_call_id = Column(String, nullable=True)
     name = Column(String, nullable=True) # for tool messages
+    schema_version = Column(Integer, default=HISTORY_SCHEMA_VERSION)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
 
+    # El resultado se lee como texto JSON, tal cual lo necesita el mensaje de
+    # historial: sin decodificarlo en la lectura ni volver a codificarlo
+    tool_result_text = column_property(cast(tool_result, Text))
+
+    __table_args__ = (
+        # Lectura de la ventana reciente: WHERE telegram_id = ? ORDER BY created_at DESC LIMIT n
+        Index("ix_conversation_history_user_created", "telegram_id", "created_at"),
+    )
+
+class TelegramInbox(Base):
+    __tablename__ = "telegram_inbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    update_id = Column(BigInteger, unique=True, index=True)
+    payload = Column(String) # JSON crudo del update
+    status = Column(String, default="pending", index=True) # pending, processing, done, failed
+    # Usuario (o chat) del update: a lo sumo uno de cada chat en proceso a la vez
+    chat_key = Column(String, nullable=True)
+    attempts = Column(Integer, default=0)
+    # Réplica que lo reclamó y hasta cuándo; vencido, vuelve a la cola
+    claimed_by = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # claim_batch: primer update pendiente de cada chat sin otro en proceso
+        Index("ix_telegram_inbox_status_chat", "status", "chat_key", "update_id"),
+    )
+
+class CalendarEvent(Base):
+    """Copia local de los eventos de Google Calendar de cada usuario (ver src/calendar_sync.py)"""
+    __tablename__ = "calendar_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    telegram_id = Column(String)
+    event_id = Column(String)
+    summary = Column(String)
+    start_time = Column(DateTime) # naive UTC
+    end_time = Column(DateTime) # naive UTC
+    all_day = Column(Boolean, default=False)
+    start_date = Column(String, nullable=True) # YYYY-MM-DD de los eventos de día completo
+    transparent = Column(Boolean, default=False) # "Disponible" en Google: no bloquea el horario
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+    __table_args__ = (
+        Index("ux_calendar_events_user_event", "telegram_id", "event_id", unique=True),
+        # list_appointments: WHERE telegram_id = ? AND end_time > ? ORDER BY start_time
+        Index("ix_calendar_events_user_start", "telegram_id", "start_time"),
+    )
+
+class CalendarSyncState(Base):
+    __tablename__ = "calendar_sync_state"
+
+    id = Column(Integer, primary_key=True, index=True)
+    telegram_id = Column(String, unique=True, index=True)
+    calendar_id = Column(String)
+    sync_token = Column(String, nullable=True)
+    last_synced_at = Column(DateTime, nullable=True)
+
+class ConversationSummary(Base):
+    """Resumen acumulado de los mensajes antiguos de cada usuario (ver src/summary_manager.py)"""
+    __tablename__ = "conversation_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    telegram_id = Column(String, unique=True, index=True)
+    summary = Column(String)
+    covered_until_id = Column(Integer, default=0) # último ConversationHistory.id incluido en el resumen
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+def _add_missing_columns():
+    """create_all no altera tablas existentes: agrega las columnas nuevas de los modelos"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"))
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+    # create_all no agrega índices nuevos a tablas que ya existían
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    # Filas de historial guardadas con el formato anterior
+    from src.history_manager import HistoryManager
+    HistoryManager.migrate_legacy_rows()
+
+def session_lock(session) -> asyncio.Lock:
+    """
+    Lock de una AsyncSession compartida (la del turno): las herramientas corren
+    en paralelo y una AsyncSession no admite dos operaciones a la vez.
+    """
+    return session.info.setdefault("lock", asyncio.Lock())
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from src.config import TIMEZONE, WORK_DAY_START, WORK_DAY_END, WORK_DAYS
+
+# Los horarios propuestos empiezan en múltiplos de este paso (en segundos)
+SLOT_STEP_SECONDS = 30 * 60
+# Máximo de propuestas por día, para repartir las opciones en la semana
+MAX_SLOTS_PER_DAY = 3
+
+
+def _epoch(dt: datetime) -> int:
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def merge_busy(starts: np.ndarray, ends: np.ndarray):
+    """Une intervalos ocupados que se solapan o se tocan. Devuelve (inicios, fines) ordenados"""
+    if starts.size == 0:
+        return starts, ends
+    order = np.argsort(starts, kind="stable")
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    # Empieza un bloque nuevo donde el inicio supera todo lo cubierto hasta el anterior
+    new_block = np.empty(starts.size, dtype=bool)
+    new_block[0] = True
+    new_block[1:] = starts[1:] > reach[:-1]
+    block_idx = np.flatnonzero(new_block)
+    return starts[block_idx], np.maximum.reduceat(ends, block_idx)
+
+
+def working_windows(window_start: datetime, window_end: datetime):
+    """Horario laboral (WORK_DAY_START-WORK_DAY_END en TIMEZONE, días WORK_DAYS) como epoch UTC"""
+    day = window_start.astimezone(TIMEZONE).date()
+    last_day = window_end.astimezone(TIMEZONE).date()
+    starts, ends = [], []
+    while day <= last_day:
+        if day.weekday() in WORK_DAYS:
+            opens = TIMEZONE.localize(datetime.combine(day, WORK_DAY_START))
+            closes = TIMEZONE.localize(datetime.combine(day, WORK_DAY_END))
+            starts.append(_epoch(opens))
+            ends.append(_epoch(closes))
+        day += timedelta(days=1)
+    return np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64)
+
+
+def find_free_slots(busy, window_start: datetime, window_end: datetime, duration: timedelta,
+                    max_results: int = 5):
+    """
+    Horarios libres de 'duration' dentro de [window_start, window_end) y del horario laboral.
+
+    'busy' es una lista de (inicio, fin) aware. Todo el cálculo es vectorizado:
+    se unen los ocupados, se toman los huecos entre ellos, se cruzan con las
+    jornadas laborales y de cada hueco útil salen propuestas alineadas a
+    SLOT_STEP_SECONDS. Las propuestas se ordenan por cercanía, con un máximo de
+    MAX_SLOTS_PER_DAY por día. Devuelve una lista de (inicio, fin) aware en TIMEZONE.
+    """
+    lo, hi = _epoch(window_start), _epoch(window_end)
+    need = int(duration.total_seconds())
+    busy_starts = np.array([_epoch(s) for s, _ in busy], dtype=np.int64)
+    busy_ends = np.array([_epoch(e) for _, e in busy], dtype=np.int64)
+    busy_starts, busy_ends = merge_busy(busy_starts, busy_ends)
+
+    # Huecos libres: antes del primer ocupado, entre ocupados y después del último
+    free_starts = np.clip(np.concatenate(([lo], busy_ends)), lo, hi)
+    free_ends = np.clip(np.concatenate((busy_starts, [hi])), lo, hi)
+
+    work_starts, work_ends = working_windows(window_start, window_end)
+    if work_starts.size == 0:
+        return []
+
+    # Intersección de cada hueco con cada jornada (matriz huecos x días)
+    starts = np.maximum(free_starts[:, None], work_starts[None, :])
+    ends = np.minimum(free_ends[:, None], work_ends[None, :])
+    starts = -(-starts // SLOT_STEP_SECONDS) * SLOT_STEP_SECONDS  # redondeo hacia arriba al paso
+    fits = ends - starts >= need
+
+    # Cada hueco útil aporta hasta MAX_SLOTS_PER_DAY propuestas consecutivas
+    spacing = -(-need // SLOT_STEP_SECONDS) * SLOT_STEP_SECONDS
+    candidates = starts[fits][:, None] + np.arange(MAX_SLOTS_PER_DAY, dtype=np.int64)[None, :] * spacing
+    valid = candidates + need <= ends[fits][:, None]
+    slot_starts = np.unique(candidates[valid])
+
+    results = []
+    per_day = {}
+    for start in slot_starts.tolist():
+        start_local = datetime.fromtimestamp(start, tz=timezone.utc).astimezone(TIMEZONE)
+        day = start_local.date()
+        if per_day.get(day, 0) >= MAX_SLOTS_PER_DAY:
+            continue
+        per_day[day] = per_day.get(day, 0) + 1
+        results.append((start_local, start_local + duration))
+        if len(results) >= max_results:
+            break
+    return results
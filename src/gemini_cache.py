@@ -0,0 +1,164 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from contextlib import suppress
+from google.genai import errors as genai_errors
+from google.genai import types
+from src.config import (
+    GEMINI_CONTEXT_CACHE,
+    GEMINI_CACHE_TTL_SECONDS,
+    GEMINI_CACHE_RETRY_SECONDS,
+    GEMINI_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def is_cache_error(error: Exception) -> bool:
+    """Gemini rechazó la entrada de cache usada en la llamada (expirada, borrada o inválida)"""
+    return (
+        isinstance(error, genai_errors.APIError)
+        and error.code in (400, 403, 404)
+        and "cache" in str(error).lower()
+    )
+
+
+class ContextCache:
+    """
+    Entradas de cachedContents de Gemini con la parte fija de cada llamada:
+    system prompt y declaraciones de herramientas. Hay una entrada por
+    combinación (modelo, prompt, herramientas), compartida por todos los usuarios,
+    así que cada llamada solo envía la conversación.
+
+    Las entradas se crean con un TTL y se renuevan con caches.update cuando les
+    queda menos de un quinto de vida. Si la API de caching falla (por ejemplo,
+    el prompt no llega al mínimo de tokens del modelo) get() devuelve None, el
+    llamador envía todo en línea y no se reintenta hasta pasados retry_seconds.
+    """
+
+    def __init__(self, client, enabled: bool = GEMINI_CONTEXT_CACHE, ttl_seconds: int = GEMINI_CACHE_TTL_SECONDS,
+                 retry_seconds: float = GEMINI_CACHE_RETRY_SECONDS, timeout: float = GEMINI_TIMEOUT_SECONDS):
+        self._client = client
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self.timeout = timeout
+        # clave -> (nombre de la entrada, vence en time.monotonic())
+        self._entries = {}
+        self._lock = asyncio.Lock()
+        self._disabled_until = 0.0
+        self._hits = 0
+        self._misses = 0
+        self._created = 0
+        self._refreshed = 0
+        self._failures = 0
+        self._prompt_tokens = 0
+        self._cached_tokens = 0
+
+    @staticmethod
+    def key(model: str, system_instruction: str, tools: list) -> str:
+        payload = json.dumps(
+            [model, system_instruction, [tool.model_dump(mode="json", exclude_none=True) for tool in tools]],
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _fresh(self, key: str):
+        entry = self._entries.get(key)
+        if entry and entry[1] - time.monotonic() > self.ttl_seconds / 5:
+            return entry[0]
+        return None
+
+    async def get(self, model: str, system_instruction: str, tools: list, key: str = None):
+        """Nombre de la entrada para (modelo, prompt, herramientas), o None si no hay cache disponible"""
+        if not self.enabled:
+            return None
+        key = key or self.key(model, system_instruction, tools)
+        name = self._fresh(key)
+        if name:
+            self._hits += 1
+            return name
+
+        async with self._lock:
+            # Otra corrutina pudo crearla o renovarla mientras esperábamos
+            name = self._fresh(key)
+            if name:
+                self._hits += 1
+                return name
+            self._misses += 1
+
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                try:
+                    await asyncio.wait_for(
+                        self._client.aio.caches.update(
+                            name=entry[0], config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+                        ),
+                        timeout=self.timeout,
+                    )
+                    self._entries[key] = (entry[0], time.monotonic() + self.ttl_seconds)
+                    self._refreshed += 1
+                    return entry[0]
+                except Exception as e:
+                    logger.warning(f"No se pudo renovar la cache de contexto {entry[0]}: {e}")
+            self._entries.pop(key, None)
+
+            if time.monotonic() < self._disabled_until:
+                return None
+            try:
+                cached = await asyncio.wait_for(
+                    self._client.aio.caches.create(
+                        model=model,
+                        config=types.CreateCachedContentConfig(
+                            system_instruction=system_instruction,
+                            tools=tools,
+                            ttl=f"{self.ttl_seconds}s",
+                            display_name=f"meetmate-{key[:12]}",
+                        ),
+                    ),
+                    timeout=self.timeout,
+                )
+            except Exception as e:
+                self._failures += 1
+                self._disabled_until = time.monotonic() + self.retry_seconds
+                logger.warning(f"Cache de contexto no disponible, se envía el prompt completo: {e}")
+                return None
+
+            self._entries[key] = (cached.name, time.monotonic() + self.ttl_seconds)
+            self._created += 1
+            logger.info(f"Cache de contexto creada: {cached.name}")
+            return cached.name
+
+    def invalidate(self, name: str):
+        """Olvida una entrada que Gemini rechazó; la próxima llamada crea otra"""
+        for key, entry in list(self._entries.items()):
+            if entry[0] == name:
+                del self._entries[key]
+
+    def record_usage(self, usage):
+        if usage is None:
+            return
+        self._prompt_tokens += usage.prompt_token_count or 0
+        self._cached_tokens += usage.cached_content_token_count or 0
+
+    async def close(self):
+        """Borra las entradas creadas por este proceso (se cobran por hora de almacenamiento)"""
+        for name, _ in list(self._entries.values()):
+            with suppress(Exception):
+                await asyncio.wait_for(self._client.aio.caches.delete(name=name), timeout=self.timeout)
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "created": self._created,
+            "refreshed": self._refreshed,
+            "failures": self._failures,
+            "prompt_tokens": self._prompt_tokens,
+            "cached_tokens": self._cached_tokens,
+        }
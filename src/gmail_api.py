@@ -6,12 +6,14 @@ from googleapiclient.discovery import build
 logger = logging.getLogger(__name__)
 
 class GmailService:
-    def __init__(self, credentials=None):
+    def __init__(self, credentials=None, service=None):
         if not credentials:
             logger.error("GmailService inicializado sin credenciales.")
             raise Exception("Credenciales requeridas para GmailService")
         
-        self.service = build('gmail', 'v1', credentials=credentials)
+        self.creds = credentials
+        # Cliente ya construido (pool de src.google_clients) o uno nuevo
+        self.service = service if service is not None else build('gmail', 'v1', credentials=credentials)
 
     def send_email(self, to, subject, body):
         """Envía un correo electrónico usando Gmail API"""
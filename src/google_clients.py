@@ -0,0 +1,205 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from src.config import (
+    GOOGLE_POOL_MAX_USERS,
+    GOOGLE_POOL_IDLE_SECONDS,
+    GOOGLE_POOL_CONNECTIONS,
+    GOOGLE_HTTP_TIMEOUT,
+    GOOGLE_IO_MAX_WORKERS,
+)
+from src.calendar_api import CalendarService
+from src.gmail_api import GmailService
+
+# API de Google por nombre de servicio usado en ToolExecutor
+_APIS = {
+    "calendar": ("calendar", "v3", CalendarService),
+    "gmail": ("gmail", "v1", GmailService),
+}
+
+# googleapiclient es bloqueante: sus .execute() corren en este pool acotado
+# para no frenar el event loop (y con él al resto de los chats)
+_google_io = ThreadPoolExecutor(max_workers=GOOGLE_IO_MAX_WORKERS, thread_name_prefix="google-io")
+
+
+async def run_google_io(fn, *args, **kwargs):
+    """Ejecuta una llamada bloqueante a Google en el pool de E/S"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_google_io, partial(fn, *args, **kwargs))
+
+# Documentos de discovery ya parseados (se leen una sola vez de los estáticos de la librería)
+_discovery_docs = {}
+_discovery_lock = threading.Lock()
+
+
+def _discovery_document(api: str, version: str) -> dict:
+    key = (api, version)
+    doc = _discovery_docs.get(key)
+    if doc is None:
+        with _discovery_lock:
+            doc = _discovery_docs.get(key)
+            if doc is None:
+                doc = _discovery_docs[key] = json.loads(get_static_doc(api, version))
+    return doc
+
+
+class _PooledHttp:
+    """
+    Transporte para googleapiclient que reutiliza conexiones keep-alive.
+
+    httplib2.Http no es seguro entre hilos, así que se mantiene un pequeño pool:
+    cada request toma una conexión libre (o crea una) y la devuelve al terminar.
+    """
+
+    def __init__(self, credentials, size: int = GOOGLE_POOL_CONNECTIONS):
+        self.credentials = credentials
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT))
+
+    def _release(self, http):
+        with self._lock:
+            if len(self._idle) < self.size and http.credentials is self.credentials:
+                self._idle.append(http)
+                return
+        http.close()
+
+    def set_credentials(self, credentials):
+        """Cambia las credenciales sin descartar las conexiones abiertas"""
+        with self._lock:
+            self.credentials = credentials
+            for http in self._idle:
+                http.credentials = credentials
+
+    def request(self, *args, **kwargs):
+        http = self._acquire()
+        try:
+            return http.request(*args, **kwargs)
+        finally:
+            self._release(http)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for http in idle:
+            http.close()
+
+
+class _PoolEntry:
+    def __init__(self, credentials, connections):
+        self.credentials = credentials
+        self.http = _PooledHttp(credentials, connections)
+        self.services = {}
+        self.last_used = time.monotonic()
+
+    def set_credentials(self, credentials):
+        self.credentials = credentials
+        self.http.set_credentials(credentials)
+        for service in self.services.values():
+            service.creds = credentials
+
+
+class LazyServices:
+    """Se comporta como el dict de servicios de ToolExecutor, pero construye cada uno al pedirlo"""
+
+    def __init__(self, pool, user_id: str, credentials):
+        self._pool = pool
+        self._user_id = user_id
+        self._credentials = credentials
+
+    def get(self, name: str, default=None):
+        if name not in _APIS or self._credentials is None:
+            return default
+        return self._pool.get(self._user_id, self._credentials, name)
+
+
+class GoogleServicePool:
+    """
+    Pool por usuario de clientes de Google ya construidos.
+
+    Evita llamar a build() en cada mensaje: el discovery se parsea una vez, cada
+    usuario conserva sus clientes y conexiones HTTP, y los usuarios inactivos
+    se descartan (LRU acotado por GOOGLE_POOL_MAX_USERS y GOOGLE_POOL_IDLE_SECONDS).
+    """
+
+    def __init__(self, max_users: int = GOOGLE_POOL_MAX_USERS, idle_seconds: float = GOOGLE_POOL_IDLE_SECONDS,
+                 connections: int = GOOGLE_POOL_CONNECTIONS, client_options=None):
+        self.max_users = max_users
+        self.idle_seconds = idle_seconds
+        self.connections = connections
+        # Permite apuntar a otro endpoint (pruebas y benchmarks)
+        self.client_options = client_options
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._builds = 0
+        self._hits = 0
+
+    def services(self, user_id: str, credentials) -> LazyServices:
+        return LazyServices(self, user_id, credentials)
+
+    def get(self, user_id: str, credentials, name: str):
+        api, version, wrapper = _APIS[name]
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = _PoolEntry(credentials, self.connections)
+            elif entry.credentials is not credentials:
+                # Credenciales recargadas desde la DB o tras volver a /conectar:
+                # se conservan los clientes y las conexiones, solo cambia el token
+                entry.set_credentials(credentials)
+            entry.last_used = time.monotonic()
+            self._entries.move_to_end(user_id)
+            self._evict()
+
+            service = entry.services.get(name)
+            if service is not None:
+                self._hits += 1
+                return service
+
+            document = _discovery_document(api, version)
+            endpoint = (self.client_options or {}).get("api_endpoint")
+            if endpoint:
+                # El batch usa rootUrl del discovery, no api_endpoint
+                document = dict(document, rootUrl=endpoint)
+            resource = build_from_document(
+                document,
+                http=entry.http,
+                client_options=self.client_options
+            )
+            service = entry.services[name] = wrapper(credentials=credentials, service=resource)
+            self._builds += 1
+            return service
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._discard(user_id)
+
+    def _discard(self, user_id):
+        entry = self._entries.pop(user_id, None)
+        if entry is not None:
+            entry.http.close()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self._entries:
+            user_id, entry = next(iter(self._entries.items()))
+            if len(self._entries) <= self.max_users and now - entry.last_used <= self.idle_seconds:
+                break
+            self._discard(user_id)
+
+    def stats(self) -> dict:
+        return {"users": len(self._entries), "builds": self._builds, "hits": self._hits}
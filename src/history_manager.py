@@ -1,87 +1,278 @@
 import logging
 import json
-from src.database import SessionLocal, ConversationHistory
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import delete, select, update
+from src.database import (
+    SessionLocal, AsyncSessionLocal, ConversationHistory, HISTORY_SCHEMA_VERSION, write_transaction, json_column_text
+)
+from src.config import HISTORY_TOKEN_BUDGET, HISTORY_MAX_MESSAGES
+from src.conversation_cache import ConversationCache
+from src.token_budget import estimator
 
 logger = logging.getLogger(__name__)
 
+# Cola reciente del historial por usuario (write-through sobre la DB)
+_cache = ConversationCache()
+
+# Reemplazo de resultados de herramientas demasiado grandes para la ventana
+_OMITTED_TOOL_RESULT = json.dumps({"result": "Resultado extenso omitido del historial; vuelve a consultar si lo necesitas."},
+                                  ensure_ascii=False)
+
+# id(mensaje original) -> (mensaje original, mensaje con el aviso), LRU. Así el
+# reemplazo es el mismo objeto en cada turno y el memo de conversión de ai.py
+# (por identidad) lo reutiliza. Guardar el original evita confundir ids reusados.
+_omitted_messages = OrderedDict()
+_OMITTED_MESSAGES_MAX = 512
+
+_MIGRATION_BATCH = 1000
+
+
+def _decode_arguments(arguments):
+    if not isinstance(arguments, str):
+        return arguments or {}
+    try:
+        return json.loads(arguments) if arguments else {}
+    except ValueError:
+        return {}
+
+
+def _pack_tool_calls(tool_calls):
+    """tool_calls de un mensaje assistant -> formato guardado en la columna JSON"""
+    return [
+        {"id": tc.get("id"), "name": tc["function"]["name"], "arguments": _decode_arguments(tc["function"]["arguments"])}
+        for tc in tool_calls
+    ]
+
+
+def _unpack_tool_calls(stored):
+    """Columna tool_calls -> tool_calls del mensaje (argumentos ya decodificados)"""
+    return [
+        {"id": tc["id"], "type": "function", "function": {"name": tc["name"], "arguments": tc["arguments"]}}
+        for tc in stored
+    ]
+
+
+def _decode_tool_result(content):
+    """Resultado de herramienta tal como llega (texto JSON) -> valor para la columna tool_result"""
+    if not isinstance(content, str):
+        return content
+    try:
+        return json.loads(content)
+    except ValueError:
+        return content
+
+
+def _omitted_message(msg):
+    """Mensaje 'tool' con el resultado reemplazado por el aviso (siempre el mismo objeto para 'msg')"""
+    entry = _omitted_messages.get(id(msg))
+    if entry is not None and entry[0] is msg:
+        _omitted_messages.move_to_end(id(msg))
+        return entry[1]
+    replacement = {**msg, "content": _OMITTED_TOOL_RESULT}
+    _omitted_messages[id(msg)] = (msg, replacement)
+    _omitted_messages.move_to_end(id(msg))
+    while len(_omitted_messages) > _OMITTED_MESSAGES_MAX:
+        _omitted_messages.popitem(last=False)
+    return replacement
+
+
 class HistoryManager:
     @staticmethod
-    def get_user_history(user_id: str, limit: int = 15):
-        """Recupera el historial de mensajes de la base de datos para un usuario"""
-        db = SessionLocal()
-        try:
-            records = db.query(ConversationHistory).filter(
-                ConversationHistory.telegram_id == user_id
-            ).order_by(ConversationHistory.created_at.asc()).all()
-            
-            messages = []
-            for rec in records:
-                try:
-                    role = rec.role
-                    content = rec.content or ""
-                    
-                    if role == "assistant" and content.startswith("{"):
-                        msg = json.loads(content)
-                        # OpenAI requiere que 'content' sea string o null, 
-                        # pero a veces falla si es null explícito en el dict enviado.
-                        if msg.get("content") is None:
-                            msg["content"] = ""
-                    else:
-                        msg = {"role": role, "content": content}
-                        if role == "tool":
-                            msg["tool_call_id"] = rec.tool_call_id
-                            msg["name"] = rec.name
-                    
-                    # Validación de seguridad: no agregar mensajes vacíos que rompan la API
-                    if not msg.get("content") and not msg.get("tool_calls") and role != "tool":
-                        continue
-                        
+    def _to_message(role: str, content, tool_call_id: str = None, name: str = None):
+        """Construye el mensaje en formato de historial (o None si se descarta)"""
+        if role == "assistant" and isinstance(content, dict):
+            msg = dict(content)
+            # OpenAI requiere que 'content' sea string o null,
+            # pero a veces falla si es null explícito en el dict enviado.
+            if msg.get("content") is None:
+                msg["content"] = ""
+            # Los argumentos quedan decodificados, igual que al leerlos de la DB
+            if msg.get("tool_calls"):
+                msg["tool_calls"] = _unpack_tool_calls(_pack_tool_calls(msg["tool_calls"]))
+        else:
+            msg = {"role": role, "content": content or ""}
+            if role == "tool":
+                # Mismo texto que devuelve tool_result_text al leer la fila (ver build_record),
+                # así el historial en cache y el leído de la DB son idénticos
+                result = _decode_tool_result(content)
+                msg["content"] = "" if result is None else json_column_text(result)
+                msg["tool_call_id"] = tool_call_id
+                msg["name"] = name
+
+        # Validación de seguridad: no agregar mensajes vacíos que rompan la API
+        if not msg.get("content") and not msg.get("tool_calls") and role != "tool":
+            return None
+        return msg
+
+    @staticmethod
+    def _parse_record(rec):
+        """Convierte una fila de ConversationHistory al formato de mensaje (o None si se descarta)"""
+        if rec.tool_calls:
+            return {"role": "assistant", "content": rec.content or "", "tool_calls": _unpack_tool_calls(rec.tool_calls)}
+        if rec.role == "tool":
+            return {
+                "role": "tool",
+                "content": rec.tool_result_text or "",
+                "tool_call_id": rec.tool_call_id,
+                "name": rec.name,
+            }
+        return HistoryManager._to_message(rec.role, rec.content, rec.tool_call_id, rec.name)
+
+    @staticmethod
+    def _select_window(messages, token_budget: int):
+        """
+        Toma el sufijo más largo del historial que entra en 'token_budget'
+        (tokens estimados) y que empieza en un mensaje 'user'.
+
+        Al ser un sufijo que arranca en 'user', nunca empieza con un 'tool' ni
+        separa un assistant con tool_calls de sus resultados. Un resultado de
+        herramienta que solo ocupa más de un cuarto del presupuesto se reemplaza
+        por un aviso corto (la respuesta del assistant que le sigue conserva el
+        resumen), para que un listado enorme no deje afuera toda la conversación.
+        """
+        tool_limit = token_budget // 4
+        window = []
+        start = 0
+        used = 0
+        for i in range(len(messages) - 1, -1, -1):
+            msg = messages[i]
+            cost = estimator.estimate_message(msg)
+            if msg.get("role") == "tool" and cost > tool_limit:
+                msg = _omitted_message(msg)
+                cost = estimator.estimate_message(msg)
+            used += cost
+            if used > token_budget:
+                break
+            window.append(msg)
+            if msg.get("role") == "user":
+                start = len(window)
+        window = window[:start]
+        window.reverse()
+        return window
+
+    @staticmethod
+    async def get_user_history(user_id: str, token_budget: int = HISTORY_TOKEN_BUDGET,
+                               max_messages: int = HISTORY_MAX_MESSAGES):
+        """Recupera el historial reciente de un usuario que entra en el presupuesto de tokens"""
+        # Como mucho se miran los últimos 'max_messages' mensajes
+        cached = _cache.get(user_id, max_messages)
+        if cached is not None:
+            return HistoryManager._select_window(cached[-max_messages:], token_budget)
+
+        async with AsyncSessionLocal() as db:
+            # Usa el índice (telegram_id, created_at)
+            records = (await db.scalars(
+                select(ConversationHistory).where(
+                    ConversationHistory.telegram_id == user_id
+                ).order_by(
+                    ConversationHistory.created_at.desc(),
+                    ConversationHistory.id.desc()
+                ).limit(max_messages)
+            )).all()
+
+        messages = []
+        for rec in reversed(records):
+            try:
+                msg = HistoryManager._parse_record(rec)
+                if msg is not None:
                     messages.append(msg)
-                except Exception as e:
-                    logger.error(f"Error parseando mensaje de historial: {e}")
-
-            # Truncado inteligente:
-            # Nunca debemos empezar con un mensaje de rol 'tool' o 'assistant' que tenga tool_calls incompleto.
-            # La forma más segura de truncar es asegurar que el primer mensaje sea de tipo 'user'.
-            if len(messages) > limit:
-                # Nos quedamos con los últimos 'limit' mensajes
-                messages = messages[-limit:]
-                # Seguimos eliminando desde el principio hasta que el primer mensaje sea 'user'
-                while messages and messages[0].get("role") != "user":
-                    messages.pop(0)
-            
-            return messages
-        finally:
-            db.close()
+            except Exception as e:
+                logger.error(f"Error parseando mensaje de historial: {e}")
+
+        _cache.put(user_id, messages, complete=len(records) < max_messages)
+        return HistoryManager._select_window(messages, token_budget)
 
     @staticmethod
-    def save_message(user_id: str, role: str, content: str, tool_call_id: str = None, name: str = None):
-        """Guarda un nuevo mensaje en el historial persistente"""
+    def build_record(user_id: str, role: str, content, tool_call_id: str = None, name: str = None, created_at=None):
+        """Crea la fila de ConversationHistory para un mensaje (sin guardarla)"""
+        tool_calls = tool_result = None
+        if isinstance(content, dict):
+            # assistant con tool_calls (model_dump del mensaje): cada parte en su columna
+            tool_calls = _pack_tool_calls(content["tool_calls"]) if content.get("tool_calls") else None
+            content = content.get("content")
+        elif role == "tool":
+            tool_result = _decode_tool_result(content)
+            content = None
+
+        return ConversationHistory(
+            telegram_id=user_id,
+            role=role,
+            content=content or "",
+            tool_calls=tool_calls,
+            tool_result=tool_result,
+            tool_call_id=tool_call_id,
+            name=name,
+            schema_version=HISTORY_SCHEMA_VERSION,
+            created_at=created_at or datetime.utcnow()
+        )
+
+    @staticmethod
+    def migrate_legacy_rows():
+        """
+        Pasa al formato actual (HISTORY_SCHEMA_VERSION) las filas guardadas con el anterior.
+        Corre al arrancar, desde init_db y antes del event loop: usa la sesión síncrona.
+        """
+        migrated = 0
         db = SessionLocal()
         try:
-            # Si el contenido es un dict (assistant message dump), lo serializamos
-            content_to_save = content or ""
-            if isinstance(content, dict):
-                content_to_save = json.dumps(content)
-                
-            new_msg = ConversationHistory(
-                telegram_id=user_id,
-                role=role,
-                content=content_to_save,
-                tool_call_id=tool_call_id,
-                name=name
-            )
-            db.add(new_msg)
-            db.commit()
+            while True:
+                rows = db.query(
+                    ConversationHistory.id, ConversationHistory.role, ConversationHistory.content
+                ).filter(
+                    ConversationHistory.schema_version.is_(None)
+                ).order_by(ConversationHistory.id).limit(_MIGRATION_BATCH).all()
+                if not rows:
+                    break
+
+                changes = []
+                for row in rows:
+                    change = {"id": row.id, "schema_version": HISTORY_SCHEMA_VERSION}
+                    content = row.content or ""
+                    if row.role == "assistant" and content.startswith("{"):
+                        try:
+                            dumped = json.loads(content)
+                            change["content"] = dumped.get("content") or ""
+                            change["tool_calls"] = _pack_tool_calls(dumped.get("tool_calls") or []) or None
+                        except (ValueError, KeyError, TypeError, AttributeError) as e:
+                            logger.error(f"Mensaje de historial {row.id} ilegible, se conserva como texto: {e}")
+                    elif row.role == "tool":
+                        change["content"] = ""
+                        change["tool_result"] = _decode_tool_result(content)
+                    changes.append(change)
+
+                db.execute(update(ConversationHistory), changes)
+                db.commit()
+                migrated += len(changes)
         finally:
             db.close()
+        if migrated:
+            logger.info(f"Historial migrado al formato {HISTORY_SCHEMA_VERSION}: {migrated} filas")
 
     @staticmethod
-    def delete_user_history(user_id: str):
+    def cache_messages(user_id: str, messages: list):
+        """Agrega al cache mensajes que ya quedaron persistidos"""
+        _cache.append(user_id, messages)
+
+    @staticmethod
+    async def save_message(user_id: str, role: str, content: str, tool_call_id: str = None, name: str = None):
+        """Guarda un nuevo mensaje en el historial persistente"""
+        async with AsyncSessionLocal() as db:
+            db.add(HistoryManager.build_record(user_id, role, content, tool_call_id, name))
+            await db.commit()
+
+        msg = HistoryManager._to_message(role, content, tool_call_id, name)
+        if msg is not None:
+            _cache.append(user_id, [msg])
+
+    @staticmethod
+    async def delete_user_history(user_id: str):
         """Elimina todo el historial de un usuario"""
-        db = SessionLocal()
-        try:
-            db.query(ConversationHistory).filter(ConversationHistory.telegram_id == user_id).delete()
-            db.commit()
-        finally:
-            db.close()
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            await db.execute(delete(ConversationHistory).where(ConversationHistory.telegram_id == user_id))
+        _cache.invalidate(user_id)
+
+    @staticmethod
+    def cache_stats() -> dict:
+        """Tasa de aciertos y memoria usada por el cache de historial"""
+        return _cache.stats()
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+from telegram import Update
+from src.config import (
+    INBOX_WORKERS, INBOX_POLL_SECONDS, INBOX_MAX_ATTEMPTS, INBOX_RETENTION_HOURS, INBOX_LEASE_SECONDS
+)
+from src.database import AsyncSessionLocal, TelegramInbox, write_transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _chat_key(payload: dict):
+    """
+    Misma clave que PerChatUpdateProcessor (effective_user y si no effective_chat),
+    sacada del JSON crudo: message, callback_query, poll_answer, etc.
+    """
+    for field, value in payload.items():
+        if field == "update_id" or not isinstance(value, dict):
+            continue
+        user = value.get("from") or value.get("user")
+        if isinstance(user, dict) and user.get("id") is not None:
+            return str(user["id"])
+        chat = value.get("chat")
+        if isinstance(chat, dict) and chat.get("id") is not None:
+            return str(chat["id"])
+    return None
+
+
+class InboxManager:
+    @staticmethod
+    async def store(update_id: int, payload: dict) -> bool:
+        """Guarda un update crudo. Devuelve False si ya existía (reentrega de Telegram)"""
+        async with AsyncSessionLocal() as db:
+            try:
+                db.add(TelegramInbox(update_id=update_id, payload=json.dumps(payload), status="pending",
+                                     chat_key=_chat_key(payload)))
+                await db.commit()
+                return True
+            except IntegrityError:
+                await db.rollback()
+                return False
+
+    @staticmethod
+    def _chat_busy(chat_key):
+        """Hay un update del mismo chat en proceso (en cualquier réplica)"""
+        other = aliased(TelegramInbox)
+        return exists().where(other.chat_key == chat_key, other.status == "processing")
+
+    @staticmethod
+    async def claim_batch(limit: int, owner: str):
+        """
+        Marca como 'processing' los updates pendientes más antiguos y los devuelve en orden.
+
+        De cada chat se toma solo el primer pendiente, y nada de los chats que ya
+        tienen uno en proceso: los siguientes esperan en la cola sin ocupar un
+        worker bloqueado en el lock del chat. Los updates sin chat no se restringen.
+        """
+        heads = select(func.min(TelegramInbox.update_id)).where(
+            TelegramInbox.status == "pending",
+            TelegramInbox.chat_key.isnot(None),
+            ~InboxManager._chat_busy(TelegramInbox.chat_key)
+        ).group_by(TelegramInbox.chat_key)
+
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.execute(
+                select(TelegramInbox.id, TelegramInbox.update_id, TelegramInbox.payload,
+                       TelegramInbox.attempts, TelegramInbox.chat_key).where(
+                    TelegramInbox.status == "pending",
+                    or_(TelegramInbox.chat_key.is_(None), TelegramInbox.update_id.in_(heads))
+                ).order_by(TelegramInbox.update_id.asc()).limit(limit)
+            )).all()
+
+            claimed = []
+            lease_expires_at = datetime.utcnow() + timedelta(seconds=INBOX_LEASE_SECONDS)
+            async with write_transaction(db):
+                for row in candidates:
+                    # Update condicional: si otra instancia ya lo tomó (o tomó otro
+                    # update del mismo chat), rowcount es 0
+                    free = TelegramInbox.status == "pending"
+                    if row.chat_key is not None:
+                        free = and_(free, ~InboxManager._chat_busy(row.chat_key))
+                    result = await db.execute(
+                        update(TelegramInbox).where(TelegramInbox.id == row.id, free).values(
+                            status="processing", claimed_by=owner, lease_expires_at=lease_expires_at
+                        ).execution_options(synchronize_session=False)
+                    )
+                    if result.rowcount:
+                        claimed.append(row)
+            return claimed
+
+    @staticmethod
+    async def mark_done(inbox_id: int, owner: str):
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            await db.execute(
+                update(TelegramInbox).where(
+                    TelegramInbox.id == inbox_id,
+                    TelegramInbox.claimed_by == owner
+                ).values(
+                    status="done", processed_at=datetime.utcnow(), claimed_by=None, lease_expires_at=None
+                ).execution_options(synchronize_session=False)
+            )
+
+    @staticmethod
+    async def mark_failed(inbox_id: int, attempts: int, owner: str):
+        """Devuelve el update a la cola o lo descarta si agotó los reintentos"""
+        status = "failed" if attempts >= INBOX_MAX_ATTEMPTS else "pending"
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            await db.execute(
+                update(TelegramInbox).where(
+                    TelegramInbox.id == inbox_id,
+                    TelegramInbox.claimed_by == owner
+                ).values(
+                    status=status, attempts=attempts, claimed_by=None, lease_expires_at=None
+                ).execution_options(synchronize_session=False)
+            )
+
+    @staticmethod
+    async def renew_leases(inbox_ids, owner: str) -> int:
+        """Extiende el lease de los updates que esta réplica sigue procesando"""
+        if not inbox_ids:
+            return 0
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            result = await db.execute(
+                update(TelegramInbox).where(
+                    TelegramInbox.id.in_(list(inbox_ids)),
+                    TelegramInbox.status == "processing",
+                    TelegramInbox.claimed_by == owner
+                ).values(
+                    lease_expires_at=datetime.utcnow() + timedelta(seconds=INBOX_LEASE_SECONDS)
+                ).execution_options(synchronize_session=False)
+            )
+        return result.rowcount
+
+    @staticmethod
+    async def release_expired(owner: str = None) -> int:
+        """
+        Devuelve a la cola los updates en 'processing' cuyo lease venció (su
+        réplica se cayó o dejó de renovarlo) y, si se indica, los que reclamó
+        'owner' en una ejecución anterior. Los de otras réplicas vivas no se tocan.
+        """
+        stale = or_(TelegramInbox.lease_expires_at.is_(None), TelegramInbox.lease_expires_at < datetime.utcnow())
+        if owner is not None:
+            stale = or_(stale, TelegramInbox.claimed_by == owner)
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            result = await db.execute(
+                update(TelegramInbox).where(TelegramInbox.status == "processing", stale).values(
+                    status="pending", claimed_by=None, lease_expires_at=None
+                ).execution_options(synchronize_session=False)
+            )
+        return result.rowcount
+
+    @staticmethod
+    async def prune(retention_hours: int = INBOX_RETENTION_HOURS) -> int:
+        """Elimina updates ya procesados más antiguos que la ventana de deduplicación"""
+        cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            result = await db.execute(
+                delete(TelegramInbox).where(
+                    TelegramInbox.status.in_(("done", "failed")),
+                    TelegramInbox.created_at < cutoff
+                ).execution_options(synchronize_session=False)
+            )
+        return result.rowcount
+
+
+class InboxDispatcher:
+    """
+    Drena la bandeja de entrada con un pool de workers en segundo plano.
+
+    Los updates se reclaman en orden de update_id, a lo sumo uno en proceso por
+    chat, y se entregan al update_processor de la aplicación. Cada réplica firma
+    lo que reclama y renueva el lease mientras lo procesa.
+
+    application.process_update no propaga las excepciones de los handlers: las
+    entrega a los error handlers. El dispatcher registra uno que las anota para
+    que el update cuente como fallido (reintento o 'failed') y no como hecho.
+    """
+
+    PRUNE_INTERVAL_SECONDS = 600
+
+    def __init__(self, application, workers: int = INBOX_WORKERS, poll_seconds: float = INBOX_POLL_SECONDS,
+                 lease_seconds: float = INBOX_LEASE_SECONDS):
+        self.application = application
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.lease_seconds = lease_seconds
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}"
+        self._wakeup = asyncio.Event()
+        # tarea -> id de la fila que procesa
+        self._tasks = {}
+        # update_id en proceso -> excepción de su handler (None si no falló)
+        self._handler_errors = {}
+        self._loop_task = None
+        self._last_prune = 0.0
+        self._last_renew = time.monotonic()
+        self._processed = 0
+        self._failed = 0
+
+    async def start(self):
+        self.application.add_error_handler(self._on_handler_error)
+        resumed = await InboxManager.release_expired(self.instance_id)
+        if resumed:
+            logger.info(f"Reanudando {resumed} updates que quedaron a medio procesar")
+        self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._loop_task:
+            self._loop_task.cancel()
+            try:
+                await self._loop_task
+            except asyncio.CancelledError:
+                pass
+        # Lo que no termine aquí se reanuda en el próximo arranque
+        if self._tasks:
+            await asyncio.wait(self._tasks, timeout=10)
+
+    def notify(self):
+        """Despierta al dispatcher cuando el webhook guarda un update nuevo"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                await self._maybe_renew()
+                free = self.workers - len(self._tasks)
+                if free <= 0:
+                    await asyncio.wait(self._tasks, timeout=self.poll_seconds, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                self._wakeup.clear()
+                rows = await InboxManager.claim_batch(free, self.instance_id)
+                if not rows:
+                    await self._maybe_prune()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                for row in rows:
+                    task = asyncio.create_task(self._process(row))
+                    self._tasks[task] = row.id
+                    task.add_done_callback(self._task_done)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error en el dispatcher de la bandeja de entrada: {e}")
+                await asyncio.sleep(self.poll_seconds)
+
+    def _task_done(self, task):
+        self._tasks.pop(task, None)
+        # El siguiente update del mismo chat ya se puede reclamar
+        self._wakeup.set()
+
+    async def _on_handler_error(self, update, context):
+        """Error handler de la aplicación: registrar uno apaga el log por defecto de PTB"""
+        logger.error(f"Excepción en un handler de Telegram: {context.error}", exc_info=context.error)
+        update_id = getattr(update, "update_id", None)
+        if update_id in self._handler_errors:
+            self._handler_errors[update_id] = context.error
+
+    async def _process(self, row):
+        self._handler_errors[row.update_id] = None
+        try:
+            update = Update.de_json(json.loads(row.payload), self.application.bot)
+            await self.application.update_processor.process_update(
+                update, self.application.process_update(update)
+            )
+            handler_error = self._handler_errors.get(row.update_id)
+            if handler_error is not None:
+                raise handler_error
+            await InboxManager.mark_done(row.id, self.instance_id)
+            self._processed += 1
+        except Exception as e:
+            logger.error(f"Error procesando update {row.update_id} de la bandeja: {e}")
+            self._failed += 1
+            await InboxManager.mark_failed(row.id, (row.attempts or 0) + 1, self.instance_id)
+        finally:
+            self._handler_errors.pop(row.update_id, None)
+
+    async def _maybe_renew(self):
+        """Renueva los leases propios y recupera los vencidos de otras réplicas"""
+        now = time.monotonic()
+        if now - self._last_renew < self.lease_seconds / 3:
+            return
+        self._last_renew = now
+        try:
+            await InboxManager.renew_leases(set(self._tasks.values()), self.instance_id)
+            released = await InboxManager.release_expired()
+            if released:
+                logger.info(f"Bandeja de entrada: {released} updates con lease vencido vuelven a la cola")
+        except Exception as e:
+            logger.error(f"Error renovando los leases de la bandeja de entrada: {e}")
+
+    async def _maybe_prune(self):
+        now = time.monotonic()
+        if now - self._last_prune < self.PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = now
+        try:
+            pruned = await InboxManager.prune()
+            if pruned:
+                logger.info(f"Bandeja de entrada: {pruned} updates antiguos eliminados")
+        except Exception as e:
+            logger.error(f"Error limpiando la bandeja de entrada: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "instance": self.instance_id,
+            "workers": self.workers,
+            "in_flight": len(self._tasks),
+            "processed": self._processed,
+            "failed": self._failed,
+        }
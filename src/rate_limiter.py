@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from telegram.error import RetryAfter
+from src.config import TELEGRAM_GLOBAL_RATE, TELEGRAM_PER_CHAT_RATE, TELEGRAM_SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token bucket simple para el event loop: 'rate' tokens por segundo, hasta 'capacity'"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Bloquea el bucket (por ejemplo tras un 429 con retry_after)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    def idle(self, now) -> bool:
+        self._refill(now)
+        return self._tokens >= self.capacity and now >= self._paused_until
+
+
+class TelegramRateLimiter:
+    """
+    Limita los envíos a los límites de Telegram: uno global para el bot y uno
+    por chat. Reintenta los 429 respetando el retry_after que devuelve la API.
+    """
+
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, per_chat_rate: float = TELEGRAM_PER_CHAT_RATE,
+                 retries: int = TELEGRAM_SEND_RETRIES):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.retries = retries
+        self._chats = {}
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.per_chat_rate, capacity=1)
+        return bucket
+
+    async def acquire(self, chat_id):
+        await self._chat_bucket(chat_id).acquire()
+        await self.global_bucket.acquire()
+
+    async def send_message(self, bot, chat_id, text: str, **kwargs):
+        """bot.send_message con límite de tasa y reintentos ante 429"""
+        for attempt in range(self.retries + 1):
+            await self.acquire(chat_id)
+            try:
+                return await bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"Telegram pidió esperar {delay}s (chat {chat_id}, intento {attempt + 1})")
+                # El 429 aplica al bot completo: se frena todo el envío
+                self.global_bucket.pause(float(delay))
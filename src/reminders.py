@@ -0,0 +1,86 @@
+import logging
+from datetime import timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Niveles de recordatorio en orden de envío: (columna de la bandera, anticipación)
+REMINDER_LEVELS = [
+    ("rem_24h_sent", timedelta(hours=24)),
+    ("rem_3h_sent", timedelta(hours=3)),
+    ("rem_1h_sent", timedelta(hours=1)),
+    ("rem_15m_sent", timedelta(minutes=15)),
+]
+
+# Funciones a las que se avisa (tras el commit) cuando cambia un next_reminder_at
+_wakeup_listeners = []
+
+
+def compute_next_reminder_at(appt):
+    """
+    Momento (naive UTC) en que vence el próximo recordatorio pendiente de la cita.
+
+    Las banderas se marcan siempre como prefijo (al enviar un nivel se marcan
+    también los anteriores), así que el próximo es el primer nivel no enviado.
+    Si ese momento ya pasó, el recordatorio está vencido y se envía el nivel que
+    corresponda a la distancia real al inicio (ver due_level).
+    """
+    if appt.start_time is None:
+        return None
+    for field, offset in REMINDER_LEVELS:
+        if not getattr(appt, field):
+            return appt.start_time - offset
+    return None
+
+
+def due_level(diff: timedelta):
+    """Nivel cuya ventana contiene 'diff' (tiempo hasta el inicio), o None si aún es pronto"""
+    for field, offset in reversed(REMINDER_LEVELS):
+        if diff <= offset:
+            return field
+    return None
+
+
+def mark_sent(appt, field: str):
+    """Marca el nivel enviado y los anteriores para no enviarlos después si se saltaron"""
+    for level_field, _ in REMINDER_LEVELS:
+        setattr(appt, level_field, True)
+        if level_field == field:
+            break
+
+
+def reset_reminders(appt):
+    """Vuelve a activar todos los recordatorios (por ejemplo, al reprogramar la cita)"""
+    for field, _ in REMINDER_LEVELS:
+        setattr(appt, field, False)
+
+
+def refresh_next_reminder(appt, session=None):
+    """Recalcula next_reminder_at; si se pasa la sesión, avisa al scheduler tras el commit"""
+    appt.next_reminder_at = compute_next_reminder_at(appt)
+    if session is not None and appt.next_reminder_at is not None:
+        session.info.setdefault("reminder_wakeups", []).append(appt.next_reminder_at)
+
+
+def add_wakeup_listener(callback):
+    _wakeup_listeners.append(callback)
+
+
+# Registrados en Session: cada AsyncSession confirma a través de una Session síncrona
+@event.listens_for(Session, "after_commit")
+def _notify_after_commit(session):
+    wakeups = session.info.pop("reminder_wakeups", None)
+    if not wakeups:
+        return
+    earliest = min(wakeups)
+    for callback in _wakeup_listeners:
+        try:
+            callback(earliest)
+        except Exception as e:
+            logger.error(f"Error avisando cambio de recordatorios: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("reminder_wakeups", None)
@@ -1,92 +1,262 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from src.database import SessionLocal, Appointment
-from src.config import TIMEZONE
+from sqlalchemy import func, update, select, or_
+from src.database import AsyncSessionLocal, Appointment, write_transaction
+from src.config import (
+    TIMEZONE,
+    REMINDER_MAX_SLEEP_SECONDS,
+    REMINDER_BATCH_SIZE,
+    REMINDER_RETRY_SECONDS,
+    REMINDER_LEASE_SECONDS,
+    CALENDAR_SYNC_INTERVAL_SECONDS,
+)
+from src.auth_manager import AuthManager
+from src.calendar_sync import CalendarSync
+from src.rate_limiter import TelegramRateLimiter
+from src.reminders import REMINDER_LEVELS, compute_next_reminder_at, due_level, mark_sent, add_wakeup_listener
 from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import asyncio
 import logging
+import os
+import socket
+import uuid
 
 logger = logging.getLogger(__name__)
 
 class SchedulerService:
+    JOB_ID = "check_reminders"
+    SYNC_JOB_ID = "calendar_sync"
+
     def __init__(self, bot_instance):
         self.scheduler = AsyncIOScheduler(timezone=TIMEZONE)
         self.bot = bot_instance
+        self.rate_limiter = TelegramRateLimiter()
+        self._lock = asyncio.Lock()
+        # Identifica a esta réplica en los leases de la tabla appointments
+        self.instance_id = f"{socket.gethostname()}-{os.getpid()}"
 
-    def start(self):
-        self.scheduler.add_job(self.check_reminders, 'interval', minutes=5)
+    async def start(self):
+        await self.backfill_next_reminders()
+        add_wakeup_listener(self.wake)
         self.scheduler.start()
+        self._schedule_at(datetime.utcnow())
+        # Trae los cambios hechos directamente en Google Calendar (eventos nuevos, movidos o borrados)
+        self.scheduler.add_job(
+            self.sync_calendars, 'interval',
+            seconds=CALENDAR_SYNC_INTERVAL_SECONDS, id=self.SYNC_JOB_ID,
+            replace_existing=True, coalesce=True, max_instances=1
+        )
 
-    async def check_reminders(self):
-        db = SessionLocal()
-        # Usamos UTC para comparar con lo guardado en DB (naive UTC)
+    async def sync_calendars(self):
+        try:
+            await CalendarSync.sync_all(AuthManager.get_calendar_service)
+        except Exception as e:
+            logger.error(f"Error sincronizando calendarios: {e}")
+
+    def _schedule_at(self, run_at_utc: datetime):
+        """Programa la próxima revisión (naive UTC), reemplazando la anterior"""
+        self.scheduler.add_job(
+            self.check_reminders, 'date',
+            run_date=run_at_utc.replace(tzinfo=timezone.utc),
+            id=self.JOB_ID, replace_existing=True,
+            misfire_grace_time=None, coalesce=True
+        )
+
+    def wake(self, next_reminder_at: datetime):
+        """Adelanta la próxima revisión si un recordatorio nuevo vence antes"""
+        job = self.scheduler.get_job(self.JOB_ID)
+        run_at = max(next_reminder_at, datetime.utcnow())
+        if job is None or job.next_run_time is None or job.next_run_time > run_at.replace(tzinfo=timezone.utc):
+            self._schedule_at(run_at)
+
+    async def _schedule_next(self):
+        """Duerme hasta el próximo recordatorio según el índice, con un tope de seguridad"""
         now_utc = datetime.utcnow()
-        
-        # Consultar citas futuras (que no hayan pasado ya)
-        appointments = db.query(Appointment).filter(
-            Appointment.start_time > now_utc
-        ).all()
+        run_at = now_utc + timedelta(seconds=REMINDER_MAX_SLEEP_SECONDS)
+        try:
+            async with AsyncSessionLocal() as db:
+                # Próximo vencimiento libre, o el fin del primer lease de otra réplica
+                # (si esa réplica cae, sus filas quedan disponibles al expirar el lease)
+                next_at = await db.scalar(
+                    select(func.min(Appointment.next_reminder_at)).where(self._lease_free(now_utc))
+                )
+                lease_end = await db.scalar(
+                    select(func.min(Appointment.lease_expires_at)).where(Appointment.lease_expires_at >= now_utc)
+                )
+            for candidate in (next_at, lease_end):
+                if candidate is not None:
+                    run_at = max(min(candidate, run_at), now_utc)
+        except Exception as e:
+            logger.error(f"Error calculando la próxima revisión de recordatorios: {e}")
+        self._schedule_at(run_at)
+
+    async def backfill_next_reminders(self):
+        """Calcula next_reminder_at para citas creadas antes de existir la columna"""
+        async with AsyncSessionLocal() as db:
+            pending = (await db.scalars(select(Appointment).where(
+                Appointment.next_reminder_at.is_(None),
+                Appointment.start_time > datetime.utcnow(),
+                Appointment.rem_15m_sent.isnot(True)
+            ))).all()
+            for appt in pending:
+                appt.next_reminder_at = compute_next_reminder_at(appt)
+            await db.commit()
+        if pending:
+            logger.info(f"next_reminder_at calculado para {len(pending)} citas existentes")
 
-        for appt in appointments:
+    async def check_reminders(self):
+        async with self._lock:
             try:
-                # Convertir naive UTC de DB a aware UTC para cálculos
-                start_utc = appt.start_time.replace(tzinfo=timezone.utc)
-                diff = start_utc - now_utc.replace(tzinfo=timezone.utc)
-                
-                # Convertir a zona horaria local para el mensaje
-                from src.config import TIMEZONE
-                start_local = start_utc.astimezone(TIMEZONE)
-                now_local = datetime.now(TIMEZONE)
-                
-                time_str = start_local.strftime('%H:%M')
-                
-                # Determinar si es hoy o mañana localmente
-                if start_local.date() == now_local.date():
-                    day_str = "hoy"
-                elif start_local.date() == (now_local + timedelta(days=1)).date():
-                    day_str = "mañana"
-                else:
-                    day_str = f"el {start_local.strftime('%d/%m')}"
-
-                message_template = f"🔔 Recordatorio: Tienes una cita '{appt.title}' {day_str} a las {time_str}. Recuerda estar 10 minutos antes. 🗓️ ¿Quieres que te envíe el link del meet?"
-                
-                message = None
-                field_to_mark = None
-                
-                # Lógica de ventanas no solapadas
-                if diff <= timedelta(minutes=15):
-                    if not appt.rem_15m_sent:
-                        message = message_template
-                        field_to_mark = "rem_15m_sent"
-                elif diff <= timedelta(hours=1):
-                    if not appt.rem_1h_sent:
-                        message = message_template
-                        field_to_mark = "rem_1h_sent"
-                elif diff <= timedelta(hours=3):
-                    if not appt.rem_3h_sent:
-                        message = message_template
-                        field_to_mark = "rem_3h_sent"
-                elif diff <= timedelta(hours=24):
-                    if not appt.rem_24h_sent:
-                        message = message_template
-                        field_to_mark = "rem_24h_sent"
-
-                if message and field_to_mark:
-                    await self.bot.send_message(chat_id=appt.telegram_id, text=message)
-                    setattr(appt, field_to_mark, True)
-                    # Marcar también los anteriores para no enviarlos después si por algo se saltan
-                    if field_to_mark == "rem_3h_sent": appt.rem_24h_sent = True
-                    if field_to_mark == "rem_1h_sent": 
-                        appt.rem_24h_sent = True
-                        appt.rem_3h_sent = True
-                    if field_to_mark == "rem_15m_sent":
-                        appt.rem_24h_sent = True
-                        appt.rem_3h_sent = True
-                        appt.rem_1h_sent = True
-                        
-                    db.commit()
-                    logger.info(f"Recordatorio {field_to_mark} enviado para la cita {appt.id}")
-                    
+                while await self._process_due_batch() >= REMINDER_BATCH_SIZE:
+                    pass
             except Exception as e:
-                logger.error(f"Error procesando cita {appt.id} en scheduler: {e}")
-                db.rollback()
-        
-        db.close()
+                logger.error(f"Error revisando recordatorios: {e}")
+            finally:
+                await self._schedule_next()
+
+    async def _process_due_batch(self) -> int:
+        async with AsyncSessionLocal() as db:
+            # Usamos UTC para comparar con lo guardado en DB (naive UTC)
+            now_utc = datetime.utcnow()
+
+            # Citas que empezaron sin que se enviara su recordatorio: ya no queda nada por enviar
+            async with write_transaction(db):
+                await db.execute(
+                    update(Appointment).where(
+                        Appointment.next_reminder_at <= now_utc,
+                        Appointment.start_time <= now_utc
+                    ).values(next_reminder_at=None).execution_options(synchronize_session=False)
+                )
+
+            # Solo las citas con un recordatorio vencido, reclamadas para esta réplica
+            lease_token, claimed_ids = await self._claim_due(db, now_utc)
+            if not claimed_ids:
+                return 0
+            # Por clave primaria: lease_owner no tiene índice
+            rows = (await db.execute(select(
+                Appointment.id, Appointment.telegram_id, Appointment.title, Appointment.start_time,
+                *[getattr(Appointment, field) for field, _ in REMINDER_LEVELS]
+            ).where(
+                Appointment.id.in_(claimed_ids)
+            ))).all()
+
+            updates, digests = self._plan_reminders(rows, now_utc)
+
+            # Un mensaje por usuario, enviados en paralelo bajo el límite de tasa
+            users = list(digests)
+            results = await asyncio.gather(
+                *(self._send_digest(user_id, digests[user_id]) for user_id in users),
+                return_exceptions=True
+            )
+            for user_id, result in zip(users, results):
+                if isinstance(result, BaseException):
+                    logger.error(f"Error enviando recordatorios a {user_id}: {result}")
+                    # Reintentar más tarde sin bloquear al resto de citas vencidas
+                    retry_at = now_utc + timedelta(seconds=REMINDER_RETRY_SECONDS)
+                    for row, _ in digests[user_id]:
+                        updates[row.id] = {"id": row.id, "next_reminder_at": retry_at}
+                else:
+                    logger.info(f"{len(digests[user_id])} recordatorios enviados a {user_id}")
+
+            # Banderas, próximo vencimiento y liberación del lease en un solo UPDATE masivo.
+            # Solo se escribe si el lease sigue siendo nuestro.
+            if updates:
+                for mapping in updates.values():
+                    mapping["lease_owner"] = None
+                    mapping["lease_expires_at"] = None
+                async with write_transaction(db):
+                    await db.execute(
+                        update(Appointment).where(Appointment.lease_owner == lease_token),
+                        list(updates.values()),
+                        execution_options={"synchronize_session": None}
+                    )
+
+            return len(rows)
+
+    @staticmethod
+    def _lease_free(now_utc: datetime):
+        return or_(Appointment.lease_expires_at.is_(None), Appointment.lease_expires_at < now_utc)
+
+    async def _claim_due(self, db, now_utc: datetime) -> tuple[str, list[int]]:
+        """
+        Reclama hasta REMINDER_BATCH_SIZE citas vencidas y sin lease vigente.
+
+        En PostgreSQL se usa SELECT ... FOR UPDATE SKIP LOCKED, así varias réplicas
+        se reparten las filas sin esperarse. En SQLite el UPDATE con subconsulta es
+        atómico porque la base admite un solo escritor a la vez. Devuelve el token
+        con el que quedaron marcadas las filas de este lote y sus ids (RETURNING).
+        """
+        lease_token = f"{self.instance_id}:{uuid.uuid4().hex[:12]}"
+        lease_expires_at = now_utc + timedelta(seconds=REMINDER_LEASE_SECONDS)
+        due = select(Appointment.id).where(
+            Appointment.next_reminder_at <= now_utc,
+            self._lease_free(now_utc)
+        ).order_by(Appointment.next_reminder_at.asc()).limit(REMINDER_BATCH_SIZE)
+
+        if db.get_bind().dialect.name == "postgresql":
+            ids = (await db.scalars(due.with_for_update(skip_locked=True))).all()
+            target = Appointment.id.in_(ids) if ids else None
+        else:
+            target = Appointment.id.in_(due.scalar_subquery())
+
+        claimed_ids = []
+        async with write_transaction(db):
+            if target is not None:
+                claimed_ids = (await db.scalars(
+                    update(Appointment).where(target, self._lease_free(now_utc)).values(
+                        lease_owner=lease_token, lease_expires_at=lease_expires_at
+                    ).returning(Appointment.id).execution_options(synchronize_session=False)
+                )).all()
+        return lease_token, list(claimed_ids)
+
+    @staticmethod
+    def _plan_reminders(rows, now_utc: datetime):
+        """Decide qué nivel toca a cada cita vencida y agrupa los envíos por usuario"""
+        updates = {}
+        digests = {}
+        for row in rows:
+            state = SimpleNamespace(start_time=row.start_time, **{f: getattr(row, f) for f, _ in REMINDER_LEVELS})
+            diff = row.start_time - now_utc
+            field_to_mark = due_level(diff)
+            if field_to_mark is not None:
+                mark_sent(state, field_to_mark)
+                digests.setdefault(row.telegram_id, []).append((row, field_to_mark))
+
+            mapping = {"id": row.id, "next_reminder_at": compute_next_reminder_at(state)}
+            mapping.update({f: getattr(state, f) for f, _ in REMINDER_LEVELS})
+            updates[row.id] = mapping
+        return updates, digests
+
+    async def _send_digest(self, user_id: str, items):
+        await self.rate_limiter.send_message(self.bot, user_id, self._format_digest(items))
+
+    @staticmethod
+    def _describe_start(start_time: datetime):
+        # Convertir naive UTC de DB a zona horaria local para el mensaje
+        start_local = start_time.replace(tzinfo=timezone.utc).astimezone(TIMEZONE)
+        now_local = datetime.now(TIMEZONE)
+
+        time_str = start_local.strftime('%H:%M')
+
+        # Determinar si es hoy o mañana localmente
+        if start_local.date() == now_local.date():
+            day_str = "hoy"
+        elif start_local.date() == (now_local + timedelta(days=1)).date():
+            day_str = "mañana"
+        else:
+            day_str = f"el {start_local.strftime('%d/%m')}"
+        return day_str, time_str
+
+    @staticmethod
+    def _format_digest(items) -> str:
+        if len(items) == 1:
+            row, _ = items[0]
+            day_str, time_str = SchedulerService._describe_start(row.start_time)
+            return f"🔔 Recordatorio: Tienes una cita '{row.title}' {day_str} a las {time_str}. Recuerda estar 10 minutos antes. 🗓️ ¿Quieres que te envíe el link del meet?"
+
+        lines = [f"🔔 Recordatorio: Tienes {len(items)} citas próximas:"]
+        for row, _ in sorted(items, key=lambda item: item[0].start_time):
+            day_str, time_str = SchedulerService._describe_start(row.start_time)
+            lines.append(f"• '{row.title}' {day_str} a las {time_str}")
+        lines.append("Recuerda estar 10 minutos antes. 🗓️ ¿Quieres que te envíe el link del meet?")
+        return "\n".join(lines)
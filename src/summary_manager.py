@@ -0,0 +1,214 @@
+import asyncio
+import json
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import delete, func, select
+from src.config import (
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_MAX_MESSAGES,
+    SUMMARY_ENABLED,
+    SUMMARY_BATCH_MESSAGES,
+    SUMMARY_MAX_FOLD_MESSAGES,
+    SUMMARY_CACHE_SIZE,
+)
+from src.database import AsyncSessionLocal, ConversationHistory, ConversationSummary, write_transaction
+from src.history_manager import HistoryManager
+
+logger = logging.getLogger(__name__)
+
+# Largo máximo de cada resultado de herramienta en el texto que se resume
+_TOOL_RESULT_CHARS = 500
+
+
+def _render(messages) -> str:
+    """Transcripción legible de los mensajes a plegar en el resumen"""
+    lines = []
+    for msg in messages:
+        role = msg.get("role")
+        if role == "user":
+            lines.append(f"Usuario: {msg.get('content')}")
+        elif role == "assistant":
+            if msg.get("content"):
+                lines.append(f"Asistente: {msg['content']}")
+            for tc in msg.get("tool_calls") or []:
+                arguments = tc["function"]["arguments"]
+                if not isinstance(arguments, str):
+                    arguments = json.dumps(arguments, ensure_ascii=False)
+                lines.append(f"Asistente usó {tc['function']['name']}({arguments})")
+        elif role == "tool":
+            lines.append(f"Resultado de {msg.get('name')}: {(msg.get('content') or '')[:_TOOL_RESULT_CHARS]}")
+    return "\n".join(lines)
+
+
+class SummaryManager:
+    """
+    Resumen acumulado de la parte antigua de la conversación de cada usuario.
+
+    El historial que ve Gemini es solo la cola reciente (HistoryManager); lo
+    anterior se pliega en segundo plano, después de cada turno, en un resumen
+    que se guarda en conversation_summaries y se antepone a la conversación.
+    Así el tamaño del prompt queda acotado sin perder compromisos o datos de
+    hace semanas. /reset lo borra junto con el historial.
+    """
+
+    # telegram_id -> resumen ("" si el usuario no tiene), LRU
+    _cache = OrderedDict()
+    # /reset avanza la generación: una compactación que estaba en curso no guarda
+    _generations = {}
+    _running = set()
+    _tasks = set()
+
+    @staticmethod
+    def _remember(user_id: str, summary: str):
+        SummaryManager._cache[user_id] = summary
+        SummaryManager._cache.move_to_end(user_id)
+        while len(SummaryManager._cache) > SUMMARY_CACHE_SIZE:
+            SummaryManager._cache.popitem(last=False)
+
+    @staticmethod
+    async def get(user_id: str) -> str:
+        """Resumen actual del usuario ("" si no hay)"""
+        summary = SummaryManager._cache.get(user_id)
+        if summary is not None:
+            SummaryManager._cache.move_to_end(user_id)
+            return summary
+
+        async with AsyncSessionLocal() as db:
+            summary = (await db.scalars(
+                select(ConversationSummary.summary).where(ConversationSummary.telegram_id == user_id)
+            )).first() or ""
+        SummaryManager._remember(user_id, summary)
+        return summary
+
+    @staticmethod
+    async def delete(user_id: str):
+        """Borra el resumen (lo usa /reset)"""
+        SummaryManager._generations[user_id] = SummaryManager._generations.get(user_id, 0) + 1
+        async with AsyncSessionLocal() as db, write_transaction(db):
+            await db.execute(delete(ConversationSummary).where(ConversationSummary.telegram_id == user_id))
+        SummaryManager._cache.pop(user_id, None)
+
+    @staticmethod
+    async def _get_state(db, user_id: str):
+        return (await db.scalars(
+            select(ConversationSummary).where(ConversationSummary.telegram_id == user_id)
+        )).first()
+
+    @staticmethod
+    def schedule(user_id: str, ai):
+        """Lanza la compactación del usuario en segundo plano (si no hay una en curso)"""
+        if not SUMMARY_ENABLED or user_id in SummaryManager._running:
+            return
+        SummaryManager._running.add(user_id)
+        task = asyncio.create_task(SummaryManager._compact_safely(user_id, ai))
+        SummaryManager._tasks.add(task)
+        task.add_done_callback(SummaryManager._tasks.discard)
+
+    @staticmethod
+    async def _compact_safely(user_id: str, ai):
+        try:
+            await SummaryManager.compact(user_id, ai)
+        except Exception as e:
+            logger.error(f"Error resumiendo la conversación de {user_id}: {e}")
+        finally:
+            SummaryManager._running.discard(user_id)
+
+    @staticmethod
+    async def _window_start_id(db, user_id: str):
+        """
+        Id del primer mensaje de la ventana que get_user_history envía a Gemini
+        (mismo presupuesto de tokens y mismo máximo de mensajes). Todo lo
+        anterior ya no está en el prompt y hay que plegarlo en el resumen.
+        """
+        records = (await db.scalars(select(ConversationHistory).where(
+            ConversationHistory.telegram_id == user_id
+        ).order_by(
+            ConversationHistory.created_at.desc(),
+            ConversationHistory.id.desc()
+        ).limit(HISTORY_MAX_MESSAGES))).all()
+
+        parsed = []
+        for rec in reversed(records):
+            try:
+                msg = HistoryManager._parse_record(rec)
+            except Exception:
+                continue
+            if msg is not None:
+                parsed.append((rec.id, msg))
+        window = HistoryManager._select_window([msg for _, msg in parsed], HISTORY_TOKEN_BUDGET)
+        if not window:
+            # Ni el último mensaje entra: no queda nada textual
+            return records[0].id + 1 if records else None
+        return parsed[len(parsed) - len(window)][0]
+
+    @staticmethod
+    async def compact(user_id: str, ai) -> bool:
+        """
+        Pliega en el resumen los mensajes sin resumir que quedaron fuera de la
+        ventana del historial, si ya son al menos SUMMARY_BATCH_MESSAGES.
+        Devuelve True si el resumen cambió.
+        """
+        generation = SummaryManager._generations.get(user_id, 0)
+        async with AsyncSessionLocal() as db:
+            state = await SummaryManager._get_state(db, user_id)
+            covered = state.covered_until_id if state else 0
+            previous = state.summary if state and state.summary else ""
+
+            pending = await db.scalar(select(func.count(ConversationHistory.id)).where(
+                ConversationHistory.telegram_id == user_id,
+                ConversationHistory.id > covered
+            ))
+            if pending < SUMMARY_BATCH_MESSAGES:
+                return False
+
+            window_start = await SummaryManager._window_start_id(db, user_id)
+            if window_start is None or window_start <= covered:
+                return False
+
+            # Si hay un atraso muy grande (historial anterior a esta función) se
+            # resumen solo los SUMMARY_MAX_FOLD_MESSAGES más recientes
+            rows = (await db.scalars(select(ConversationHistory).where(
+                ConversationHistory.telegram_id == user_id,
+                ConversationHistory.id > covered,
+                ConversationHistory.id < window_start
+            ).order_by(
+                ConversationHistory.created_at.desc(),
+                ConversationHistory.id.desc()
+            ).limit(SUMMARY_MAX_FOLD_MESSAGES))).all()
+            rows = rows[::-1]
+
+        if len(rows) < SUMMARY_BATCH_MESSAGES:
+            return False
+
+        folded = []
+        for rec in rows:
+            try:
+                msg = HistoryManager._parse_record(rec)
+            except Exception as e:
+                logger.error(f"Error parseando mensaje de historial: {e}")
+                continue
+            if msg is not None:
+                folded.append(msg)
+        covered_until = max(rec.id for rec in rows)
+
+        summary = await ai.summarize_conversation(previous, _render(folded))
+        if not summary:
+            return False
+        if SummaryManager._generations.get(user_id, 0) != generation:
+            # /reset mientras se generaba: el resumen ya no corresponde
+            return False
+
+        async with AsyncSessionLocal() as db:
+            state = await SummaryManager._get_state(db, user_id)
+            if state is None:
+                state = ConversationSummary(telegram_id=user_id)
+                db.add(state)
+            state.summary = summary
+            state.covered_until_id = covered_until
+            state.updated_at = datetime.utcnow()
+            await db.commit()
+
+        SummaryManager._remember(user_id, summary)
+        logger.info(f"Resumen de {user_id} actualizado: {len(folded)} mensajes plegados")
+        return True
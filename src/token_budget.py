@@ -0,0 +1,64 @@
+import json
+from src.config import TOKEN_CHARS_PER_TOKEN
+
+# Tokens fijos por mensaje (rol, separadores) además del texto
+_MESSAGE_OVERHEAD_TOKENS = 4
+# El factor de corrección se mueve de a poco y dentro de un rango razonable
+_CALIBRATION_WEIGHT = 0.2
+_MIN_FACTOR, _MAX_FACTOR = 0.5, 3.0
+
+
+def _message_chars(msg: dict) -> int:
+    chars = len(msg.get("content") or "")
+    for tc in msg.get("tool_calls") or []:
+        fn = tc["function"] if isinstance(tc, dict) else tc.function
+        name = fn["name"] if isinstance(fn, dict) else fn.name
+        arguments = fn["arguments"] if isinstance(fn, dict) else fn.arguments
+        if not isinstance(arguments, str):
+            arguments = json.dumps(arguments, ensure_ascii=False)
+        chars += len(name) + len(arguments)
+    return chars + len(msg.get("name") or "")
+
+
+class TokenEstimator:
+    """
+    Estimación local de tokens de los mensajes del historial.
+
+    Cuenta caracteres / TOKEN_CHARS_PER_TOKEN más un costo fijo por mensaje,
+    multiplicado por un factor de corrección. AIService ajusta ese factor de
+    vez en cuando comparando la estimación con count_tokens de Gemini, así
+    que se adapta al idioma y al tipo de contenido reales sin pagar una
+    llamada por turno.
+    """
+
+    def __init__(self, chars_per_token: float = TOKEN_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+        self.factor = 1.0
+        self.samples = 0
+
+    def raw(self, msg: dict) -> float:
+        """Estimación sin corregir de un mensaje"""
+        return _message_chars(msg) / self.chars_per_token + _MESSAGE_OVERHEAD_TOKENS
+
+    def estimate_message(self, msg: dict) -> int:
+        return int(self.raw(msg) * self.factor) + 1
+
+    def estimate(self, messages: list) -> int:
+        return sum(self.estimate_message(m) for m in messages)
+
+    def calibrate(self, messages: list, actual_tokens: int):
+        """Acerca el factor de corrección a la relación real para 'messages'"""
+        raw = sum(self.raw(m) for m in messages)
+        if raw <= 0 or actual_tokens <= 0:
+            return
+        ratio = min(max(actual_tokens / raw, _MIN_FACTOR), _MAX_FACTOR)
+        weight = 1.0 if self.samples == 0 else _CALIBRATION_WEIGHT
+        self.factor += (ratio - self.factor) * weight
+        self.samples += 1
+
+    def stats(self) -> dict:
+        return {"factor": round(self.factor, 3), "samples": self.samples}
+
+
+# Compartido por HistoryManager (ventana del historial) y AIService (calibración)
+estimator = TokenEstimator()
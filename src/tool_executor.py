@@ -1,31 +1,98 @@
+import asyncio
 import logging
 import json
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from src.database import SessionLocal, Appointment
+from src.database import AsyncSessionLocal, Appointment, session_lock
 from src.calendar_api import CalendarService
+from src.calendar_sync import CalendarSync
+from src.conflicts import ConflictChecker
+from src.free_slots import find_free_slots
+from src.google_clients import run_google_io
+from src.reminders import refresh_next_reminder, reset_reminders
 
 logger = logging.getLogger(__name__)
 
+# Herramientas que afectan a todas las citas: se ejecutan solas, después de las
+# anteriores y antes de las siguientes
+_BARRIER_TOOLS = {"delete_all_appointments"}
+
+@asynccontextmanager
+async def _db_scope(db=None):
+    """Usa la sesión del turno si se recibe; si no, abre una propia con commit al salir.
+
+    Con la sesión del turno los cambios se hacen a nivel ORM (add / delete /
+    atributos) para que ningún DML se ejecute antes del commit del turno y la
+    DB no quede bloqueada mientras se espera a Gemini o a Google. Las
+    herramientas del turno corren en paralelo: la sesión se toma con su lock,
+    nunca durante una llamada a Google.
+    """
+    if db is not None:
+        async with session_lock(db):
+            yield db
+        return
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
 class ToolExecutor:
     @staticmethod
-    async def execute(name, args, telegram_id, services: dict):
-        """Ejecuta la lógica de una herramienta específica recibida de la IA"""
+    async def execute_many(calls, telegram_id, services: dict, db=None):
+        """Ejecuta las herramientas pedidas en una misma respuesta de la IA.
+
+        'calls' es una lista de (nombre, args). Las llamadas independientes corren
+        en paralelo; las que tocan el mismo event_id se encadenan en el orden
+        pedido, y delete_all_appointments separa lo anterior de lo posterior.
+        Devuelve los resultados en el mismo orden que 'calls'.
+        """
+        results = [None] * len(calls)
+
+        async def run_chain(indexes):
+            for i in indexes:
+                name, args = calls[i]
+                results[i] = await ToolExecutor.execute(name, args, telegram_id, services, db=db)
+
+        chains = {}
+        for i, (name, args) in enumerate(calls):
+            if name in _BARRIER_TOOLS:
+                await asyncio.gather(*(run_chain(c) for c in chains.values()))
+                chains = {}
+                await run_chain([i])
+                continue
+            event_id = args.get("event_id") if isinstance(args, dict) else None
+            chains.setdefault(event_id or ("call", i), []).append(i)
+        await asyncio.gather(*(run_chain(c) for c in chains.values()))
+        return results
+
+    @staticmethod
+    async def execute(name, args, telegram_id, services: dict, db=None):
+        """Ejecuta la lógica de una herramienta específica recibida de la IA.
+
+        Si se pasa 'db' (sesión del TurnUnitOfWork), los cambios en Appointment
+        se confirman junto con el resto del turno.
+        """
         try:
+            # Solo se pide (y construye) el servicio que la herramienta necesita
+            if name == "send_email":
+                return await ToolExecutor._send_email(args, services.get("gmail"))
             calendar_service = services.get("calendar")
-            gmail_service = services.get("gmail")
 
             if name == "create_appointment":
-                return await ToolExecutor._create_appointment(args, telegram_id, calendar_service)
+                return await ToolExecutor._create_appointment(args, telegram_id, calendar_service, db)
             elif name == "list_appointments":
-                return ToolExecutor._list_appointments(args, calendar_service)
+                return await ToolExecutor._list_appointments(args, telegram_id, calendar_service, db)
             elif name == "update_appointment":
-                return await ToolExecutor._update_appointment(args, calendar_service)
+                return await ToolExecutor._update_appointment(args, telegram_id, calendar_service, db)
             elif name == "delete_appointment":
-                return await ToolExecutor._delete_appointment(args, calendar_service)
+                return await ToolExecutor._delete_appointment(args, telegram_id, calendar_service, db)
+            elif name == "find_free_slots":
+                return await ToolExecutor._find_free_slots(args, calendar_service)
             elif name == "delete_all_appointments":
-                return await ToolExecutor._delete_all_appointments(calendar_service, telegram_id)
-            elif name == "send_email":
-                return await ToolExecutor._send_email(args, gmail_service)
+                return await ToolExecutor._delete_all_appointments(calendar_service, telegram_id, db)
             
             return {"status": "error", "message": f"Herramienta '{name}' no reconocida."}
         except Exception as e:
@@ -33,7 +100,7 @@ class ToolExecutor:
             return {"status": "error", "message": str(e)}
 
     @staticmethod
-    async def _create_appointment(args, telegram_id, calendar_service):
+    async def _create_appointment(args, telegram_id, calendar_service, db=None):
         start_dt = datetime.fromisoformat(args['start_time'].replace('Z', '+00:00'))
         if start_dt.tzinfo is None:
             # Si viene sin zona horaria, asumimos UTC por el formato ISO de la IA
@@ -49,6 +116,14 @@ class ToolExecutor:
             else:
                 end_dt = end_dt.astimezone(timezone.utc)
         
+        # Antes de crear: avisar si el horario choca con otros eventos
+        if not args.get('ignore_conflicts'):
+            conflicts = await ToolExecutor._find_conflicts(
+                telegram_id, calendar_service, start_dt, end_dt or (start_dt + timedelta(hours=1)), db
+            )
+            if conflicts:
+                return ToolExecutor._conflict_result(conflicts)
+
         user_emails = args.get('user_emails', [])
         # Soporte para el campo antiguo por si acaso la IA se confunde al principio
         if not user_emails and 'user_email' in args:
@@ -56,7 +131,8 @@ class ToolExecutor:
             
         enable_meet = args.get('enable_meet', False)
         
-        event = calendar_service.create_event(
+        event = await run_google_io(
+            calendar_service.create_event,
             args['summary'], 
             start_dt, 
             end_dt, 
@@ -64,20 +140,17 @@ class ToolExecutor:
             enable_meet=enable_meet
         )
         
-        # Guardar en DB para seguimiento
-        db = SessionLocal()
-        try:
-            new_appt = Appointment(
-                telegram_id=telegram_id,
-                event_id=event['id'],
-                title=args['summary'],
-                start_time=start_dt.replace(tzinfo=None), # Guardamos como naive UTC
-                end_time=(end_dt or (start_dt + timedelta(hours=1))).replace(tzinfo=None) # Guardamos como naive UTC
-            )
-            db.add(new_appt)
-            db.commit()
-        finally:
-            db.close()
+        # Guardar en DB para seguimiento (una sincronización del mismo turno pudo haberla agregado ya)
+        async with _db_scope(db) as session:
+            new_appt = (await CalendarSync.load_rows(session, Appointment, [event['id']])).get(event['id'])
+            if new_appt is None:
+                new_appt = Appointment(telegram_id=telegram_id, event_id=event['id'])
+                session.add(new_appt)
+            new_appt.title = args['summary']
+            new_appt.start_time = start_dt.replace(tzinfo=None) # Guardamos como naive UTC
+            new_appt.end_time = (end_dt or (start_dt + timedelta(hours=1))).replace(tzinfo=None) # Guardamos como naive UTC
+            refresh_next_reminder(new_appt, session)
+            await CalendarSync.upsert_events(session, telegram_id, [event])
             
         meet_link = event.get('hangoutLink')
         return {
@@ -88,35 +161,113 @@ class ToolExecutor:
         }
 
     @staticmethod
-    def _list_appointments(args, calendar_service):
+    async def _find_conflicts(telegram_id, calendar_service, start_dt, end_dt, db=None, exclude_event_id=None):
+        """Eventos que se cruzan con [start_dt, end_dt): índice local, o Google si la copia no está disponible"""
+        try:
+            await CalendarSync.ensure_fresh(telegram_id, calendar_service, db=db)
+            async with _db_scope(db) as session:
+                rows = await ConflictChecker.find(
+                    session, telegram_id,
+                    start_dt.astimezone(timezone.utc).replace(tzinfo=None),
+                    end_dt.astimezone(timezone.utc).replace(tzinfo=None),
+                    exclude_event_id
+                )
+                return [{"id": r.event_id, "summary": r.summary, "start": CalendarSync.render_start(r)} for r in rows]
+        except Exception as e:
+            logger.warning(f"Copia local del calendario no disponible, verificando conflictos en Google: {e}")
+            events = await run_google_io(calendar_service.check_conflicts, start_dt, end_dt, exclude_event_id)
+            return [{"id": e['id'], "summary": e.get('summary'), "start": e['start']} for e in events]
+
+    @staticmethod
+    def _conflict_result(conflicts):
+        return {
+            "status": "conflict",
+            "message": "El horario se cruza con otros eventos. Avísale al usuario y, si confirma, "
+                       "vuelve a llamar con ignore_conflicts=true.",
+            "conflicts": conflicts
+        }
+
+    @staticmethod
+    async def _list_appointments(args, telegram_id, calendar_service, db=None):
         time_min_str = args.get('time_min')
-        parsed_time_min = None
+        time_min = datetime.now(timezone.utc)
         if time_min_str:
             try:
                 dt = datetime.fromisoformat(time_min_str.replace('Z', '+00:00'))
                 if dt.tzinfo is None:
                     dt = dt.replace(tzinfo=timezone.utc)
-                parsed_time_min = dt.isoformat()
+                time_min = dt
             except ValueError:
-                # Si falla el parseo, se dejará nulo y calendar_api usará datetime.now
+                # Si falla el parseo, se usa el momento actual
                 logger.warning(f"Formato de fecha inválido de IA para list_appointments: {time_min_str}")
-                parsed_time_min = None
 
-        events = calendar_service.list_events(parsed_time_min)
-        return [{"id": e['id'], "summary": e['summary'], "start": e['start']} for e in events]
+        try:
+            # Lectura desde la copia local (sincronizada si quedó vieja)
+            await CalendarSync.ensure_fresh(telegram_id, calendar_service, db=db)
+            events = await CalendarSync.list_events(
+                telegram_id, time_min.astimezone(timezone.utc).replace(tzinfo=None), db=db
+            )
+        except Exception as e:
+            logger.warning(f"Copia local del calendario no disponible, consultando Google: {e}")
+            events = await run_google_io(calendar_service.list_events, time_min.isoformat())
+        return [{"id": e['id'], "summary": e.get('summary'), "start": e['start']} for e in events]
 
     @staticmethod
-    async def _update_appointment(args, calendar_service):
+    async def _find_free_slots(args, calendar_service):
+        now = datetime.now(timezone.utc)
+        time_min = now
+        time_max = None
+        for key in ('time_min', 'time_max'):
+            if args.get(key):
+                dt = datetime.fromisoformat(args[key].replace('Z', '+00:00'))
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                if key == 'time_min':
+                    time_min = max(dt, now)
+                else:
+                    time_max = dt
+        time_max = time_max or (time_min + timedelta(days=7))
+        if time_max <= time_min:
+            return {"status": "error", "message": "time_max debe ser posterior a time_min."}
+
+        duration = timedelta(minutes=int(args.get('duration_minutes') or 60))
+        busy, errors = await run_google_io(calendar_service.free_busy, time_min, time_max, args.get('attendees'))
+        slots = find_free_slots(busy, time_min, time_max, duration, max_results=int(args.get('max_results') or 5))
+
+        result = {
+            "status": "success",
+            "slots": [{"start": start.isoformat(), "end": end.isoformat()} for start, end in slots]
+        }
+        if errors:
+            # Calendarios sin acceso (por ejemplo, correos externos): no se tuvieron en cuenta
+            result["unavailable_calendars"] = errors
+        return result
+
+    @staticmethod
+    async def _update_appointment(args, telegram_id, calendar_service, db=None):
         start_dt = None
         if 'start_time' in args:
             start_dt = datetime.fromisoformat(args['start_time'].replace('Z', '+00:00'))
+            if start_dt.tzinfo is None:
+                start_dt = start_dt.replace(tzinfo=timezone.utc)
+
+            # Nuevo horario (1 hora, como en update_event): revisar choques sin contar el propio evento
+            if not args.get('ignore_conflicts'):
+                conflicts = await ToolExecutor._find_conflicts(
+                    telegram_id, calendar_service, start_dt, start_dt + timedelta(hours=1), db,
+                    exclude_event_id=args['event_id']
+                )
+                if conflicts:
+                    return ToolExecutor._conflict_result(conflicts)
         
-        event = calendar_service.update_event(args['event_id'], summary=args.get('summary'), start_time=start_dt)
+        event = await run_google_io(
+            calendar_service.update_event, args['event_id'], summary=args.get('summary'), start_time=start_dt
+        )
         
         # Actualizar DB
-        db = SessionLocal()
-        try:
-            appt = db.query(Appointment).filter(Appointment.event_id == args['event_id']).first()
+        async with _db_scope(db) as session:
+            appt = (await CalendarSync.load_rows(session, Appointment, [args['event_id']])).get(args['event_id'])
+            await CalendarSync.upsert_events(session, telegram_id, [event])
             if appt:
                 if 'summary' in args: appt.title = args['summary']
                 if start_dt: 
@@ -126,46 +277,39 @@ class ToolExecutor:
                     else:
                         start_dt = start_dt.astimezone(timezone.utc)
                     appt.start_time = start_dt.replace(tzinfo=None)
-                db.commit()
-        finally:
-            db.close()
+                    # Nueva fecha: los recordatorios vuelven a empezar
+                    reset_reminders(appt)
+                    refresh_next_reminder(appt, session)
             
         return {"status": "success", "event_id": event['id']}
 
     @staticmethod
-    async def _delete_appointment(args, calendar_service):
+    async def _delete_appointment(args, telegram_id, calendar_service, db=None):
         try:
-            calendar_service.delete_event(args['event_id'])
+            await run_google_io(calendar_service.delete_event, args['event_id'])
         except Exception as e:
             # Si falla en Google (excepto 404 manejado arriba), logueamos pero intentamos borrar en DB
             logger.warning(f"Error borrando en Google (procediendo con DB): {e}")
 
-        db = SessionLocal()
-        try:
-            db.query(Appointment).filter(Appointment.event_id == args['event_id']).delete()
-            db.commit()
-        finally:
-            db.close()
+        async with _db_scope(db) as session:
+            appt = (await CalendarSync.load_rows(session, Appointment, [args['event_id']])).get(args['event_id'])
+            if appt:
+                await CalendarSync.discard(session, appt)
+            await CalendarSync.remove_events(session, telegram_id, [args['event_id']])
         return {"status": "success"}
 
     @staticmethod
-    async def _delete_all_appointments(calendar_service, telegram_id):
+    async def _delete_all_appointments(calendar_service, telegram_id, db=None):
         try:
-            count = calendar_service.delete_all_events()
+            deleted_ids = await run_google_io(calendar_service.delete_all_events)
             
-            # Limpiar DB localmente para este usuario (citas futuras)
-            db = SessionLocal()
-            try:
-                now_utc = datetime.utcnow()
-                db.query(Appointment).filter(
-                    Appointment.telegram_id == telegram_id,
-                    Appointment.start_time >= now_utc
-                ).delete()
-                db.commit()
-            finally:
-                db.close()
+            # Quitar de la DB solo las citas que Google confirmó como eliminadas
+            async with _db_scope(db) as session:
+                for appt in (await CalendarSync.load_rows(session, Appointment, deleted_ids, telegram_id)).values():
+                    await CalendarSync.discard(session, appt)
+                await CalendarSync.remove_events(session, telegram_id, deleted_ids)
             
-            return {"status": "success", "message": f"Se han eliminado {count} citas correctamente."}
+            return {"status": "success", "message": f"Se han eliminado {len(deleted_ids)} citas correctamente."}
         except Exception as e:
             logger.error(f"Error en _delete_all_appointments: {e}")
             return {"status": "error", "message": str(e)}
@@ -185,7 +329,8 @@ class ToolExecutor:
             else:
                 to_str = str(to_list)
 
-            gmail_service.send_email(
+            await run_google_io(
+                gmail_service.send_email,
                 to=to_str,
                 subject=args['subject'],
                 body=args['body']
@@ -0,0 +1,68 @@
+import logging
+from datetime import datetime
+from src.database import AsyncSessionLocal
+from src.history_manager import HistoryManager
+
+logger = logging.getLogger(__name__)
+
+class TurnUnitOfWork:
+    """
+    Agrupa todas las escrituras de un turno de conversación en una transacción.
+
+    Los mensajes de historial se acumulan y se insertan en bloque al final; las
+    herramientas reciben la misma sesión (self.db, una AsyncSession) para sus
+    cambios en Appointment y la usan de a una por vez (database.session_lock).
+    Todo se confirma con un único commit, o se descarta si el turno falla a
+    mitad de camino.
+
+    Uso:
+        async with TurnUnitOfWork(user_id) as uow:
+            uow.add_message("user", text)
+            ...
+    """
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.db = AsyncSessionLocal()
+        self._records = []
+        self._messages = []
+
+    def add_message(self, role: str, content, tool_call_id: str = None, name: str = None):
+        """Registra un mensaje para el commit del turno y lo devuelve en formato de historial"""
+        self._records.append(
+            HistoryManager.build_record(self.user_id, role, content, tool_call_id, name, created_at=datetime.utcnow())
+        )
+        msg = HistoryManager._to_message(role, content, tool_call_id, name)
+        if msg is not None:
+            self._messages.append(msg)
+        return msg
+
+    async def commit(self):
+        self.db.add_all(self._records)
+        await self.db.commit()
+        # El cache solo se actualiza cuando los mensajes ya están en la DB
+        HistoryManager.cache_messages(self.user_id, self._messages)
+        self._records = []
+        self._messages = []
+
+    async def rollback(self):
+        await self.db.rollback()
+        self._records = []
+        self._messages = []
+
+    async def close(self):
+        await self.db.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                await self.commit()
+            else:
+                logger.warning(f"Turno de {self.user_id} fallido, descartando cambios: {exc_val}")
+                await self.rollback()
+        finally:
+            await self.close()
+        return False
@@ -0,0 +1,106 @@
+import asyncio
+import contextlib
+import logging
+import time
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+from src.config import UPDATE_WORKERS, UPDATE_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+
+class _ChatSlot:
+    """Cola de un chat: un lock FIFO y cuántos updates del chat están en vuelo"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Procesa updates de distintos usuarios en paralelo sobre un pool de workers,
+    pero serializa los updates de un mismo telegram_id en orden de llegada.
+
+    El semáforo de la clase base solo limita los updates admitidos (en espera o
+    en curso); el número de workers se controla con un semáforo propio que se
+    adquiere después del lock del chat, así un usuario que envía muchos mensajes
+    seguidos no ocupa workers mientras espera su turno.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, max_pending: int = UPDATE_MAX_PENDING):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.workers = workers
+        self._worker_slots = asyncio.Semaphore(workers)
+        self._chats = {}
+        self._pending = 0
+        self._active = 0
+        self._processed = 0
+        self._started = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @staticmethod
+    def _chat_key(update):
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user:
+            return str(update.effective_user.id)
+        if update.effective_chat:
+            return str(update.effective_chat.id)
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._chat_key(update)
+        slot = None
+        if key is not None:
+            slot = self._chats.setdefault(key, _ChatSlot())
+            slot.depth += 1
+
+        enqueued_at = time.monotonic()
+        self._pending += 1
+        started = False
+        try:
+            async with (slot.lock if slot else contextlib.nullcontext()):
+                async with self._worker_slots:
+                    self._pending -= 1
+                    started = True
+                    self._started += 1
+                    waited = time.monotonic() - enqueued_at
+                    self._wait_total += waited
+                    self._wait_max = max(self._wait_max, waited)
+
+                    self._active += 1
+                    try:
+                        await coroutine
+                    finally:
+                        self._active -= 1
+                        self._processed += 1
+        finally:
+            if not started:
+                # Cancelado mientras esperaba turno: la corrutina nunca se ejecutó
+                self._pending -= 1
+                coroutine.close()
+            if slot:
+                slot.depth -= 1
+                if slot.depth == 0:
+                    self._chats.pop(key, None)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self) -> dict:
+        """Profundidad de cola y tiempos de espera actuales"""
+        return {
+            "workers": self.workers,
+            "active": self._active,
+            "pending": self._pending,
+            "chats_in_flight": len(self._chats),
+            "max_chat_depth": max((s.depth for s in self._chats.values()), default=0),
+            "processed": self._processed,
+            "avg_wait_ms": round(self._wait_total / self._started * 1000, 2) if self._started else 0.0,
+            "max_wait_ms": round(self._wait_max * 1000, 2),
+        }
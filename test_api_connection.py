@@ -1,3 +1,4 @@
+import asyncio
 import os
 import sys
 from dotenv import load_dotenv
@@ -8,7 +9,8 @@ sys.path.append(os.getcwd())
 load_dotenv()
 
 from src.config import GEMINI_API_KEY
-from src.database import SessionLocal, init_db, UserAuth, USE_SQLITE, DATABASE_URL
+from sqlalchemy import func, select
+from src.database import AsyncSessionLocal, init_db, UserAuth, USE_SQLITE, DATABASE_URL
 import google.generativeai as genai
 
 
@@ -26,16 +28,20 @@ def test_gemini():
         return False
 
 
+async def _count_users():
+    # Mismo engine asíncrono (aiosqlite / asyncpg) que usa el bot
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(func.count(UserAuth.id)))
+
+
 def test_db():
     print(f"\n--- Testing Database Connection ---")
     print(f"DATABASE_URL: {DATABASE_URL}")
     print(f"USE_SQLITE: {USE_SQLITE}")
     try:
         init_db()
-        db = SessionLocal()
-        count = db.query(UserAuth).count()
+        count = asyncio.run(_count_users())
         print(f"Database Success: Found {count} authenticated users.")
-        db.close()
         return True
     except Exception as e:
         print(f"Database Error: {e}")
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from src.ai import AIService
 import os
@@ -17,12 +18,12 @@ def test_multilingual():
     
     print("Probando respuesta en inglés...")
     messages_en = [{"role": "user", "content": "Hello, I want to see my appointments for today."}]
-    response_en = ai.get_agent_response(messages_en, [])
+    response_en = asyncio.run(ai.get_agent_response(messages_en, []))
     print(f"Respuesta (EN): {response_en.content}")
     
     print("\nProbando respuesta en español...")
     messages_es = [{"role": "user", "content": "Hola, ¿qué eventos tengo hoy?"}]
-    response_es = ai.get_agent_response(messages_es, [])
+    response_es = asyncio.run(ai.get_agent_response(messages_es, []))
     print(f"Respuesta (ES): {response_es.content}")
 
 if __name__ == "__main__":
@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Lotes pequeños para que los procesos compitan por las mismas filas
+os.environ["REMINDER_BATCH_SIZE"] = "25"
+
+WORKERS = 4
+USERS = 150
+APPOINTMENTS_PER_USER = 4
+
+
+class FakeBot:
+    """Registra los mensajes en lugar de enviarlos a Telegram"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        await asyncio.sleep(0.001)
+        self.sent.append((chat_id, text))
+
+
+def _bind(db_path):
+    from sqlalchemy import create_engine
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import NullPool
+    from src.database import SessionLocal, AsyncSessionLocal
+
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"timeout": 30})
+    SessionLocal.configure(bind=engine)
+    # Sin pool: cada pasada del scheduler corre en su propio event loop (asyncio.run)
+    AsyncSessionLocal.configure(bind=create_async_engine(
+        f"sqlite+aiosqlite:///{db_path}", connect_args={"timeout": 30}, poolclass=NullPool
+    ))
+    return engine
+
+
+def _seed(db_path):
+    from src.database import Base, SessionLocal, Appointment
+    from src.reminders import compute_next_reminder_at
+
+    engine = _bind(db_path)
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    now = datetime.utcnow()
+    for user in range(USERS):
+        for n in range(APPOINTMENTS_PER_USER):
+            start = now + timedelta(minutes=30 + n)
+            appt = Appointment(
+                telegram_id=str(user), event_id=f"ev-{user}-{n}", title=f"appt-{user}-{n}",
+                start_time=start, end_time=start + timedelta(hours=1),
+                rem_24h_sent=False, rem_3h_sent=False, rem_1h_sent=False, rem_15m_sent=False
+            )
+            appt.next_reminder_at = compute_next_reminder_at(appt)
+            db.add(appt)
+    db.commit()
+    db.close()
+
+
+def _worker(db_path, start_event, results):
+    from src.rate_limiter import TelegramRateLimiter
+    from src.scheduler import SchedulerService
+
+    _bind(db_path)
+    bot = FakeBot()
+    service = SchedulerService(bot)
+    service.rate_limiter = TelegramRateLimiter(global_rate=1e6, per_chat_rate=1e6)
+
+    start_event.wait()
+    # Varias pasadas: cada una reclama lo que queda libre
+    for _ in range(10):
+        asyncio.run(service.check_reminders())
+        time.sleep(0.01)
+    results.put(bot.sent)
+
+
+def _run_claims():
+    """Corre los procesos y verifica la entrega; devuelve (mensajes, recordatorios entregados)"""
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "claims.db")
+        _seed(db_path)
+
+        start_event = ctx.Event()
+        results = ctx.Queue()
+        procs = [ctx.Process(target=_worker, args=(db_path, start_event, results)) for _ in range(WORKERS)]
+        for p in procs:
+            p.start()
+        start_event.set()
+        sent = []
+        for _ in procs:
+            sent.extend(results.get(timeout=120))
+        for p in procs:
+            p.join(timeout=30)
+
+        delivered = {}
+        for chat_id, text in sent:
+            for title in re.findall(r"'(appt-\d+-\d+)'", text):
+                assert title.startswith(f"appt-{chat_id}-"), f"{title} enviado al chat equivocado {chat_id}"
+                delivered[title] = delivered.get(title, 0) + 1
+
+        expected = {f"appt-{u}-{n}" for u in range(USERS) for n in range(APPOINTMENTS_PER_USER)}
+        duplicates = {t: c for t, c in delivered.items() if c > 1}
+        assert not duplicates, f"Recordatorios duplicados: {duplicates}"
+        assert set(delivered) == expected, f"Faltan {len(expected - set(delivered))} recordatorios"
+
+        from src.database import SessionLocal, Appointment
+        _bind(db_path)
+        db = SessionLocal()
+        try:
+            assert db.query(Appointment).filter(Appointment.rem_1h_sent.isnot(True)).count() == 0
+            assert db.query(Appointment).filter(Appointment.lease_owner.isnot(None)).count() == 0
+        finally:
+            db.close()
+        return len(sent), len(delivered)
+
+
+def test_reminders_delivered_exactly_once_across_processes():
+    messages, reminders = _run_claims()
+    assert reminders == USERS * APPOINTMENTS_PER_USER
+    # Cada mensaje agrupa al menos un recordatorio del usuario
+    assert 0 < messages <= reminders
+
+
+if __name__ == "__main__":
+    messages, reminders = _run_claims()
+    print(f"✅ {reminders} recordatorios entregados exactamente una vez en {messages} mensajes ({WORKERS} procesos).")
@@ -0,0 +1,90 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+import pytest
+from google.genai import errors as genai_errors
+from google.genai import types
+
+import src.ai as ai_module
+from src.ai import AIService
+
+
+def _chunk(text):
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+    )
+
+
+def _cache_error():
+    return genai_errors.APIError(404, {"error": {"code": 404, "message": "CachedContent not found", "status": "NOT_FOUND"}})
+
+
+class FakeCaches:
+    async def create(self, model, config=None):
+        return types.CachedContent(name="cachedContents/test")
+
+    async def update(self, name, config=None):
+        return types.CachedContent(name=name)
+
+    async def delete(self, name, config=None):
+        pass
+
+
+class FakeModels:
+    """El stream con cache entrega 'cached_chunks' y después falla; el inline responde 'Hola'"""
+
+    def __init__(self, cached_chunks):
+        self.cached_chunks = cached_chunks
+        self.calls = []
+
+    async def generate_content_stream(self, model, contents, config=None):
+        cached = config.cached_content is not None
+        self.calls.append("cache" if cached else "inline")
+
+        async def stream():
+            if cached:
+                for text in self.cached_chunks:
+                    yield _chunk(text)
+                raise _cache_error()
+            yield _chunk("Hola")
+
+        return stream()
+
+
+def _run(cached_chunks):
+    models = FakeModels(cached_chunks)
+    ai_module.client = type("Client", (), {"aio": type("Aio", (), {"models": models, "caches": FakeCaches()})()})()
+    service = AIService(timeout=5)
+    service._context_cache.enabled = True
+    pushed = []
+
+    async def go():
+        try:
+            return await service.stream_agent_response(
+                [{"role": "user", "content": "hola"}], [], on_text=pushed.append
+            )
+        finally:
+            await service.close()
+
+    return models, pushed, go
+
+
+def test_cache_rejected_before_first_chunk_retries_inline():
+    models, pushed, go = _run([])
+    reply = asyncio.run(go())
+    assert models.calls == ["cache", "inline"]
+    assert reply.content == "Hola"
+    assert pushed == ["Hola"]
+
+
+def test_cache_rejected_mid_stream_does_not_retry():
+    models, pushed, go = _run(["Parcial"])
+    with pytest.raises(genai_errors.APIError):
+        asyncio.run(go())
+    # Sin reintento: el texto ya enviado no se duplica ni se mezcla con otra respuesta
+    assert models.calls == ["cache"]
+    assert pushed == ["Parcial"]